@@ -1,13 +1,64 @@
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils.html import format_html
+from common.jobs import start_job
+from common.key_frames import KeyFrameRuleForm, assign_key_frames_job
+from common.metadata import update_metadata_facets_on_commit
 
 from .models import *
 
+
+class TaskAdmin(admin.ModelAdmin):
+    actions = ['select_key_frames']
+
+    def select_key_frames(self, request, queryset):
+        """
+        Select the key frames of every sequence of the selected tasks from a rule, after choosing the rule
+        and its options on an intermediate page
+        """
+        form = KeyFrameRuleForm(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            for task in queryset:
+                job = start_job('Select key frames of task ' + task.name, assign_key_frames_job, task.id, request.user.id,
+                                form.cleaned_data['rule'], form.get_options())
+                self.message_user(request, format_html('Selecting key frames of {} in the background: <a href="{}">progress</a>',
+                                                       task.name, reverse('job', args=[job.id])))
+            return None
+
+        return render(request, 'admin/annotationweb/task/select_key_frames.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Select key frames',
+            'opts': self.model._meta,
+            'tasks': queryset,
+            'form': form,
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
+    select_key_frames.short_description = 'Select the key frames of every sequence from a rule'
+
+
+class ImageMetadataAdmin(admin.ModelAdmin):
+    # Deleting metadata sends no signal which updates the metadata facets, see common.metadata
+
+    def delete_model(self, request, obj):
+        dataset_ids = ImageSequence.objects.filter(id=obj.image_id).values_list('subject__dataset_id', flat=True)
+        update_metadata_facets_on_commit(list(dataset_ids))
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        dataset_ids = queryset.values_list('image__subject__dataset_id', flat=True).distinct()
+        update_metadata_facets_on_commit(list(dataset_ids))
+        super().delete_queryset(request, queryset)
+
+
 # Register your models here.
 admin.site.register(Dataset)
 admin.site.register(Subject)
-admin.site.register(Task)
+admin.site.register(Task, TaskAdmin)
 admin.site.register(Label)
 admin.site.register(ImageSequence)
 admin.site.register(KeyFrameAnnotation)
 admin.site.register(ImageAnnotation)
-admin.site.register(ImageMetadata)
+admin.site.register(ImageMetadata, ImageMetadataAdmin)
+admin.site.register(Job)
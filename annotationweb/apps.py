@@ -3,3 +3,14 @@ from django.apps import AppConfig
 
 class AnnotationwebConfig(AppConfig):
     name = 'annotationweb'
+
+    def ready(self):
+        # Connect signal receivers
+        import common.label
+        import common.metadata
+
+        # Build the registries of importers and exporters once, instead of for each request
+        from common.importer import load_importers
+        from common.exporter import load_exporters
+        load_importers()
+        load_exporters()
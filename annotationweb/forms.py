@@ -68,7 +68,7 @@ class ImageListForm(forms.Form):
         widget=forms.SelectMultiple(attrs={'onchange': 'this.form.submit();'})
     )
 
-    def __init__(self, subjects, users, metadata, data=None, labels=None, initial=None):
+    def __init__(self, subjects, users, metadata, data=None, labels=None, initial=None, numeric_metadata=None):
         super().__init__(data, initial=initial)
 
         if labels is not None:
@@ -103,3 +103,13 @@ class ImageListForm(forms.Form):
                 widget=forms.SelectMultiple(attrs={'onchange': 'this.form.submit();'})
             )
 
+        if numeric_metadata:
+            self.fields['metadata_range_name'] = forms.ChoiceField(
+                label='Metadata range',
+                required=False,
+                choices=[('', '---------')] + [(name, name) for name in numeric_metadata],
+                widget=forms.Select(attrs={'onchange': 'this.form.submit();'})
+            )
+            self.fields['metadata_min'] = forms.FloatField(label='Minimum', required=False)
+            self.fields['metadata_max'] = forms.FloatField(label='Maximum', required=False)
+
@@ -0,0 +1,48 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from annotationweb.models import Task
+from common.key_frames import RULES, RULE_EVERY_NTH, RULE_CSV, RULE_METADATA, get_rule, assign_key_frames
+
+
+class Command(BaseCommand):
+    help = 'Select the key frames of all image sequences of a task from a rule. ' \
+           'Sequences which get no frames from a CSV file or metadata keep their key frames.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('task_id', type=int)
+        parser.add_argument('rule', choices=RULES)
+        parser.add_argument('--n', type=int, help='Select every Nth frame, for the every-nth rule')
+        parser.add_argument('--csv', help='CSV file with rows of sequence id or format followed by frame numbers, for the csv rule')
+        parser.add_argument('--metadata', help='Name of the metadata with the frame numbers, for the metadata rule')
+        parser.add_argument('--user', required=True, help='Username of the user new image annotations are created for')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Number of image sequences per transaction')
+
+    def handle(self, *args, **options):
+        rule = options['rule']
+        for option, required_rule in (('n', RULE_EVERY_NTH), ('csv', RULE_CSV), ('metadata', RULE_METADATA)):
+            if rule == required_rule and options[option] is None:
+                raise CommandError('--' + option + ' is required for the ' + rule + ' rule')
+
+        try:
+            task = Task.objects.get(pk=options['task_id'], deleted=False)
+            user = User.objects.get(username=options['user'])
+        except Task.DoesNotExist:
+            raise CommandError('Task does not exist')
+        except User.DoesNotExist:
+            raise CommandError('User does not exist')
+
+        start = time.perf_counter()
+        chunks_done = []
+        try:
+            get_frames = get_rule(task, rule, n=options['n'], csv_filename=options['csv'], metadata_name=options['metadata'],
+                                  report=self.stderr.write)
+            created, deleted = assign_key_frames(task, user, get_frames, options['chunk_size'],
+                                                 progress=chunks_done.append)
+        except (OSError, ValueError) as e:
+            # Each chunk is committed by itself
+            raise CommandError('{}. Stopped after {} image sequences, the key frames of these sequences have been changed.'
+                               .format(e, sum(chunks_done)))
+
+        self.stdout.write('{} key frames were created and {} key frames were deleted in {:.1f} s'.format(
+            created, deleted, time.perf_counter() - start))
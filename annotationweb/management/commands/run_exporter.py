@@ -0,0 +1,48 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from annotationweb.models import Task
+from common.exporter import find_all_exporters
+from common.plugins import find_plugin, get_form_data, read_form_spec
+
+
+class Command(BaseCommand):
+    help = 'Run an exporter of a task without the web interface, e.g. a nightly export from cron. The form of the ' \
+           'exporter is filled from a JSON file and name=value arguments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('task_id', type=int)
+        parser.add_argument('exporter', help='Class name, name or index of the exporter')
+        parser.add_argument('--spec', help='JSON file with an object of form field name -> value')
+        parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                            help='Value of a form field, can be given several times for fields with multiple values')
+        parser.add_argument('--workers', type=int, help='Number of worker processes, for exporters which support it')
+
+    def handle(self, *args, **options):
+        try:
+            task = Task.objects.get(pk=options['task_id'], deleted=False)
+        except Task.DoesNotExist:
+            raise CommandError('Task does not exist')
+
+        exporters = find_all_exporters(task.type)
+        exporter_class = find_plugin(exporters, options['exporter'])
+        if exporter_class is None:
+            raise CommandError('Exporter not found, available exporters for this task: ' +
+                               ', '.join('{} ({})'.format(exporter.__name__, exporter.name) for exporter in exporters))
+
+        exporter = exporter_class()
+        exporter.task = task
+        if options['workers'] is not None:
+            exporter.workers = options['workers']
+        try:
+            spec = read_form_spec(options['spec']) if options['spec'] is not None else None
+            form = exporter.get_form(data=get_form_data(spec, options['set']))
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        if not form.is_valid():
+            raise CommandError('Invalid exporter options:\n' + form.errors.as_text())
+
+        start = time.perf_counter()
+        success, message = exporter.export(form)
+        if not success:
+            raise CommandError('Export failed: ' + message)
+        self.stdout.write('Export finished in {:.1f} s: {}'.format(time.perf_counter() - start, message))
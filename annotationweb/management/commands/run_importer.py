@@ -0,0 +1,53 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from annotationweb.models import Dataset, Job
+from common.importer import find_all_importers, import_in_background
+from common.jobs import run_job, get_process_name
+from common.plugins import find_plugin, get_form_data, read_form_spec
+
+
+class Command(BaseCommand):
+    help = 'Run an importer without the web interface, e.g. from cron. The form of the importer is filled from a JSON ' \
+           'file and name=value arguments. The import is run as a job, which can be followed and cancelled on the jobs page.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('importer', help='Class name, name or index of the importer')
+        parser.add_argument('--dataset', type=int, required=True, help='Id of the dataset to import to')
+        parser.add_argument('--spec', help='JSON file with an object of form field name -> value')
+        parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                            help='Value of a form field, can be given several times for fields with multiple values')
+        parser.add_argument('--workers', type=int, help='Number of parallel workers, for importers which support it')
+
+    def handle(self, *args, **options):
+        importers = find_all_importers()
+        importer_class = find_plugin(importers, options['importer'])
+        if importer_class is None:
+            raise CommandError('Importer not found, available importers: ' +
+                               ', '.join('{} ({})'.format(importer.__name__, importer.name) for importer in importers))
+        try:
+            dataset = Dataset.objects.get(pk=options['dataset'], deleted=False)
+        except Dataset.DoesNotExist:
+            raise CommandError('Dataset does not exist')
+
+        importer = importer_class()
+        importer.dataset = dataset
+        if options['workers'] is not None:
+            importer.workers = options['workers']
+        try:
+            spec = read_form_spec(options['spec']) if options['spec'] is not None else None
+            form = importer.get_form(data=get_form_data(spec, options['set']))
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        if not form.is_valid():
+            raise CommandError('Invalid importer options:\n' + form.errors.as_text())
+
+        start = time.perf_counter()
+        # Created as running, so that the job is not claimed by run_jobs
+        job = Job.objects.create(name='Import ' + importer.name + ' to ' + dataset.name, status=Job.STATUS_RUNNING,
+                                 process=get_process_name())
+        run_job(job, import_in_background, importer, form)
+        job.refresh_from_db()
+        self.stdout.write(job.message)
+        if job.status != Job.STATUS_FINISHED:
+            raise CommandError('Import ' + job.status + ' after {:.1f} s'.format(time.perf_counter() - start))
+        self.stdout.write('Import finished in {:.1f} s'.format(time.perf_counter() - start))
@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from common.jobs import claim_job, run_queued_job
+
+
+class Command(BaseCommand):
+    help = 'Run the jobs queued by the web server, e.g. imports, deletes and copies of tasks. ' \
+           'Several of these commands can be run at the same time to run jobs in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=2, help='Seconds to wait before looking for new jobs')
+        parser.add_argument('--once', action='store_true', help='Run the queued jobs and stop, instead of waiting for new jobs')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            job = claim_job()
+            if job is not None:
+                self.stdout.write('Running job {}: {}'.format(job.id, job.name))
+                run_queued_job(job)
+                self.stdout.write('Job {} {}'.format(job.id, job.status))
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['interval'])
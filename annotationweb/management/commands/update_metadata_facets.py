@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from annotationweb.models import Dataset
+from common.metadata import update_metadata_facets
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the metadata facets of datasets, e.g. after ImageMetadata was changed with queryset updates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset_id', type=int, nargs='*', help='Ids of the datasets, all datasets if not given')
+
+    def handle(self, *args, **options):
+        datasets = Dataset.objects.filter(deleted=False).order_by('id')
+        if len(options['dataset_id']) > 0:
+            datasets = datasets.filter(id__in=options['dataset_id'])
+            if datasets.count() != len(set(options['dataset_id'])):
+                raise CommandError('Dataset does not exist')
+
+        for dataset in datasets:
+            update_metadata_facets(dataset)
+            self.stdout.write('Updated the metadata facets of ' + dataset.name)
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0007_auto_20230202_1054'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='imageannotation',
+            index=models.Index(fields=['task', 'finished', 'date'], name='annotationw_task_id_b573d5_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:16
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_annotations(apps, schema_editor):
+    """
+    Merge image annotations of the same task and image into the one saved last, so that the unique constraint can be added.
+    The key frames of the other annotations are moved to it.
+    """
+    ImageAnnotation = apps.get_model('annotationweb', 'ImageAnnotation')
+    KeyFrameAnnotation = apps.get_model('annotationweb', 'KeyFrameAnnotation')
+    duplicates = ImageAnnotation.objects.values('task_id', 'image_id').annotate(count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        ids = list(ImageAnnotation.objects.filter(task_id=duplicate['task_id'], image_id=duplicate['image_id'])
+                   .order_by('-date', '-id').values_list('id', flat=True))
+        KeyFrameAnnotation.objects.filter(image_annotation_id__in=ids[1:]).update(image_annotation_id=ids[0])
+        ImageAnnotation.objects.filter(id__in=ids[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0008_auto_20261019_0616'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='imagemetadata',
+            index=models.Index(fields=['name', 'value'], name='annotationw_name_aef4ae_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imagesequence',
+            index=models.Index(fields=['subject', 'format'], name='annotationw_subject_19ccf8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='keyframeannotation',
+            index=models.Index(fields=['image_annotation', 'frame_nr'], name='annotationw_image_a_350bd7_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_annotations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='imageannotation',
+            constraint=models.UniqueConstraint(fields=('task', 'image'), name='unique_task_image'),
+        ),
+    ]
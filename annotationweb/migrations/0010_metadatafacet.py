@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+from itertools import groupby
+import numpy as np
+
+
+def create_metadata_facets(apps, schema_editor):
+    Dataset = apps.get_model('annotationweb', 'Dataset')
+    ImageMetadata = apps.get_model('annotationweb', 'ImageMetadata')
+    MetadataFacet = apps.get_model('annotationweb', 'MetadataFacet')
+    for dataset in Dataset.objects.all():
+        rows = ImageMetadata.objects.filter(image__subject__dataset=dataset)\
+            .order_by('name', 'value', 'image_id')\
+            .values_list('name', 'value', 'image_id')
+        facets = []
+        for (name, value), group in groupby(rows, key=lambda row: (row[0], row[1])):
+            image_ids = np.unique(np.asarray([row[2] for row in group], dtype=np.uint32)).tobytes()
+            facets.append(MetadataFacet(dataset=dataset, name=name, value=value, image_ids=image_ids))
+        MetadataFacet.objects.bulk_create(facets)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0009_auto_20261019_0616'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetadataFacet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('value', models.CharField(max_length=256)),
+                ('image_ids', models.BinaryField()),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='annotationweb.Dataset')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='metadatafacet',
+            index=models.Index(fields=['dataset', 'name', 'value'], name='annotationw_dataset_b41f15_idx'),
+        ),
+        migrations.RunPython(create_metadata_facets, migrations.RunPython.noop),
+    ]
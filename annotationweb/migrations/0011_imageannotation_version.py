@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0010_metadatafacet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageannotation',
+            name='version',
+            field=models.PositiveIntegerField(default=0, help_text='Incremented on every save, used to detect concurrent changes'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0012_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='deleted',
+            field=models.BooleanField(default=False, help_text='Hidden while being deleted in the background'),
+        ),
+        migrations.AddField(
+            model_name='imagesequence',
+            name='deleted',
+            field=models.BooleanField(default=False, help_text='Hidden while being deleted in the background'),
+        ),
+        migrations.AddField(
+            model_name='subject',
+            name='deleted',
+            field=models.BooleanField(default=False, help_text='Hidden while being deleted in the background'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='deleted',
+            field=models.BooleanField(default=False, help_text='Hidden while being deleted in the background'),
+        ),
+    ]
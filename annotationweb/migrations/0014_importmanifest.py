@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0013_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportManifest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024)),
+                ('modified', models.BigIntegerField(help_text='Modification time of the folder in nanoseconds')),
+                ('nr_of_frames', models.PositiveIntegerField(default=0)),
+                ('format', models.CharField(blank=True, default='', help_text='Empty if the folder has no image sequence', max_length=1024)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='annotationweb.Dataset')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='importmanifest',
+            index=models.Index(fields=['dataset', 'path'], name='annotationw_dataset_71b4bf_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0014_importmanifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importmanifest',
+            name='start_frame_nr',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
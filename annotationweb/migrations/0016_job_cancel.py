@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0015_importmanifest_start_frame_nr'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='cancel',
+            field=models.BooleanField(default=False, help_text='Set to ask the job to stop, jobs which support it check this between steps'),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='queued', max_length=50),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0016_job_cancel'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imagesequence',
+            name='format',
+            field=models.CharField(help_text='Should contain # which will be replaced with an integer, increasing with 1 for each frame. E.g. /path/to/frame_#.png. Or a single file with all frames: 3D .mhd, multi-page .tif or .h5', max_length=1024),
+        ),
+    ]
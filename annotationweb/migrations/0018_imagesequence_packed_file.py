@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0017_imagesequence_container_format'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagesequence',
+            name='packed_file',
+            field=models.CharField(blank=True, default='', help_text='Packed store with all frames in one .npy file, frames are read from this file if set', max_length=1024),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:49
+
+from django.db import migrations, models
+import math
+
+
+def parse_numbers(apps, schema_editor):
+    ImageMetadata = apps.get_model('annotationweb', 'ImageMetadata')
+    changed = []
+    for metadata in ImageMetadata.objects.only('id', 'value').iterator():
+        try:
+            number = float(metadata.value)
+        except ValueError:
+            continue
+        if math.isfinite(number):
+            metadata.number = number
+            changed.append(metadata)
+    ImageMetadata.objects.bulk_update(changed, ['number'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0018_imagesequence_packed_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagemetadata',
+            name='number',
+            field=models.FloatField(blank=True, help_text='The value as a number, if it is numeric', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='imagemetadata',
+            index=models.Index(fields=['name', 'number'], name='annotationw_name_7dec0e_idx'),
+        ),
+        migrations.RunPython(parse_numbers, migrations.RunPython.noop),
+    ]
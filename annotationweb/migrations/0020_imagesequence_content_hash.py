@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0019_imagemetadata_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagesequence',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', help_text='Hash of the content of the frames, used to find sequences which are stored twice', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='imagesequence',
+            index=models.Index(fields=['content_hash'], name='annotationw_content_39d8c6_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 2.2.28 on 2026-10-19 05:00
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_key_frames(apps, schema_editor):
+    """
+    Merge key frames with the same image annotation and frame number into the first one, so that the unique
+    constraint can be added. The boxes, landmarks, control points etc. of the other key frames are moved to it,
+    except for one-to-one relations such as classification labels where the first key frame already has one.
+    """
+    KeyFrameAnnotation = apps.get_model('annotationweb', 'KeyFrameAnnotation')
+    relations = [(model, field) for model in apps.get_models() for field in model._meta.fields
+                 if field.is_relation and field.related_model == KeyFrameAnnotation]
+
+    duplicates = KeyFrameAnnotation.objects.values('image_annotation_id', 'frame_nr').annotate(count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        ids = list(KeyFrameAnnotation.objects.filter(image_annotation_id=duplicate['image_annotation_id'],
+                                                     frame_nr=duplicate['frame_nr']).order_by('id').values_list('id', flat=True))
+        for model, field in relations:
+            others = model.objects.filter(**{field.attname + '__in': ids[1:]})
+            if field.unique:
+                if model.objects.filter(**{field.attname: ids[0]}).exists():
+                    others.delete()
+                    continue
+                # Keep only one of them
+                first = others.order_by('pk').first()
+                others.exclude(pk=getattr(first, 'pk', None)).delete()
+            others.update(**{field.attname: ids[0]})
+        KeyFrameAnnotation.objects.filter(id__in=ids[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0020_imagesequence_content_hash'),
+        # Models with key frames, which are merged
+        ('boundingbox', '0001_initial'),
+        ('classification', '0002_auto_20200114_1514'),
+        ('landmark', '0001_initial'),
+        ('spline_segmentation', '0003_contour'),
+        ('image_quality', '0002_category_default_rank'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_key_frames, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='keyframeannotation',
+            constraint=models.UniqueConstraint(fields=('image_annotation', 'frame_nr'), name='unique_image_annotation_frame_nr'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 05:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0021_keyframeannotation_unique_frame'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='process',
+            field=models.CharField(blank=True, default='', help_text='Host and process id of the process which runs the job', max_length=255),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-19 05:16
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0022_job_process'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='keyframeannotation',
+            name='annotationw_image_a_350bd7_idx',
+        ),
+    ]
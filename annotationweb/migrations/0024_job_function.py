@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-19 05:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0023_remove_keyframeannotation_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='arguments',
+            field=models.TextField(default='[]', help_text='JSON list of the arguments given to the function after the job'),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='function',
+            field=models.CharField(blank=True, default='', help_text='Dotted path of the function run by the job', max_length=255),
+        ),
+    ]
@@ -4,6 +4,7 @@ from django.contrib.auth.models import User
 
 class Dataset(models.Model):
     name = models.CharField(max_length=200)
+    deleted = models.BooleanField(default=False, help_text='Hidden while being deleted in the background')
 
     def __str__(self):
         return self.name
@@ -15,6 +16,7 @@ class Dataset(models.Model):
 class Subject(models.Model):
     name = models.CharField(max_length=200, help_text='Use anonymized id')
     dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE)
+    deleted = models.BooleanField(default=False, help_text='Hidden while being deleted in the background')
 
     def __str__(self):
         return self.dataset.name + ' - ' + self.name
@@ -77,6 +79,7 @@ class Task(models.Model):
     description = models.TextField(default='', blank=True)
     large_image_layout = models.BooleanField(default=False, help_text='Use a large image layout for annotation')
     post_processing_method = models.CharField(default='', help_text='Name of post processing method to use', max_length=255, blank=True)
+    deleted = models.BooleanField(default=False, help_text='Hidden while being deleted in the background')
 
     def __str__(self):
         return self.name
@@ -106,14 +109,30 @@ class Task(models.Model):
 
 class ImageSequence(models.Model):
     format = models.CharField(max_length=1024, help_text='Should contain # which will be replaced with an integer, '
-                                                         'increasing with 1 for each frame. E.g. /path/to/frame_#.png')
+                                                         'increasing with 1 for each frame. E.g. /path/to/frame_#.png. '
+                                                         'Or a single file with all frames: 3D .mhd, multi-page .tif or .h5')
     subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
     nr_of_frames = models.PositiveIntegerField()
     start_frame_nr = models.PositiveIntegerField(default=0)
+    deleted = models.BooleanField(default=False, help_text='Hidden while being deleted in the background')
+    packed_file = models.CharField(max_length=1024, default='', blank=True,
+                                   help_text='Packed store with all frames in one .npy file, frames are read from this file if set')
+    content_hash = models.CharField(max_length=64, default='', blank=True,
+                                    help_text='Hash of the content of the frames, used to find sequences which are stored twice')
+
+    # Content hash of a sequence whose frames could not be read when it was hashed, it is not hashed again
+    # until its frames change
+    HASH_UNREADABLE = 'unreadable'
 
     def __str__(self):
         return self.format
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['subject', 'format']),
+            models.Index(fields=['content_hash']),
+        ]
+
 
 class ImageAnnotation(models.Model):
     """
@@ -137,6 +156,16 @@ class ImageAnnotation(models.Model):
     comments = models.TextField()
     rejected = models.BooleanField()
     finished = models.BooleanField(default=True)
+    version = models.PositiveIntegerField(default=0, help_text='Incremented on every save, used to detect concurrent changes')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'image'], name='unique_task_image'),
+        ]
+        indexes = [
+            # Also used for previous/next navigation in the image list, which is sorted on date
+            models.Index(fields=['task', 'finished', 'date']),
+        ]
 
 
 class KeyFrameAnnotation(models.Model):
@@ -151,12 +180,129 @@ class KeyFrameAnnotation(models.Model):
     def __str__(self):
         return str(self.frame_nr)
 
+    class Meta:
+        constraints = [
+            # Also the index used to find the key frames of an annotation
+            models.UniqueConstraint(fields=['image_annotation', 'frame_nr'], name='unique_image_annotation_frame_nr'),
+        ]
+
 
 # Used to attach metadata to images, such as acquisition parameters
 class ImageMetadata(models.Model):
     image = models.ForeignKey(ImageSequence, on_delete=models.CASCADE)
     name = models.CharField(max_length=50)
     value = models.CharField(max_length=256)
+    number = models.FloatField(null=True, blank=True, help_text='The value as a number, if it is numeric')
 
     def __str__(self):
         return self.name + ': ' + self.value
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'value']),
+            models.Index(fields=['name', 'number']),
+        ]
+
+
+
+class MetadataFacet(models.Model):
+    """
+    Materialized index of the image metadata of a dataset, used for the metadata choices of image lists and
+    to find image sequences with metadata in memory.
+    Stores the ids of all image sequences with a given metadata name and value as a sorted uint32 array.
+    Updated with common.metadata.update_metadata_facets, when ImageMetadata is saved and when it is deleted in the admin.
+    """
+
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE)
+    name = models.CharField(max_length=50)
+    value = models.CharField(max_length=256)
+    image_ids = models.BinaryField()
+
+    def __str__(self):
+        return self.name + ': ' + self.value
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dataset', 'name', 'value']),
+        ]
+
+
+class ImportManifest(models.Model):
+    """
+    A folder scanned by the image sequence importer, with its modification time when it was scanned.
+    Used to skip folders which have not changed when a dataset is imported again.
+    """
+
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE)
+    path = models.CharField(max_length=1024)
+    modified = models.BigIntegerField(help_text='Modification time of the folder in nanoseconds')
+    start_frame_nr = models.PositiveIntegerField(default=0)
+    nr_of_frames = models.PositiveIntegerField(default=0)
+    format = models.CharField(max_length=1024, default='', blank=True, help_text='Empty if the folder has no image sequence')
+
+    def __str__(self):
+        return self.path
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dataset', 'path']),
+        ]
+
+
+class Job(models.Model):
+    """
+    A long running operation, such as copying a task, which is queued with common.jobs.start_job
+    and run in the background by the run_jobs management command
+    """
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_FINISHED = 'finished'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_FINISHED, 'Finished'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_CANCELLED, 'Cancelled'),
+    )
+
+    name = models.CharField(max_length=255)
+    status = models.CharField(max_length=50, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    message = models.TextField(default='', blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    cancel = models.BooleanField(default=False, help_text='Set to ask the job to stop, jobs which support it check this between steps')
+    process = models.CharField(max_length=255, default='', blank=True, help_text='Host and process id of the process which runs the job')
+    function = models.CharField(max_length=255, default='', blank=True, help_text='Dotted path of the function run by the job')
+    arguments = models.TextField(default='[]', help_text='JSON list of the arguments given to the function after the job')
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def is_active(self):
+        return self.status in (Job.STATUS_QUEUED, Job.STATUS_RUNNING)
+
+    @property
+    def percentage_finished(self):
+        if self.total == 0:
+            return 0
+        else:
+            return round(self.progress*100 / self.total, 1)
+
+    def set_progress(self, progress, total=None):
+        self.progress = progress
+        if total is not None:
+            self.total = total
+        Job.objects.filter(id=self.id).update(progress=self.progress, total=self.total)
+
+    def add_message(self, message):
+        self.message += message + '\n'
+        Job.objects.filter(id=self.id).update(message=self.message)
+
+    def is_cancelled(self):
+        return Job.objects.filter(id=self.id, cancel=True).exists()
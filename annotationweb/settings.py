@@ -99,6 +99,18 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# Label trees are cached, and invalidated when labels are changed. The local memory cache is only invalidated in the
+# process which changed the labels, thus when the site is served by several processes, use a shared backend instead,
+# such as django.core.cache.backends.db.DatabaseCache (run python manage.py createcachetable) or memcached.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
@@ -22,6 +22,10 @@ var g_targetFrames = []; // Frames to annotate
 var g_currentTargetFrameIndex = -1; // Index of current target frame (g_targetFrames), -1 if not on target frame
 var g_shiftKeyPressed = false;
 var g_userFrameSelection = false;
+var g_annotationVersion = 0; // Version of the stored annotation, used to detect changes by others when autosaving
+var g_autosaveSnapshot = {}; // JSON of each object of each frame as it was last saved
+var g_autosaveTimer = null;
+var g_autosaveInProgress = false;
 
 function max(a, b) {
     return a > b ? a : b;
@@ -83,6 +87,7 @@ function goToFrame(frameNr) {
 }
 
 function save() {
+    disableAutosave();
     var messageBox = document.getElementById("message");
     messageBox.innerHTML = '<span class="info">Please wait while saving..</span>';
     sendDataForSave().done(function(data) {
@@ -114,6 +119,120 @@ function save() {
     console.log("Save function executed");
 }
 
+// Periodically send the objects which have changed since the last autosave.
+// getAnnotation must return a dictionary of frame_nr -> object -> object data, e.g. g_controlPoints
+function enableAutosave(url, version, getAnnotation) {
+    g_annotationVersion = version;
+    g_autosaveSnapshot = createAutosaveSnapshot(getAnnotation());
+    g_autosaveTimer = setInterval(function() {
+        autosave(url, getAnnotation);
+    }, 10000);
+}
+
+function disableAutosave() {
+    if(g_autosaveTimer !== null) {
+        clearInterval(g_autosaveTimer);
+        g_autosaveTimer = null;
+    }
+}
+
+function createAutosaveSnapshot(annotation) {
+    var snapshot = {};
+    for(var frame in annotation) {
+        snapshot[frame] = {};
+        for(var object in annotation[frame]) {
+            snapshot[frame][object] = JSON.stringify(annotation[frame][object]);
+        }
+    }
+    return snapshot;
+}
+
+function autosave(url, getAnnotation) {
+    if(g_autosaveInProgress)
+        return;
+
+    // Find changed and deleted objects
+    var snapshot = createAutosaveSnapshot(getAnnotation());
+    var frames = {};
+    var changed = false;
+    for(var frame in snapshot) {
+        var previous = frame in g_autosaveSnapshot ? g_autosaveSnapshot[frame] : {};
+        var objects = {};
+        var frameChanged = false;
+        for(var object in snapshot[frame]) {
+            if(previous[object] !== snapshot[frame][object]) {
+                objects[object] = JSON.parse(snapshot[frame][object]);
+                frameChanged = true;
+            }
+        }
+        for(var object in previous) {
+            if(!(object in snapshot[frame])) {
+                objects[object] = null;
+                frameChanged = true;
+            }
+        }
+        if(frameChanged) {
+            frames[frame] = objects;
+            changed = true;
+        }
+    }
+    for(var frame in g_autosaveSnapshot) {
+        if(!(frame in snapshot) && Object.keys(g_autosaveSnapshot[frame]).length > 0) {
+            frames[frame] = null;
+            changed = true;
+        }
+    }
+    if(!changed)
+        return;
+
+    g_autosaveInProgress = true;
+    $.ajax({
+        type: "PATCH",
+        url: url,
+        contentType: "application/json",
+        data: JSON.stringify({
+            task_id: g_taskID,
+            image_id: g_imageID,
+            version: g_annotationVersion,
+            frames: frames,
+        }),
+        dataType: "json"
+    }).done(function(data) {
+        g_annotationVersion = data.version;
+        g_autosaveSnapshot = snapshot;
+    }).fail(function(xhr) {
+        if(xhr.status == 409) {
+            // Annotation was saved by someone else, stop autosaving to not overwrite it
+            disableAutosave();
+            var messageBox = document.getElementById("message");
+            messageBox.innerHTML = '<div class="error"><strong>Autosave stopped</strong><br> ' + xhr.responseJSON.message + '</div>';
+        }
+    }).always(function() {
+        g_autosaveInProgress = false;
+    });
+}
+
+// Get the existing annotations which the view has serialized to JSON in context['annotation_data']
+function getAnnotationData() {
+    var element = document.getElementById('annotationData');
+    if(element === null)
+        return [];
+    return JSON.parse(element.textContent);
+}
+
+// Add the contours given by common.control_points.get_contour_data, using the addControlPoint function of the task
+function loadControlPoints(contours) {
+    for(var i = 0; i < contours.length; ++i) {
+        var frameNr = contours[i][0];
+        var object = contours[i][1];
+        var label = contours[i][2];
+        var points = contours[i][3];
+        for(var j = 0; j < points.length; j += 3) {
+            addControlPoint(points[j], points[j+1], frameNr, object, label, points[j+2] != 0);
+        }
+    }
+}
+
 function initializeAnnotation(taskID, imageID) {
     g_taskID = taskID;
     g_imageID = imageID;
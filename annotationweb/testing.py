@@ -0,0 +1,52 @@
+import json
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from annotationweb.models import Dataset, Subject, Task, Label, ImageSequence, ImageAnnotation
+
+
+def get_frame_data(nr_of_frames, value):
+    """
+    Get the JSON of an object with the same value for each frame, as posted by the annotation tasks
+    """
+    return json.dumps({str(frame_nr): value for frame_nr in range(nr_of_frames)})
+
+
+class SaveAnnotationTestCase(TestCase):
+    """
+    Base class of the tests of the save view of a task type, which post an annotation of a new image sequence
+    with a key frame for each frame. Subclasses set the task type and the name of the save view.
+    """
+    task_type = None
+    save_view = None
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='annotater')
+        cls.subject = Subject.objects.create(name='Subject', dataset=Dataset.objects.create(name='Dataset'))
+        cls.task = Task.objects.create(name='Task', type=cls.task_type)
+        cls.label = Label.objects.create(name='Label')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def save(self, nr_of_frames, **data):
+        """
+        Save an annotation of every frame of a new image sequence
+        :param data: the task specific data which is posted, e.g. from get_frame_data
+        :return response and number of queries:
+        """
+        image = ImageSequence.objects.create(format='/data/frame_#.png', subject=self.subject, nr_of_frames=nr_of_frames)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse(self.save_view), {
+                'image_id': image.id,
+                'task_id': self.task.id,
+                'target_frames': json.dumps(list(range(nr_of_frames))),
+                'rejected': 'false',
+                'comments': '',
+                'quality': ImageAnnotation.QUALITY_OK,
+                **data,
+            })
+        return response.json(), len(queries)
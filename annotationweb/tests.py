@@ -0,0 +1,1504 @@
+import datetime
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import unittest
+import h5py
+import numpy as np
+import PIL.Image
+from unittest import mock
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from annotationweb.forms import ImageListForm
+from annotationweb.models import *
+from boundingbox.models import BoundingBox
+from common.label import get_label_tree, get_all_labels, get_complete_label_name
+from common.metadata import update_metadata_facets, get_metadata_choices, get_image_ids_with_metadata, parse_number
+from common.search_filters import SearchFilter
+import common.task
+from common.task import save_annotation, save_key_frame_rows, copy_task, set_key_frames, get_next_image, get_previous_image
+from common.delete import delete_in_chunks
+from importers.image_sequence_importer import ImageSequenceImporter, ImageSequenceImporterForm, FolderScanner
+from common.frames import get_frame_pattern, find_frame_numbers, get_frame_range, find_frames, is_container, \
+    get_container_frames, find_container_frames, read_container_frame, hash_image_sequence
+from common.metaimage import MetaImage
+from common.utility import get_frame_filename, export_frame
+from common.importer import import_in_background, find_all_importers
+from common.exporter import find_all_exporters, load_exporters
+from common.jobs import run_job, get_process_name, claim_job, JobCancelled
+from common.key_frames import middle_frame, every_nth_frame, frames_from_metadata, assign_key_frames, assign_key_frames_job
+from common.packing import pack_image_sequences, get_packed_filename
+from common.frame_store import read_sidecar, pack_frames, get_sidecar_filename
+from common.plugins import get_form_data
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is specific to SQLite')
+class QueryPlanTestCase(TestCase):
+    """
+    Base class for tests which check that hot querysets are answered using indexes, not table scans
+    """
+
+    def get_query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertNoTableScan(self, queryset, table):
+        plan = self.get_query_plan(queryset)
+        for line in plan:
+            if re.match(r'SCAN (TABLE )?' + table + r'\b', line):
+                self.fail('Query does a full scan of ' + table + ':\n' + '\n'.join(plan))
+
+    def assertUsesIndex(self, queryset, table):
+        self.assertNoTableScan(queryset, table)
+        plan = self.get_query_plan(queryset)
+        if not any(re.match(r'SEARCH (TABLE )?' + table + r'\b.*USING', line) for line in plan):
+            self.fail('Query does not use an index on ' + table + ':\n' + '\n'.join(plan))
+
+
+class AnnotationQueryPlanTests(QueryPlanTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='annotater')
+        cls.dataset = Dataset.objects.create(name='Dataset')
+        cls.subject = Subject.objects.create(name='Subject', dataset=cls.dataset)
+        cls.task = Task.objects.create(name='Task', type=Task.BOUNDING_BOX)
+        cls.task.dataset.add(cls.dataset)
+        cls.image = ImageSequence.objects.create(format='/data/frame_#.png', subject=cls.subject, nr_of_frames=10)
+        cls.annotation = ImageAnnotation.objects.create(image=cls.image, task=cls.task, user=cls.user,
+                                                        image_quality=ImageAnnotation.QUALITY_OK, comments='',
+                                                        rejected=False)
+
+    def test_annotation_by_task_and_image(self):
+        queryset = ImageAnnotation.objects.filter(task=self.task, image=self.image)
+        self.assertUsesIndex(queryset, 'annotationweb_imageannotation')
+
+    def test_finished_annotations_of_task(self):
+        queryset = ImageAnnotation.objects.filter(task=self.task, finished=True)
+        self.assertUsesIndex(queryset, 'annotationweb_imageannotation')
+
+    def test_key_frame_by_annotation_and_frame(self):
+        queryset = KeyFrameAnnotation.objects.filter(image_annotation=self.annotation, frame_nr=5)
+        self.assertUsesIndex(queryset, 'annotationweb_keyframeannotation')
+
+    def test_key_frames_of_task_and_image(self):
+        queryset = KeyFrameAnnotation.objects.filter(image_annotation__task=self.task,
+                                                     image_annotation__image=self.image)
+        self.assertNoTableScan(queryset, 'annotationweb_keyframeannotation')
+        self.assertNoTableScan(queryset, 'annotationweb_imageannotation')
+
+    def test_metadata_by_name_and_value(self):
+        queryset = ImageMetadata.objects.filter(name='Probe', value__in=['A', 'B'])
+        self.assertUsesIndex(queryset, 'annotationweb_imagemetadata')
+
+    def test_metadata_by_name_and_number_range(self):
+        queryset = ImageMetadata.objects.filter(name='Age', number__gte=30, number__lte=50)
+        self.assertUsesIndex(queryset, 'annotationweb_imagemetadata')
+
+    def test_sequence_by_subject_and_format(self):
+        queryset = ImageSequence.objects.filter(subject=self.subject, format=self.image.format)
+        self.assertUsesIndex(queryset, 'annotationweb_imagesequence')
+
+    def test_image_list_neighbour(self):
+        request = RequestFactory().get('/')
+        request.session = {}
+        search_filters = SearchFilter(request, self.task)
+        search_filters.set_value('sort_by', ImageListForm.SORT_DATE_DESC)
+        queryset = search_filters.get_annotations().filter(date__lt=self.annotation.date).order_by('-date', '-id')
+        self.assertUsesIndex(queryset, 'annotationweb_imageannotation')
+
+
+class NeighbourImageTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='annotater')
+        dataset = Dataset.objects.create(name='Dataset')
+        subject = Subject.objects.create(name='Subject', dataset=dataset)
+        cls.task = Task.objects.create(name='Task', type=Task.BOUNDING_BOX)
+        cls.task.dataset.add(dataset)
+        cls.images = [ImageSequence.objects.create(format='/data/' + str(i) + '/frame_#.png', subject=subject, nr_of_frames=10)
+                      for i in range(6)]
+        # The second and third images are annotated at the same time, images 4 and 5 are not annotated
+        dates = [timezone.now() - datetime.timedelta(days=days) for days in (3, 2, 2, 1)]
+        for image, date in zip(cls.images, dates):
+            annotation = ImageAnnotation.objects.create(image=image, task=cls.task, user=user, rejected=False,
+                                                        image_quality=ImageAnnotation.QUALITY_OK, comments='')
+            ImageAnnotation.objects.filter(id=annotation.id).update(date=date)
+        ImageAnnotation.objects.create(image=cls.images[5], task=cls.task, user=user, rejected=False, finished=False,
+                                       image_quality=ImageAnnotation.QUALITY_OK, comments='')
+
+    def get_neighbours(self, sort_by, index):
+        request = RequestFactory().get('/')
+        request.session = {}
+        SearchFilter(request, self.task).set_value('sort_by', sort_by)
+        ids = [image.id for image in self.images]
+        previous = get_previous_image(request, self.task, self.images[index])
+        next = get_next_image(request, self.task, self.images[index])
+        return (ids.index(previous) if previous is not None else None,
+                ids.index(next) if next is not None else None)
+
+    def test_date_ascending(self):
+        self.assertEqual(self.get_neighbours(ImageListForm.SORT_DATE_ASC, 0), (None, 1))
+        self.assertEqual(self.get_neighbours(ImageListForm.SORT_DATE_ASC, 1), (0, 2))
+        self.assertEqual(self.get_neighbours(ImageListForm.SORT_DATE_ASC, 2), (1, 3))
+        self.assertEqual(self.get_neighbours(ImageListForm.SORT_DATE_ASC, 3), (2, None))
+        # Images which are not in the list have no neighbours
+        self.assertEqual(self.get_neighbours(ImageListForm.SORT_DATE_ASC, 4), (None, None))
+
+    def test_date_descending(self):
+        self.assertEqual(self.get_neighbours(ImageListForm.SORT_DATE_DESC, 3), (None, 2))
+        self.assertEqual(self.get_neighbours(ImageListForm.SORT_DATE_DESC, 2), (3, 1))
+        self.assertEqual(self.get_neighbours(ImageListForm.SORT_DATE_DESC, 1), (2, 0))
+        self.assertEqual(self.get_neighbours(ImageListForm.SORT_DATE_DESC, 0), (1, None))
+
+    def test_image_id(self):
+        self.assertEqual(self.get_neighbours(ImageListForm.SORT_IMAGE_ID, 0), (None, 1))
+        self.assertEqual(self.get_neighbours(ImageListForm.SORT_IMAGE_ID, 3), (2, 4))
+        self.assertEqual(self.get_neighbours(ImageListForm.SORT_IMAGE_ID, 5), (4, None))
+
+    def test_not_annotated(self):
+        self.assertEqual(self.get_neighbours(ImageListForm.SORT_NOT_ANNOTATED_IMAGE_ID, 4), (None, 5))
+        self.assertEqual(self.get_neighbours(ImageListForm.SORT_NOT_ANNOTATED_IMAGE_ID, 5), (4, None))
+        self.assertEqual(self.get_neighbours(ImageListForm.SORT_NOT_ANNOTATED_IMAGE_ID, 1), (None, 4))
+
+
+class LabelTreeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.task = Task.objects.create(name='Task', type=Task.CLASSIFICATION)
+        cls.heart = Label.objects.create(name='Heart')
+        cls.lung = Label.objects.create(name='Lung')
+        cls.left = Label.objects.create(name='Left', parent=cls.heart)
+        cls.atrium = Label.objects.create(name='Atrium', parent=cls.left)
+        cls.task.label.add(cls.heart, cls.lung)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_hierarchy(self):
+        # One query for each level of labels, and one for the sublabels of the last level
+        with self.assertNumQueries(4):
+            label_tree = get_label_tree(self.task)
+            sublabels, labels = label_tree.get_sublabels()
+            parent_ids = [label.parent.id for label in labels if label.parent is not None]
+
+        self.assertEqual(label_tree.toplabels, [self.heart, self.lung])
+        self.assertEqual(sublabels, [{'id': self.heart.id, 'labels': [self.left]},
+                                     {'id': self.left.id, 'labels': [self.atrium]}])
+        self.assertEqual(parent_ids, [self.heart.id, self.left.id])
+        self.assertEqual(get_all_labels(self.task), [
+            {'id': self.heart.id, 'name': 'Heart'},
+            {'id': self.left.id, 'name': 'Heart - Left'},
+            {'id': self.atrium.id, 'name': 'Heart - Left - Atrium'},
+            {'id': self.lung.id, 'name': 'Lung'},
+        ])
+
+    def test_only_labels_of_task_are_loaded(self):
+        other = Label.objects.create(name='Other')
+        Label.objects.create(name='Sublabel', parent=other)
+        Task.objects.create(name='Other', type=Task.CLASSIFICATION).label.add(other)
+        label_tree = get_label_tree(self.task)
+        self.assertEqual(set(label_tree.labels), {self.heart.id, self.lung.id, self.left.id, self.atrium.id})
+
+    def test_complete_label_name_is_cached(self):
+        self.assertEqual(get_complete_label_name(self.atrium), 'Heart - Left - Atrium')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_complete_label_name(self.left), 'Heart - Left')
+
+    def test_invalidation(self):
+        get_label_tree(self.task)
+        self.left.name = 'Right'
+        self.left.save()
+        self.assertEqual(get_complete_label_name(self.atrium), 'Heart - Right - Atrium')
+
+        self.task.label.remove(self.lung)
+        self.assertEqual(get_label_tree(self.task).toplabels, [self.heart])
+
+
+class SearchFilterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dataset = Dataset.objects.create(name='Dataset')
+        cls.subjects = [Subject.objects.create(name='Subject ' + str(i), dataset=cls.dataset) for i in range(100)]
+        cls.task = Task.objects.create(name='Task', type=Task.BOUNDING_BOX)
+        cls.task.dataset.add(cls.dataset)
+
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+        self.request.session = SessionStore()
+
+    def test_default_state_is_not_stored(self):
+        search_filters = SearchFilter(self.request, self.task)
+        search_filters.create_form()
+        self.assertFalse(self.request.session.modified)
+        self.assertNotIn('search_filters' + str(self.task.id), self.request.session)
+        self.assertEqual(len(search_filters.get_value('subject')), 100)
+
+    def test_excluded_subjects_are_stored(self):
+        search_filters = SearchFilter(self.request, self.task)
+        selected = [str(subject.id) for subject in self.subjects[1:]]
+        search_filters.create_form(data={'sort_by': ImageListForm.SORT_IMAGE_ID, 'subject': selected,
+                                         'image_quality': search_filters.image_quality})
+        self.assertTrue(self.request.session.modified)
+        self.assertEqual(self.request.session['search_filters' + str(self.task.id)], {
+            'sort_by': ImageListForm.SORT_IMAGE_ID,
+            'subject': {'exclude': [str(self.subjects[0].id)]},
+        })
+
+        # Same filter values should not modify the session again
+        self.request.session.modified = False
+        search_filters = SearchFilter(self.request, self.task)
+        search_filters.create_form(data={'sort_by': ImageListForm.SORT_IMAGE_ID, 'subject': selected,
+                                         'image_quality': search_filters.image_quality})
+        self.assertFalse(self.request.session.modified)
+        self.assertCountEqual(search_filters.get_value('subject'), selected)
+
+
+class MetadataFacetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dataset = Dataset.objects.create(name='Dataset')
+        subject = Subject.objects.create(name='Subject', dataset=cls.dataset)
+        cls.task = Task.objects.create(name='Task', type=Task.BOUNDING_BOX)
+        cls.task.dataset.add(cls.dataset)
+        cls.images = []
+        for probe, view in (('A', '4CH'), ('A', '2CH'), ('B', '4CH'), ('C', 'Time: 10:15')):
+            image = ImageSequence.objects.create(format='/data/frame_#.png', subject=subject, nr_of_frames=10)
+            ImageMetadata.objects.create(image=image, name='Probe', value=probe)
+            ImageMetadata.objects.create(image=image, name='View', value=view)
+            cls.images.append(image.id)
+        update_metadata_facets(cls.dataset)
+
+    def test_choices(self):
+        self.assertEqual(len(get_metadata_choices(self.task)), 6)
+
+    def test_filter(self):
+        self.assertEqual(get_image_ids_with_metadata(self.task, {'Probe': ['A', 'B']}), self.images[:3])
+        self.assertEqual(get_image_ids_with_metadata(self.task, {'Probe': ['A', 'B'], 'View': ['4CH']}),
+                         [self.images[0], self.images[2]])
+        self.assertEqual(get_image_ids_with_metadata(self.task, {'Probe': ['C'], 'View': ['4CH']}), [])
+
+    def test_search_filter(self):
+        request = RequestFactory().get('/')
+        request.session = {}
+        search_filters = SearchFilter(request, self.task)
+        search_filters.set_value('sort_by', ImageListForm.SORT_IMAGE_ID)
+        search_filters.set_value('metadata', ['Probe: A', 'View: 2CH'])
+        self.assertEqual(list(search_filters.get_image_sequences().values_list('id', flat=True)), [self.images[1]])
+        # Filtered with subqueries instead of lists of ids
+        with CaptureQueriesContext(connection) as queries:
+            list(search_filters.get_image_sequences())
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(queries[0]['sql'].count('annotationweb_imagemetadata'), 2)
+
+
+class MetadataFacetSignalTests(TransactionTestCase):
+    # The facets are updated when the transaction is committed, which a TestCase never does
+
+    def setUp(self):
+        self.dataset = Dataset.objects.create(name='Dataset')
+        subject = Subject.objects.create(name='Subject', dataset=self.dataset)
+        self.task = Task.objects.create(name='Task', type=Task.BOUNDING_BOX)
+        self.task.dataset.add(self.dataset)
+        self.image = ImageSequence.objects.create(format='/data/frame_#.png', subject=subject, nr_of_frames=10)
+
+    def test_save_and_delete(self):
+        metadata = ImageMetadata.objects.create(image=self.image, name='Probe', value='A')
+        self.assertEqual(get_image_ids_with_metadata(self.task, {'Probe': ['A']}), [self.image.id])
+
+        metadata.value = 'B'
+        metadata.save()
+        self.assertEqual(get_image_ids_with_metadata(self.task, {'Probe': ['A']}), [])
+        self.assertEqual(get_image_ids_with_metadata(self.task, {'Probe': ['B']}), [self.image.id])
+
+        # Deleted in the admin
+        self.client.force_login(User.objects.create(username='admin', is_staff=True, is_superuser=True))
+        self.client.post(reverse('admin:annotationweb_imagemetadata_delete', args=[metadata.id]), {'post': 'yes'})
+        self.assertFalse(ImageMetadata.objects.exists())
+        self.assertFalse(MetadataFacet.objects.exists())
+
+    def test_updated_once_per_transaction(self):
+        with mock.patch('common.metadata.update_metadata_facets') as update:
+            with transaction.atomic():
+                for value in ('A', 'B', 'C'):
+                    ImageMetadata.objects.create(image=self.image, name='Probe', value=value)
+        update.assert_called_once_with(self.dataset)
+
+    def test_metadata_is_fast_deleted(self):
+        ImageMetadata.objects.create(image=self.image, name='Probe', value='A')
+        # Fast deletes don't load the rows before deleting them
+        with CaptureQueriesContext(connection) as queries:
+            ImageMetadata.objects.filter(image=self.image).delete()
+        self.assertFalse(any(query['sql'].startswith('SELECT') for query in queries))
+
+    def test_command(self):
+        ImageMetadata.objects.create(image=self.image, name='Probe', value='A')
+        ImageMetadata.objects.update(value='B')
+        call_command('update_metadata_facets', self.dataset.id, stdout=io.StringIO())
+        self.assertEqual(get_image_ids_with_metadata(self.task, {'Probe': ['B']}), [self.image.id])
+
+
+class MetadataIngestionTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+        self.dataset = Dataset.objects.create(name='Dataset')
+        self.task = Task.objects.create(name='Task', type=Task.BOUNDING_BOX)
+        self.task.dataset.add(self.dataset)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_sequence(self, sequence, filename=None, content=''):
+        sequence_dir = os.path.join(self.path, 'Subject', sequence)
+        os.makedirs(sequence_dir)
+        open(os.path.join(sequence_dir, 'frame_0.png'), 'w').close()
+        if filename is not None:
+            with open(os.path.join(sequence_dir, filename), 'w') as f:
+                f.write(content)
+        return os.path.join(sequence_dir, 'frame_#.png')
+
+    def import_data(self, metadata_csv=''):
+        importer = ImageSequenceImporter()
+        importer.dataset = self.dataset
+        form = ImageSequenceImporterForm({'path': self.path, 'metadata_csv': metadata_csv})
+        self.assertTrue(form.is_valid())
+        return importer.import_data(form)
+
+    def get_metadata(self):
+        return set(ImageMetadata.objects.values_list('image__format', 'name', 'value', 'number'))
+
+    def test_parse_number(self):
+        self.assertEqual(parse_number('42'), 42.0)
+        self.assertEqual(parse_number(' -1.5e3 '), -1500.0)
+        self.assertIsNone(parse_number('A4C'))
+        self.assertIsNone(parse_number('nan'))
+        self.assertIsNone(parse_number('inf'))
+
+    def test_text_and_json(self):
+        first = self.create_sequence('Sequence 1', 'metadata.txt', 'Time: 10:15:30\n\nAge: 42\n')
+        second = self.create_sequence('Sequence 2', 'metadata.json', json.dumps({'View': 'A4C', 'Heart rate': 61.5}))
+        self.import_data()
+        self.assertEqual(self.get_metadata(), {(first, 'Time', '10:15:30', None), (first, 'Age', '42', 42.0),
+                                               (second, 'View', 'A4C', None), (second, 'Heart rate', '61.5', 61.5)})
+
+    def test_csv(self):
+        first = self.create_sequence('Sequence 1', 'metadata.txt', 'Age: 42\nView: A2C\n')
+        second = self.create_sequence('Sequence 2')
+        filename = os.path.join(self.path, 'metadata.csv')
+        with open(filename, 'w') as f:
+            f.write('path,Age,Probe\nSubject/Sequence 1,43,\n' + os.path.dirname(second) + ',30,S5\nSubject/Missing,1,2\n')
+        self.import_data(filename)
+        self.assertEqual(self.get_metadata(), {(first, 'Age', '43', 43.0), (first, 'View', 'A2C', None),
+                                               (second, 'Age', '30', 30.0), (second, 'Probe', 'S5', None)})
+        self.assertEqual(MetadataFacet.objects.filter(dataset=self.dataset).count(), 4)
+
+    def test_range_filter(self):
+        for i, age in enumerate(('25', '42', '61')):
+            self.create_sequence('Sequence ' + str(i), 'metadata.txt', 'Age: ' + age + '\nView: A' + str(i) + 'C\n')
+        self.import_data()
+        ids = list(ImageSequence.objects.order_by('format').values_list('id', flat=True))
+
+        request = RequestFactory().get('/')
+        request.session = {}
+        search_filters = SearchFilter(request, self.task)
+        self.assertEqual(search_filters.numeric_metadata, ['Age'])
+        form = search_filters.create_form(data={'sort_by': ImageListForm.SORT_IMAGE_ID, 'image_quality': search_filters.image_quality,
+                                                'subject': search_filters.get_value('subject'),
+                                                'metadata_range_name': 'Age', 'metadata_min': '30', 'metadata_max': ''})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(list(search_filters.get_image_sequences().values_list('id', flat=True)), ids[1:])
+        search_filters.set_value('metadata_max', 50)
+        self.assertEqual(list(search_filters.get_image_sequences().values_list('id', flat=True)), ids[1:2])
+        search_filters.set_value('metadata', ['View: A1C'])
+        self.assertEqual(list(search_filters.get_image_sequences().values_list('id', flat=True)), ids[1:2])
+        search_filters.set_value('metadata', ['View: A2C'])
+        self.assertEqual(list(search_filters.get_image_sequences().values_list('id', flat=True)), [])
+
+
+class SaveAnnotationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='annotater')
+        subject = Subject.objects.create(name='Subject', dataset=Dataset.objects.create(name='Dataset'))
+        cls.task = Task.objects.create(name='Task', type=Task.BOUNDING_BOX)
+        cls.image = ImageSequence.objects.create(format='/data/frame_#.png', subject=subject, nr_of_frames=10)
+
+    def save(self, frames):
+        request = RequestFactory().post('/', {
+            'image_id': self.image.id,
+            'task_id': self.task.id,
+            'target_frames': json.dumps(frames),
+            'rejected': 'false',
+            'comments': '',
+            'quality': ImageAnnotation.QUALITY_OK,
+        })
+        request.user = self.user
+        return save_annotation(request)
+
+    def test_key_frames_are_kept(self):
+        first = {key_frame.frame_nr: key_frame.id for key_frame in self.save([1, 2, 3])}
+        key_frames = self.save([4, 2, 3, 4])
+        self.assertEqual([key_frame.frame_nr for key_frame in key_frames], [4, 2, 3])
+        self.assertEqual(key_frames[1].id, first[2])
+        self.assertEqual(key_frames[2].id, first[3])
+        self.assertFalse(KeyFrameAnnotation.objects.filter(id=first[1]).exists())
+        self.assertEqual(ImageAnnotation.objects.filter(task=self.task, image=self.image).count(), 1)
+
+    def save_boxes(self, frames, boxes):
+        key_frames = self.save(frames)
+        label = Label.objects.get_or_create(name='Label')[0]
+        rows = [BoundingBox(image=key_frame, x=x, y=0, width=1, height=1, label=label)
+                for key_frame in key_frames for x in boxes.get(key_frame.frame_nr, [])]
+        return save_key_frame_rows(BoundingBox, key_frames, rows, ['x', 'y', 'width', 'height', 'label'])
+
+    def test_only_changed_key_frames_are_written(self):
+        self.assertEqual(self.save_boxes([1, 2, 3], {1: [0], 2: [0, 1], 3: [0]}), 3)
+        ids = dict(BoundingBox.objects.values_list('image__frame_nr', 'id').filter(image__frame_nr__in=[1, 3]))
+        with CaptureQueriesContext(connection) as queries:
+            # Frame 1 is unchanged, frame 2 gets another box and frame 3 a moved box
+            self.assertEqual(self.save_boxes([1, 2, 3], {1: [0], 2: [0, 1, 2], 3: [5]}), 2)
+        writes = [query['sql'].split(' ')[0] for query in queries if 'boundingbox' in query['sql']]
+        self.assertEqual(writes, ['SELECT', 'DELETE', 'UPDATE', 'INSERT'])
+        self.assertEqual(BoundingBox.objects.get(image__frame_nr=3).id, ids[3])
+        self.assertEqual(BoundingBox.objects.get(image__frame_nr=1).id, ids[1])
+        self.assertEqual(list(BoundingBox.objects.filter(image__frame_nr=2).order_by('x').values_list('x', flat=True)), [0, 1, 2])
+
+    def test_annotations_of_kept_key_frames_are_removed(self):
+        self.save_boxes([1, 2], {1: [0], 2: [0]})
+        self.assertEqual(self.save_boxes([1, 2], {2: [0]}), 1)
+        self.assertEqual(list(BoundingBox.objects.values_list('image__frame_nr', flat=True)), [2])
+
+    def test_save_increments_version(self):
+        self.save([1])
+        self.save([1])
+        self.assertEqual(ImageAnnotation.objects.get(task=self.task, image=self.image).version, 2)
+
+    def test_key_frames_are_unique(self):
+        key_frame = self.save([1])[0]
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            KeyFrameAnnotation.objects.create(image_annotation=key_frame.image_annotation, frame_nr=1)
+
+
+class SelectKeyFramesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='admin', is_staff=True)
+        dataset = Dataset.objects.create(name='Dataset')
+        subject = Subject.objects.create(name='Subject', dataset=dataset)
+        cls.task = Task.objects.create(name='Task', type=Task.BOUNDING_BOX)
+        cls.task.dataset.add(dataset)
+        cls.images = [ImageSequence.objects.create(format='/data/frame_#.png', subject=subject, nr_of_frames=10) for i in range(20)]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get_key_frames(self):
+        return set(KeyFrameAnnotation.objects.values_list('image_annotation__image_id', 'frame_nr'))
+
+    def test_select_key_frames(self):
+        response = self.client.post(reverse('select_key_frames', args=[self.task.id, self.images[0].id]), {'frames': [1, 2]})
+        self.assertRedirects(response, reverse('task', args=[self.task.id]))
+        key_frame = KeyFrameAnnotation.objects.get(frame_nr=2)
+        ImageAnnotation.objects.update(finished=True)
+
+        self.client.post(reverse('select_key_frames', args=[self.task.id, self.images[0].id]), {'frames': [2, 3]})
+        self.assertEqual(self.get_key_frames(), {(self.images[0].id, 2), (self.images[0].id, 3)})
+        self.assertTrue(KeyFrameAnnotation.objects.filter(id=key_frame.id).exists())
+        annotation = ImageAnnotation.objects.get()
+        self.assertFalse(annotation.finished)
+        self.assertEqual(annotation.version, 2)
+
+    def test_removed_key_frames_are_deleted_with_annotations(self):
+        set_key_frames(self.task, self.user, {self.images[0].id: [1, 2]})
+        label = Label.objects.create(name='Label')
+        for key_frame in KeyFrameAnnotation.objects.all():
+            BoundingBox.objects.create(image=key_frame, x=0, y=0, width=1, height=1, label=label)
+        ImageAnnotation.objects.update(finished=True)
+
+        self.assertEqual(set_key_frames(self.task, self.user, {self.images[0].id: [2]}), (0, 1))
+        self.assertEqual(BoundingBox.objects.get().image.frame_nr, 2)
+        # No new frames to annotate
+        self.assertTrue(ImageAnnotation.objects.get().finished)
+
+    def test_invalid_frame(self):
+        response = self.client.post(reverse('select_key_frames', args=[self.task.id, self.images[0].id]), {'frames': [10]})
+        self.assertRedirects(response, reverse('select_key_frames', args=[self.task.id, self.images[0].id]))
+        self.assertFalse(ImageAnnotation.objects.exists())
+
+    def test_bulk(self):
+        key_frames = {image.id: [0, 9] for image in self.images}
+        # Sequences, savepoint, annotations, insert annotations, annotations, key frames, insert key frames,
+        # 2 updates of annotations and release savepoint
+        with self.assertNumQueries(10):
+            set_key_frames(self.task, self.user, key_frames)
+        self.assertEqual(len(self.get_key_frames()), 40)
+
+        key_frames = {str(image.id): [9] for image in self.images[:10]}
+        response = self.client.post(reverse('select_key_frames_bulk', args=[self.task.id]),
+                                    json.dumps({'key_frames': key_frames}), content_type='application/json')
+        self.assertEqual(response.json()['success'], 'true')
+        self.assertEqual((response.json()['created'], response.json()['deleted']), (0, 10))
+        self.assertEqual(len(self.get_key_frames()), 30)
+
+    def test_bulk_is_not_applied_partly(self):
+        set_key_frames(self.task, self.user, {image.id: [1] for image in self.images})
+        key_frames = {image.id: [2] for image in self.images}
+        # Invalid frame in the last chunk
+        key_frames[self.images[-1].id] = [10]
+        with self.assertRaises(ValueError):
+            set_key_frames(self.task, self.user, key_frames, chunk_size=5)
+        self.assertEqual(self.get_key_frames(), {(image.id, 1) for image in self.images})
+
+    def test_bulk_is_rolled_back(self):
+        set_key_frames_of_chunk = common.task._set_key_frames
+        chunks = []
+
+        def fail_in_last_chunk(*args):
+            chunks.append(args[2])
+            if len(chunks) == 4:
+                raise IntegrityError
+            return set_key_frames_of_chunk(*args)
+
+        with mock.patch('common.task._set_key_frames', side_effect=fail_in_last_chunk):
+            with self.assertRaises(IntegrityError):
+                set_key_frames(self.task, self.user, {image.id: [2] for image in self.images}, chunk_size=5)
+        self.assertEqual(len(chunks), 4)
+        self.assertFalse(ImageAnnotation.objects.exists())
+
+    def test_bulk_is_validated(self):
+        other = ImageSequence.objects.create(format='/other/frame_#.png', nr_of_frames=10,
+                                             subject=Subject.objects.create(name='Other', dataset=Dataset.objects.create(name='Other')))
+        key_frames = {self.images[0].id: [1], other.id: [1]}
+        response = self.client.post(reverse('select_key_frames_bulk', args=[self.task.id]),
+                                    json.dumps({'key_frames': key_frames}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(KeyFrameAnnotation.objects.exists())
+
+
+class AssignKeyFramesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        dataset = Dataset.objects.create(name='Dataset')
+        subject = Subject.objects.create(name='Subject', dataset=dataset)
+        cls.task = Task.objects.create(name='Task', type=Task.BOUNDING_BOX)
+        cls.task.dataset.add(dataset)
+        cls.images = [ImageSequence.objects.create(format='/data/' + str(i) + '/frame_#.png', subject=subject,
+                                                   nr_of_frames=10, start_frame_nr=1) for i in range(3)]
+
+    def get_key_frames(self):
+        key_frames = {}
+        for image_id, frame_nr in KeyFrameAnnotation.objects.order_by('frame_nr').values_list('image_annotation__image_id', 'frame_nr'):
+            key_frames.setdefault(image_id, []).append(frame_nr)
+        return key_frames
+
+    def test_middle_frame(self):
+        self.assertEqual(assign_key_frames(self.task, self.user, middle_frame()), (3, 0))
+        self.assertEqual(self.get_key_frames(), {image.id: [6] for image in self.images})
+
+    def test_middle_frame_of_empty_sequence(self):
+        self.assertIsNone(middle_frame()(self.images[0].id, self.images[0].format, 0, 0))
+
+    def test_every_nth_frame(self):
+        assign_key_frames(self.task, self.user, every_nth_frame(4), chunk_size=2)
+        self.assertEqual(self.get_key_frames(), {image.id: [1, 5, 9] for image in self.images})
+
+    def test_metadata(self):
+        ImageMetadata.objects.create(image=self.images[0], name='ED', value='2, 7')
+        ImageMetadata.objects.create(image=self.images[1], name='ED', value='3')
+        assign_key_frames(self.task, self.user, frames_from_metadata(self.task, 'ED'))
+        self.assertEqual(self.get_key_frames(), {self.images[0].id: [2, 7], self.images[1].id: [3]})
+
+    def test_invalid_metadata_is_reported(self):
+        for image, value in zip(self.images, ('12.5', '-3', '4,')):
+            ImageMetadata.objects.create(image=image, name='ED', value=value)
+        messages = []
+        assign_key_frames(self.task, self.user, frames_from_metadata(self.task, 'ED', messages.append))
+        self.assertEqual(self.get_key_frames(), {})
+        self.assertEqual(len(messages), 3)
+        self.assertIn('its ED is not a list of frame numbers: 12.5', messages[0])
+
+    def test_command_with_csv(self):
+        assign_key_frames(self.task, self.user, middle_frame())
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as file:
+            file.write(str(self.images[0].id) + ',1,2\n' + self.images[1].format + ',3\n')
+            file.flush()
+            call_command('assign_key_frames', self.task.id, 'csv', csv=file.name, user='admin', stdout=io.StringIO())
+        self.assertEqual(self.get_key_frames(), {self.images[0].id: [1, 2], self.images[1].id: [3], self.images[2].id: [6]})
+
+    def test_queries_do_not_depend_on_number_of_sequences(self):
+        with CaptureQueriesContext(connection) as few:
+            assign_key_frames(self.task, self.user, middle_frame())
+        KeyFrameAnnotation.objects.all().delete()
+        ImageAnnotation.objects.all().delete()
+        subject = self.images[0].subject
+        ImageSequence.objects.bulk_create([ImageSequence(format='/more/' + str(i) + '/frame_#.png', subject=subject, nr_of_frames=10)
+                                           for i in range(100)])
+        with CaptureQueriesContext(connection) as many:
+            assign_key_frames(self.task, self.user, middle_frame())
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(KeyFrameAnnotation.objects.count(), 103)
+
+    @override_settings(RUN_JOBS_IN_BACKGROUND=False)
+    def test_admin_action(self):
+        self.client.force_login(self.user)
+        data = {'action': 'select_key_frames', '_selected_action': [self.task.id]}
+        response = self.client.post(reverse('admin:annotationweb_task_changelist'), data)
+        self.assertContains(response, 'name="apply"')
+        self.assertFalse(Job.objects.exists())
+
+        # Options are required by some rules
+        response = self.client.post(reverse('admin:annotationweb_task_changelist'), dict(data, apply='Apply', rule='every-nth'))
+        self.assertContains(response, 'N is required for every Nth frame')
+        self.assertFalse(Job.objects.exists())
+
+        self.client.post(reverse('admin:annotationweb_task_changelist'), dict(data, apply='Apply', rule='every-nth', n=4))
+        self.assertEqual(Job.objects.get().status, Job.STATUS_FINISHED)
+        self.assertEqual(self.get_key_frames(), {image.id: [1, 5, 9] for image in self.images})
+
+    @override_settings(RUN_JOBS_IN_BACKGROUND=False)
+    def test_admin_action_with_metadata(self):
+        ImageMetadata.objects.create(image=self.images[0], name='ED', value='3')
+        self.client.force_login(self.user)
+        self.client.post(reverse('admin:annotationweb_task_changelist'), {
+            'action': 'select_key_frames', '_selected_action': [self.task.id], 'apply': 'Apply',
+            'rule': 'metadata', 'metadata_name': 'ED'})
+        self.assertEqual(self.get_key_frames(), {self.images[0].id: [3]})
+
+    def test_failed_job_reports_committed_chunks(self):
+        def fail_after_first_chunk(task, user, get_frames, progress):
+            progress(1)
+            raise IntegrityError('failed')
+
+        job = Job.objects.create(name='Job', status=Job.STATUS_RUNNING)
+        with mock.patch('common.key_frames.assign_key_frames', side_effect=fail_after_first_chunk), mock.patch('traceback.print_exc'):
+            run_job(job, assign_key_frames_job, self.task.id, self.user.id, 'middle', {})
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertIn('Stopped after 1 of 3 image sequences', job.message)
+
+
+class FrameDiscoveryTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.format = os.path.join(self.directory.name, 'frame_#.png')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_frames(self, frame_nrs):
+        for frame_nr in frame_nrs:
+            open(self.format.replace('#', str(frame_nr)), 'w').close()
+
+    def test_pattern(self):
+        self.assertEqual(find_frame_numbers(['frame_1.png', 'frame_10.png', 'frame_01.png', 'frame_2.mhd', 'frame_x.png',
+                                             'other_3.png', 'frame_0.png'], 'frame_#.png'), [0, 1, 10])
+        self.assertEqual(find_frame_numbers(['a1_1.png', 'a1_2.png'], '/data/a#_#.png'), [1])
+        self.assertEqual(find_frame_numbers(['f(1).png'], '/data/f(#).png'), [1])
+        with self.assertRaises(ValueError):
+            get_frame_pattern('/data/#/frame.png')
+
+    def test_range(self):
+        self.assertEqual(get_frame_range([]), (None, 0, []))
+        self.assertEqual(get_frame_range([1, 2, 3]), (1, 3, []))
+        self.assertEqual(get_frame_range([0, 1, 4, 6]), (0, 2, [2, 3, 5]))
+
+    def test_find_frames_with_one_listing(self):
+        self.create_frames([5, 6, 7, 9])
+        with mock.patch('os.scandir', wraps=os.scandir) as scandir, mock.patch('os.path.isfile') as isfile:
+            self.assertEqual(find_frames(self.format), (5, 3, [8]))
+        self.assertEqual(scandir.call_count, 1)
+        self.assertFalse(isfile.called)
+        self.assertEqual(find_frames(os.path.join(self.directory.name, 'missing', 'frame_#.png')), (None, 0, []))
+
+    def test_add_image_sequence(self):
+        self.create_frames([1, 2, 3, 5])
+        user = User.objects.create(username='admin', is_staff=True)
+        subject = Subject.objects.create(name='Subject', dataset=Dataset.objects.create(name='Dataset'))
+        self.client.force_login(user)
+        response = self.client.post(reverse('add_image_sequence', args=[subject.id]), {'format': self.format}, follow=True)
+        self.assertEqual(ImageSequence.objects.values_list('start_frame_nr', 'nr_of_frames').get(), (1, 3))
+        self.assertIn('these frames are missing: 4', response.content.decode())
+
+
+class ContainerTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # 4 frames of 3x2 pixels, where each pixel has the frame number as value
+        self.frames = np.repeat(np.arange(4, dtype=np.uint8), 6).reshape((4, 2, 3))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_metaimage(self, folder=''):
+        filename = os.path.join(self.directory.name, folder, 'loop.mhd')
+        with open(filename, 'w') as f:
+            f.write('NDims = 3\nDimSize = 3 2 4\nElementType = MET_UCHAR\nElementSpacing = 1 1 1\n'
+                    'ElementNumberOfChannels = 1\nElementDataFile = loop.raw\n')
+        self.frames.tofile(os.path.join(self.directory.name, folder, 'loop.raw'))
+        return filename
+
+    def write_tiff(self, folder=''):
+        filename = os.path.join(self.directory.name, folder, 'loop.tif')
+        images = [PIL.Image.fromarray(frame) for frame in self.frames]
+        images[0].save(filename, save_all=True, append_images=images[1:])
+        return filename
+
+    def write_hdf5(self, folder=''):
+        filename = os.path.join(self.directory.name, folder, 'loop.h5')
+        with h5py.File(filename, 'w') as f:
+            f.create_dataset('spacing', data=np.ones(3))
+            f.create_dataset('ultrasound/images', data=self.frames, chunks=(1, 2, 3))
+        return filename
+
+    def test_read_frames(self):
+        for filename in (self.write_metaimage(), self.write_tiff(), self.write_hdf5()):
+            self.assertTrue(is_container(filename))
+            self.assertEqual(get_container_frames(filename), 4)
+            self.assertEqual(find_container_frames(filename), (0, 4, []))
+            image, source = read_container_frame(filename, 2)
+            np.testing.assert_array_equal(np.asarray(image), self.frames[2])
+
+    def test_metaimage_frame_is_memory_mapped(self):
+        filename = self.write_metaimage()
+        with mock.patch('numpy.fromfile') as fromfile:
+            metaimage = MetaImage(filename=filename, frame_nr=3)
+        self.assertFalse(fromfile.called)
+        np.testing.assert_array_equal(metaimage.get_pixel_data(), self.frames[3])
+        np.testing.assert_array_equal(MetaImage(filename=filename).get_pixel_data(), self.frames)
+
+    def test_show_frame(self):
+        subject = Subject.objects.create(name='Subject', dataset=Dataset.objects.create(name='Dataset'))
+        image = ImageSequence.objects.create(format=self.write_hdf5(), subject=subject, nr_of_frames=4)
+        task = Task.objects.create(name='Task', type=Task.BOUNDING_BOX)
+        self.client.force_login(User.objects.create(username='annotater'))
+        response = self.client.get(reverse('show_frame', args=[image.id, 1, task.id]))
+        self.assertEqual(response['Content-Type'], 'image/png')
+        np.testing.assert_array_equal(np.asarray(PIL.Image.open(io.BytesIO(response.content))), self.frames[1])
+
+    def test_add_image_sequence(self):
+        subject = Subject.objects.create(name='Subject', dataset=Dataset.objects.create(name='Dataset'))
+        self.client.force_login(User.objects.create(username='admin', is_staff=True))
+        self.client.post(reverse('add_image_sequence', args=[subject.id]), {'format': self.write_tiff()})
+        self.assertEqual(ImageSequence.objects.values_list('start_frame_nr', 'nr_of_frames').get(), (0, 4))
+
+    def test_import(self):
+        formats = set()
+        for i, write in enumerate((self.write_metaimage, self.write_tiff, self.write_hdf5)):
+            folder = os.path.join('Subject', 'Sequence ' + str(i))
+            os.makedirs(os.path.join(self.directory.name, folder))
+            formats.add((write(folder), 0, 4))
+
+        importer = ImageSequenceImporter()
+        importer.dataset = Dataset.objects.create(name='Dataset')
+        form = ImageSequenceImporterForm({'path': self.directory.name})
+        form.is_valid()
+        importer.import_data(form)
+        self.assertEqual(set(ImageSequence.objects.values_list('format', 'start_frame_nr', 'nr_of_frames')), formats)
+
+    def test_import_skips_folders_which_cant_be_read(self):
+        folders = [os.path.join('Subject', name) for name in ('Frames', 'Containers', 'Unreadable')]
+        for folder in folders:
+            os.makedirs(os.path.join(self.directory.name, folder))
+        # Other files next to frames are ignored
+        PIL.Image.fromarray(self.frames[0]).save(os.path.join(self.directory.name, folders[0], 'frame_0.png'))
+        self.write_tiff(folders[0])
+        self.write_tiff(folders[1])
+        self.write_hdf5(folders[1])
+        with h5py.File(os.path.join(self.directory.name, folders[2], 'loop.h5'), 'w') as f:
+            f.create_dataset('image', data=self.frames[0])
+
+        importer = ImageSequenceImporter()
+        importer.dataset = Dataset.objects.create(name='Dataset')
+        form = ImageSequenceImporterForm({'path': self.directory.name})
+        form.is_valid()
+        success, message = importer.import_data(form)
+        self.assertTrue(success)
+        self.assertEqual(list(ImageSequence.objects.values_list('format', flat=True)),
+                         [os.path.join(self.directory.name, folders[0], 'frame_#.png')])
+        # Skipped folders are scanned again by the next import
+        self.assertFalse(ImportManifest.objects.filter(path__endswith='Containers').exists())
+        self.assertFalse(ImportManifest.objects.filter(path__endswith='Unreadable').exists())
+
+    def test_export_frame(self):
+        filename = self.write_hdf5()
+        self.assertEqual(get_frame_filename(filename, 2), 'loop_2.png')
+        self.assertEqual(get_frame_filename(os.path.join(self.directory.name, 'frame_#.mhd'), 2), 'frame_2.mhd')
+        for new_filename in ('frame.png', 'frame.mhd'):
+            export_frame(filename, '', 2, os.path.join(self.directory.name, new_filename))
+        np.testing.assert_array_equal(np.asarray(PIL.Image.open(os.path.join(self.directory.name, 'frame.png'))), self.frames[2])
+        np.testing.assert_array_equal(MetaImage(filename=os.path.join(self.directory.name, 'frame.mhd')).get_pixel_data(), self.frames[2])
+
+
+class ImageSequenceImporterTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+        self.dataset = Dataset.objects.create(name='Dataset')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_sequence(self, subject, sequence, nr_of_frames, extension='.png', metadata=None):
+        sequence_dir = os.path.join(self.path, subject, sequence)
+        os.makedirs(sequence_dir, exist_ok=True)
+        for i in range(nr_of_frames):
+            open(os.path.join(sequence_dir, 'frame_' + str(i) + extension), 'w').close()
+        if metadata is not None:
+            with open(os.path.join(sequence_dir, 'metadata.txt'), 'w') as f:
+                f.write(metadata)
+        self.touch(sequence_dir)
+        return os.path.join(sequence_dir, 'frame_#' + extension)
+
+    def touch(self, path):
+        # The resolution of modification times can be too coarse to see changes made right after an import
+        self.modified = getattr(self, 'modified', 10**18) + 10**9
+        os.utime(path, ns=(self.modified, self.modified))
+
+    def import_data(self, **options):
+        importer = ImageSequenceImporter()
+        importer.dataset = self.dataset
+        form = ImageSequenceImporterForm(dict(path=self.path, **options))
+        self.assertTrue(form.is_valid())
+        return importer.import_data(form)
+
+    def get_sequences(self):
+        return set(ImageSequence.objects.values_list('subject__name', 'format', 'nr_of_frames'))
+
+    def test_import(self):
+        first = self.create_sequence('Subject 1', 'Sequence 1', 3, metadata='Probe: S5\nView: A4C\n')
+        second = self.create_sequence('Subject 1', 'Sequence 2', 2, extension='.mhd')
+        third = self.create_sequence('Subject 2', 'Sequence 1', 4)
+        os.makedirs(os.path.join(self.path, 'Subject 2', 'Empty'))
+        open(os.path.join(self.path, 'notes.txt'), 'w').close()
+
+        self.assertEqual(self.import_data(), (True, self.path + ': 3 image sequences added, 0 changed and 0 not found. '
+                                                               'Sequences which are not found are not deleted.'))
+        self.assertEqual(self.get_sequences(), {('Subject 1', first, 3), ('Subject 1', second, 2), ('Subject 2', third, 4)})
+        self.assertEqual(set(ImageMetadata.objects.values_list('image__format', 'name', 'value')),
+                         {(first, 'Probe', 'S5'), (first, 'View', 'A4C')})
+        self.assertEqual(MetadataFacet.objects.filter(dataset=self.dataset).count(), 2)
+        self.assertEqual(ImportManifest.objects.filter(dataset=self.dataset).count(), 6)
+
+    def test_reimport(self):
+        first = self.create_sequence('Subject 1', 'Sequence 1', 3, metadata='Probe: S5\n')
+        second = self.create_sequence('Subject 1', 'Sequence 2', 2)
+        self.import_data()
+        first_id = ImageSequence.objects.get(format=first).id
+
+        # More frames in the first sequence, a new sequence and a removed sequence
+        self.create_sequence('Subject 1', 'Sequence 1', 5)
+        third = self.create_sequence('Subject 2', 'Sequence 1', 1)
+        shutil.rmtree(os.path.dirname(second))
+        self.touch(os.path.join(self.path, 'Subject 1'))
+        success, message = self.import_data()
+        self.assertIn('1 image sequences added, 1 changed and 1 not found', message)
+        self.assertEqual(self.get_sequences(), {('Subject 1', first, 5), ('Subject 1', second, 2), ('Subject 2', third, 1)})
+        self.assertEqual(ImageSequence.objects.get(format=first).id, first_id)
+        self.assertEqual(Subject.objects.filter(name='Subject 1').count(), 1)
+        self.assertEqual(ImageMetadata.objects.get().image_id, first_id)
+        self.assertFalse(ImportManifest.objects.filter(path=os.path.dirname(second)).exists())
+
+    def test_unchanged_folders_are_not_listed(self):
+        self.create_sequence('Subject 1', 'Sequence 1', 3)
+        self.create_sequence('Subject 1', 'Sequence 2', 2)
+        self.touch(os.path.join(self.path, 'Subject 1'))
+        self.import_data()
+        with mock.patch('os.scandir', wraps=os.scandir) as scandir:
+            success, message = self.import_data()
+        self.assertEqual([call[0][0] for call in scandir.call_args_list], [self.path])
+        self.assertIn('0 image sequences added, 0 changed and 0 not found', message)
+
+        # Only the changed folder is listed
+        self.create_sequence('Subject 1', 'Sequence 2', 4)
+        with mock.patch('os.scandir', wraps=os.scandir) as scandir:
+            self.import_data()
+        self.assertEqual([call[0][0] for call in scandir.call_args_list], [self.path, os.path.join(self.path, 'Subject 1', 'Sequence 2')])
+        self.assertEqual(ImageSequence.objects.get(format__contains='Sequence 2').nr_of_frames, 4)
+
+    @override_settings(RUN_JOBS_IN_BACKGROUND=False)
+    def test_import_job(self):
+        self.create_sequence('Subject 1', 'Sequence 1', 3)
+        self.client.force_login(User.objects.create(username='admin', is_staff=True))
+        response = self.client.post(reverse('import_options', args=[self.dataset.id, 0]), {'path': self.path})
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('job', args=[job.id]))
+        self.assertEqual((job.status, job.progress, job.total), (Job.STATUS_FINISHED, 1, 1))
+        self.assertIn('Import finished: ' + self.path + ': 1 image sequences added', job.message)
+        self.assertEqual(ImageSequence.objects.count(), 1)
+        self.assertContains(self.client.get(reverse('jobs')), reverse('job', args=[job.id]))
+
+    def test_import_job_is_run_by_worker(self):
+        self.create_sequence('Subject 1', 'Sequence 1', 3)
+        self.client.force_login(User.objects.create(username='admin', is_staff=True))
+        self.client.post(reverse('import_options', args=[self.dataset.id, 0]), {'path': self.path})
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.process), (Job.STATUS_QUEUED, ''))
+        self.assertFalse(ImageSequence.objects.exists())
+
+        call_command('run_jobs', '--once', stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.process), (Job.STATUS_FINISHED, get_process_name()))
+        self.assertEqual(ImageSequence.objects.count(), 1)
+
+    def test_cancel_import_job(self):
+        self.create_sequence('Subject 1', 'Sequence 1', 3)
+        self.client.force_login(User.objects.create(username='admin', is_staff=True))
+        job = Job.objects.create(name='Import', status=Job.STATUS_RUNNING)
+        self.client.post(reverse('cancel_job', args=[job.id]))
+        self.assertTrue(self.client.get(reverse('job_status', args=[job.id])).json()['cancel'])
+
+        importer = ImageSequenceImporter()
+        importer.dataset = self.dataset
+        form = ImageSequenceImporterForm({'path': self.path})
+        form.is_valid()
+        run_job(job, import_in_background, importer, form)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_CANCELLED)
+        self.assertFalse(ImageSequence.objects.exists())
+
+        # Finished jobs are not changed
+        self.client.post(reverse('cancel_job', args=[job.id]))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_CANCELLED)
+
+    def test_failed_scan_cancels_pending_folders(self):
+        for i in range(20):
+            self.create_sequence('Subject 1', 'Sequence ' + str(i), 1)
+        scanned = []
+
+        def scan_sequence_folder(scanner, path):
+            scanned.append(path)
+            if len(scanned) > 1:
+                time.sleep(0.1)
+            raise OSError('Folder can not be read')
+
+        with mock.patch.object(ImageSequenceImporter, 'workers', 1), \
+                mock.patch.object(FolderScanner, 'scan_sequence_folder', autospec=True, side_effect=scan_sequence_folder):
+            with self.assertRaises(OSError):
+                self.import_data()
+        # The folder being scanned when the first one failed is finished, the others are never started
+        self.assertLessEqual(len(scanned), 2)
+
+    def test_start_frame(self):
+        format = self.create_sequence('Subject 1', 'Sequence 1', 3)
+        os.remove(format.replace('#', '0'))
+        open(format.replace('#', '5'), 'w').close()
+        self.import_data()
+        self.assertEqual(ImageSequence.objects.values_list('start_frame_nr', 'nr_of_frames').get(), (1, 2))
+
+    def test_queries_do_not_depend_on_number_of_sequences(self):
+        for i in range(10):
+            self.create_sequence('Subject ' + str(i % 2), 'Sequence ' + str(i), 2, metadata='Index: ' + str(i) + '\n')
+        with CaptureQueriesContext(connection) as queries:
+            self.import_data()
+        self.assertEqual(ImageSequence.objects.count(), 10)
+        self.assertEqual(ImageMetadata.objects.count(), 10)
+        self.assertLess(len(queries), 20)
+
+    def test_duplicates_are_reported(self):
+        first = self.create_sequence('Subject 1', 'Sequence 1', 3)
+        with open(first.replace('#', '1'), 'w') as f:
+            f.write('frame')
+        self.import_data()
+
+        # The same sequence stored under another subject, and a sequence with other content
+        second = self.create_sequence('Subject 2', 'Sequence 1', 3)
+        shutil.copyfile(first.replace('#', '1'), second.replace('#', '1'))
+        self.create_sequence('Subject 2', 'Sequence 2', 3)
+        success, message = self.import_data()
+        self.assertIn('2 image sequences added', message)
+        self.assertIn('1 duplicates found.', message)
+        self.assertEqual(ImageSequence.objects.get(format=first).content_hash, ImageSequence.objects.get(format=second).content_hash)
+        self.assertEqual(ImageSequence.objects.values('content_hash').distinct().count(), 2)
+
+    def test_copy_of_sequence_without_hash_is_found(self):
+        first = self.create_sequence('Subject 1', 'Sequence 1', 3)
+        missing = self.create_sequence('Subject 1', 'Sequence 2', 2)
+        self.import_data()
+        # Imported before content hashes were stored
+        ImageSequence.objects.update(content_hash='')
+        shutil.rmtree(os.path.dirname(missing))
+
+        second = self.create_sequence('Subject 2', 'Sequence 1', 3)
+        success, message = self.import_data()
+        self.assertIn('1 duplicates found.', message)
+        self.assertEqual(ImageSequence.objects.get(format=first).content_hash, ImageSequence.objects.get(format=second).content_hash)
+        # Sequences which can't be read are not hashed again by the next import
+        self.assertEqual(ImageSequence.objects.get(format=missing).content_hash, ImageSequence.HASH_UNREADABLE)
+        with mock.patch('importers.image_sequence_importer.hash_image_sequence') as hash_image_sequence:
+            self.import_data()
+        self.assertFalse(hash_image_sequence.called)
+
+    def test_duplicates_are_skipped(self):
+        self.create_sequence('Subject 1', 'Sequence 1', 3)
+        self.create_sequence('Subject 2', 'Sequence 1', 3)
+        self.create_sequence('Subject 2', 'Sequence 2', 2)
+        success, message = self.import_data(duplicates=ImageSequenceImporterForm.DUPLICATES_SKIP)
+        self.assertIn('2 image sequences added', message)
+        self.assertIn('1 duplicates skipped.', message)
+        self.assertEqual(ImageSequence.objects.filter(nr_of_frames=3).count(), 1)
+
+    def test_hash_samples_frames(self):
+        format = self.create_sequence('Subject 1', 'Sequence 1', 10)
+        content_hash = hash_image_sequence(format, 0, 10, max_frames=4)
+        self.assertNotEqual(hash_image_sequence(format, 0, 10), content_hash)
+        # Frames 0, 3, 6 and 9 are hashed
+        with open(format.replace('#', '4'), 'w') as f:
+            f.write('frame')
+        self.assertEqual(hash_image_sequence(format, 0, 10, max_frames=4), content_hash)
+        with open(format.replace('#', '3'), 'w') as f:
+            f.write('frame')
+        self.assertNotEqual(hash_image_sequence(format, 0, 10, max_frames=4), content_hash)
+
+    def test_mixed_extensions(self):
+        self.create_sequence('Subject 1', 'Sequence 1', 1)
+        self.create_sequence('Subject 1', 'Sequence 1', 1, extension='.mhd')
+        with self.assertRaises(Exception):
+            self.import_data()
+
+
+class PackTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'data')
+        self.pack_path = os.path.join(self.directory.name, 'packed')
+        self.dataset = Dataset.objects.create(name='Dataset')
+        # 3 frames of 3x2 pixels, where each pixel has the frame number as value
+        self.frames = np.repeat(np.arange(3, dtype=np.uint8), 6).reshape((3, 2, 3))
+        self.formats = [self.create_sequence('Sequence ' + str(i)) for i in range(2)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_sequence(self, sequence):
+        sequence_dir = os.path.join(self.path, 'Subject', sequence)
+        os.makedirs(sequence_dir)
+        for i, frame in enumerate(self.frames):
+            PIL.Image.fromarray(frame).save(os.path.join(sequence_dir, 'frame_' + str(i) + '.png'))
+        return os.path.join(sequence_dir, 'frame_#.png')
+
+    def import_data(self):
+        importer = ImageSequenceImporter()
+        importer.dataset = self.dataset
+        importer.workers = 2
+        form = ImageSequenceImporterForm({'path': self.path, 'pack_path': self.pack_path})
+        self.assertTrue(form.is_valid())
+        return importer.import_data(form)
+
+    def import_data_without_packing(self):
+        importer = ImageSequenceImporter()
+        importer.dataset = self.dataset
+        form = ImageSequenceImporterForm({'path': self.path})
+        self.assertTrue(form.is_valid())
+        return importer.import_data(form)
+
+    def test_pack_on_import(self):
+        success, message = self.import_data()
+        self.assertIn('2 image sequences packed to ' + self.pack_path + ', 0 failed.', message)
+        for image in ImageSequence.objects.all():
+            self.assertEqual(image.packed_file, get_packed_filename(self.pack_path, image.id))
+            np.testing.assert_array_equal(np.load(image.packed_file, mmap_mode='r'), self.frames)
+            self.assertEqual(read_sidecar(image.packed_file), {'format': image.format, 'start_frame_nr': 0, 'nr_of_frames': 3,
+                                                               'height': 2, 'width': 3, 'channels': 1, 'spacing': [1.0, 1.0]})
+
+    def test_sidecar_is_written_first(self):
+        filename = os.path.join(self.directory.name, 'sequence.npy')
+        with mock.patch('os.replace', wraps=os.replace) as replace:
+            pack_frames(self.formats[0], 0, 3, filename)
+        # The .npy file is only moved into place when its sidecar exists
+        self.assertEqual([call[0][1] for call in replace.call_args_list], [get_sidecar_filename(filename), filename])
+
+    def test_resume_requires_sidecar(self):
+        self.import_data()
+        image = ImageSequence.objects.get(format=self.formats[0])
+        os.remove(get_sidecar_filename(image.packed_file))
+        ImageSequence.objects.update(packed_file='')
+        pack_image_sequences(ImageSequence.objects.all(), self.pack_path, workers=1)
+        image.refresh_from_db()
+        self.assertEqual(read_sidecar(image.packed_file)['nr_of_frames'], 3)
+
+    def test_show_frame_reads_pack(self):
+        self.import_data()
+        image = ImageSequence.objects.get(format=self.formats[0])
+        # Frames are read from the packed store only
+        shutil.rmtree(os.path.dirname(image.format))
+        task = Task.objects.create(name='Task', type=Task.BOUNDING_BOX)
+        self.client.force_login(User.objects.create(username='annotater'))
+        response = self.client.get(reverse('show_frame', args=[image.id, 2, task.id]))
+        self.assertEqual(response['Content-Type'], 'image/png')
+        np.testing.assert_array_equal(np.asarray(PIL.Image.open(io.BytesIO(response.content))), self.frames[2])
+
+    def test_resume(self):
+        self.import_data()
+        filenames = dict(ImageSequence.objects.values_list('id', 'packed_file'))
+        modified = {id: os.stat(filename).st_mtime_ns for id, filename in filenames.items()}
+
+        # Packed sequences which were not stored before the conversion was stopped are not packed again
+        ImageSequence.objects.update(packed_file='')
+        count, errors = pack_image_sequences(ImageSequence.objects.all(), self.pack_path, workers=1)
+        self.assertEqual((count, errors), (2, []))
+        self.assertEqual(dict(ImageSequence.objects.values_list('id', 'packed_file')), filenames)
+        self.assertEqual({id: os.stat(filename).st_mtime_ns for id, filename in filenames.items()}, modified)
+
+    def test_stop_cancels_pending_sequences(self):
+        self.formats += [self.create_sequence('Sequence ' + str(i)) for i in range(2, 8)]
+        self.import_data_without_packing()
+
+        def stop(count):
+            if count > 0:
+                raise JobCancelled
+
+        with self.assertRaises(JobCancelled):
+            pack_image_sequences(ImageSequence.objects.all(), self.pack_path, workers=1, progress=stop, chunk_size=1)
+        # Sequences which were not started are not transcoded
+        self.assertLess(len([filename for filename in os.listdir(self.pack_path) if filename.endswith('.npy')]), 8)
+        self.assertEqual(ImageSequence.objects.exclude(packed_file='').count(), 1)
+
+    def test_changed_sequence_is_packed_again(self):
+        self.import_data()
+        image = ImageSequence.objects.get(format=self.formats[0])
+        PIL.Image.fromarray(self.frames[0]).save(image.format.replace('#', '3'))
+        os.utime(os.path.dirname(image.format), ns=(10**18, 10**18))
+        self.import_data()
+        image.refresh_from_db()
+        self.assertEqual(image.nr_of_frames, 4)
+        self.assertEqual(np.load(image.packed_file, mmap_mode='r').shape, (4, 2, 3))
+
+
+class RunPluginCommandTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'data')
+        self.dataset = Dataset.objects.create(name='Dataset')
+        sequence_dir = os.path.join(self.path, 'Subject', 'Sequence')
+        os.makedirs(sequence_dir)
+        for i in range(3):
+            PIL.Image.fromarray(np.full((2, 3), i, dtype=np.uint8)).save(os.path.join(sequence_dir, 'frame_' + str(i) + '.png'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_form_data(self):
+        data = get_form_data({'path': '/data', 'subjects': [1, 2], 'delete_existing_data': True}, ['subjects=3', 'subjects=4', 'a=b=c'])
+        self.assertEqual(data['path'], '/data')
+        self.assertEqual(data.getlist('subjects'), ['3', '4'])
+        self.assertIs(data['delete_existing_data'], True)
+        self.assertEqual(data['a'], 'b=c')
+        with self.assertRaises(ValueError):
+            get_form_data(values=['path'])
+
+    def test_run_importer(self):
+        spec = os.path.join(self.directory.name, 'import.json')
+        with open(spec, 'w') as f:
+            json.dump({'path': '/wrong', 'duplicates': ImageSequenceImporterForm.DUPLICATES_SKIP}, f)
+        output = io.StringIO()
+        call_command('run_importer', 'ImageSequenceImporter', '--dataset', str(self.dataset.id), '--spec', spec,
+                     '--set', 'path=' + self.path, '--workers', '2', stdout=output)
+        self.assertIn('1 image sequences added', output.getvalue())
+        self.assertEqual(ImageSequence.objects.values_list('subject__dataset', 'nr_of_frames').get(), (self.dataset.id, 3))
+        self.assertEqual(Job.objects.get().status, Job.STATUS_FINISHED)
+
+    def test_run_importer_errors(self):
+        with self.assertRaisesMessage(CommandError, 'Importer not found'):
+            call_command('run_importer', 'Missing', '--dataset', str(self.dataset.id))
+        with self.assertRaisesMessage(CommandError, 'Invalid importer options'):
+            call_command('run_importer', 'Image sequence importer', '--dataset', str(self.dataset.id))
+        with self.assertRaisesMessage(CommandError, 'Import failed'), mock.patch('traceback.print_exc'):
+            call_command('run_importer', '0', '--dataset', str(self.dataset.id), '--set', 'path=/does/not/exist',
+                         stdout=io.StringIO())
+
+    def test_run_exporter(self):
+        call_command('run_importer', 'ImageSequenceImporter', '--dataset', str(self.dataset.id), '--set', 'path=' + self.path,
+                     stdout=io.StringIO())
+        user = User.objects.create(username='annotater')
+        label = Label.objects.create(name='Label')
+        task = Task.objects.create(name='Task', type=Task.BOUNDING_BOX)
+        task.dataset.add(self.dataset)
+        task.label.add(label)
+        annotation = ImageAnnotation.objects.create(image=ImageSequence.objects.get(), task=task, user=user, rejected=False,
+                                                    image_quality=ImageAnnotation.QUALITY_OK, comments='')
+        for frame_nr in (0, 2):
+            key_frame = KeyFrameAnnotation.objects.create(image_annotation=annotation, frame_nr=frame_nr)
+            BoundingBox.objects.create(image=key_frame, x=1, y=0, width=2, height=2, label=label)
+
+        export_path = os.path.join(self.directory.name, 'export')
+        output = io.StringIO()
+        call_command('run_exporter', str(task.id), 'BoundingBoxExporter', '--set', 'path=' + export_path,
+                     '--set', 'subjects=' + str(Subject.objects.get().id), '--workers', '2', stdout=output)
+        self.assertIn('Export finished', output.getvalue())
+        for frame_nr in (0, 2):
+            image = PIL.Image.open(os.path.join(export_path, 'Subject', 'frame_' + str(frame_nr) + '.png'))
+            np.testing.assert_array_equal(np.asarray(image), np.full((2, 3), frame_nr, dtype=np.uint8))
+            with open(os.path.join(export_path, 'Subject', str(frame_nr) + '.txt')) as f:
+                self.assertEqual(f.read(), '0 2 1 2 2\n')
+
+
+class PluginRegistryTests(TestCase):
+
+    def test_plugins_are_loaded_once(self):
+        task = Task.objects.create(name='Task', type=Task.CLASSIFICATION)
+        self.client.force_login(User.objects.create(username='admin', is_staff=True))
+        with mock.patch('common.exporter.load_plugin_modules') as load_exporter_modules, \
+                mock.patch('common.importer.load_plugin_modules') as load_importer_modules:
+            response = self.client.get(reverse('export', args=[task.id]))
+            self.assertEqual(find_all_importers(), find_all_importers())
+        self.assertFalse(load_exporter_modules.called)
+        self.assertFalse(load_importer_modules.called)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Default image classification exporter')
+
+    def test_registry(self):
+        self.assertEqual([exporter.__name__ for exporter in find_all_exporters(Task.BOUNDING_BOX)], ['BoundingBoxExporter'])
+        self.assertEqual(find_all_exporters('unknown'), [])
+        # Same classes as when imported directly
+        self.assertEqual(find_all_importers(), [ImageSequenceImporter])
+
+    def test_reload(self):
+        exporters = find_all_exporters(Task.CLASSIFICATION)
+        try:
+            load_exporters(reload=True)
+            reloaded = find_all_exporters(Task.CLASSIFICATION)
+            self.assertEqual([exporter.__name__ for exporter in reloaded], [exporter.__name__ for exporter in exporters])
+            self.assertNotEqual(reloaded, exporters)
+        finally:
+            load_exporters(reload=True)
+
+
+class JobViewTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create(username='admin', is_staff=True))
+
+    def test_missing_job(self):
+        self.assertEqual(self.client.get(reverse('job', args=[1])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('job_status', args=[1])).status_code, 404)
+
+    def test_job_of_stopped_process_fails(self):
+        job = Job.objects.create(name='Import', status=Job.STATUS_RUNNING, process=get_process_name())
+        self.assertEqual(self.client.get(reverse('job_status', args=[job.id])).json()['status'], Job.STATUS_RUNNING)
+
+        with mock.patch('os.kill', side_effect=ProcessLookupError):
+            data = self.client.get(reverse('job_status', args=[job.id])).json()
+        self.assertEqual(data['status'], Job.STATUS_FAILED)
+        self.assertIn('The process running the job has stopped', data['message'])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertIsNotNone(job.finished)
+
+    def test_job_of_other_host_is_kept(self):
+        job = Job.objects.create(name='Import', status=Job.STATUS_RUNNING, process='other-host:1')
+        with mock.patch('os.kill', side_effect=ProcessLookupError):
+            self.client.get(reverse('jobs'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_RUNNING)
+
+    def test_jobs_are_claimed_once(self):
+        job = Job.objects.create(name='Job', function='common.task.copy_task', arguments='[1]')
+        self.assertEqual(claim_job(), job)
+        self.assertIsNone(claim_job())
+        self.assertEqual(Job.objects.get().status, Job.STATUS_RUNNING)
+
+    def test_cancelled_queued_job_is_not_started(self):
+        Job.objects.create(name='Job', function='common.task.copy_task', arguments='[1]', cancel=True)
+        with mock.patch('common.task.copy_task') as copy_task:
+            call_command('run_jobs', '--once', stdout=io.StringIO())
+        self.assertFalse(copy_task.called)
+        self.assertEqual(Job.objects.get().status, Job.STATUS_CANCELLED)
+
+    def test_unknown_function_fails(self):
+        Job.objects.create(name='Job', function='common.task.missing', arguments='[]')
+        call_command('run_jobs', '--once', stdout=io.StringIO())
+        self.assertEqual(Job.objects.get().status, Job.STATUS_FAILED)
+
+
+@override_settings(RUN_JOBS_IN_BACKGROUND=False)
+class CopyTaskTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='admin', is_staff=True)
+        cls.dataset = Dataset.objects.create(name='Dataset')
+        subject = Subject.objects.create(name='Subject', dataset=cls.dataset)
+        cls.label = Label.objects.create(name='Label')
+        cls.task = Task.objects.create(name='Task', type=Task.BOUNDING_BOX)
+        cls.task.dataset.add(cls.dataset)
+        cls.task.label.add(cls.label)
+        for i in range(5):
+            image = ImageSequence.objects.create(format='/data/frame_#.png', subject=subject, nr_of_frames=10)
+            annotation = ImageAnnotation.objects.create(image=image, task=cls.task, user=cls.user, rejected=False,
+                                                        image_quality=ImageAnnotation.QUALITY_OK, comments='')
+            for frame_nr in (1, 5):
+                key_frame = KeyFrameAnnotation.objects.create(image_annotation=annotation, frame_nr=frame_nr)
+                BoundingBox.objects.create(image=key_frame, x=i, y=frame_nr, width=1, height=1, label=cls.label)
+
+    def get_copy(self):
+        return Task.objects.get(name='Task Copy')
+
+    def test_copy_key_frames(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('copy_task', args=[self.task.id]), {'choice': 'Yes'})
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('job', args=[job.id]))
+        self.assertEqual(job.status, Job.STATUS_FINISHED)
+        self.assertEqual(job.percentage_finished, 100)
+
+        task = self.get_copy()
+        self.assertEqual(list(task.dataset.all()), [self.dataset])
+        self.assertEqual(list(task.label.all()), [self.label])
+        self.assertEqual(ImageAnnotation.objects.filter(task=task, finished=False).count(), 5)
+        self.assertEqual(KeyFrameAnnotation.objects.filter(image_annotation__task=task).count(), 10)
+        self.assertEqual(BoundingBox.objects.filter(image__image_annotation__task=task).count(), 0)
+
+    def test_copy_annotations(self):
+        job = Job.objects.create(name='Copy')
+        copy_task(job, self.task.id, copy_annotations=True, chunk_size=2)
+        self.assertEqual((job.progress, job.total), (5, 5))
+
+        task = self.get_copy()
+        self.assertEqual(ImageAnnotation.objects.filter(task=task, finished=True).count(), 5)
+        boxes = BoundingBox.objects.filter(image__image_annotation__task=task)
+        self.assertEqual(sorted((box.image.image_annotation.image_id, box.image.frame_nr, box.y) for box in boxes),
+                         sorted((box.image.image_annotation.image_id, box.image.frame_nr, box.y)
+                                for box in BoundingBox.objects.filter(image__image_annotation__task=self.task)))
+
+    def test_failed_copy_is_removed(self):
+        copy_annotations = common.task._copy_annotations
+        chunks = []
+
+        def fail_in_second_chunk(*args):
+            chunks.append(args)
+            if len(chunks) == 2:
+                raise RuntimeError('Copy failed')
+            copy_annotations(*args)
+
+        job = Job.objects.create(name='Copy')
+        with mock.patch('common.task._copy_annotations', side_effect=fail_in_second_chunk):
+            with self.assertRaises(RuntimeError):
+                copy_task(job, self.task.id, copy_annotations=True, chunk_size=2)
+        self.assertFalse(Task.objects.filter(name='Task Copy').exists())
+        self.assertEqual(ImageAnnotation.objects.count(), 5)
+        self.assertEqual(BoundingBox.objects.count(), 10)
+
+    def test_failed_copy_is_hidden_until_removed(self):
+        job = Job.objects.create(name='Copy')
+        with mock.patch('common.task._copy_annotations', side_effect=RuntimeError('Copy failed')), \
+                mock.patch('common.task.delete_object', side_effect=RuntimeError('Delete failed')):
+            with self.assertRaises(RuntimeError):
+                copy_task(job, self.task.id)
+        self.assertTrue(Task.objects.get(name='Task Copy').deleted)
+
+
+@override_settings(RUN_JOBS_IN_BACKGROUND=False)
+class DeleteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='admin', is_staff=True)
+        cls.dataset = Dataset.objects.create(name='Dataset')
+        cls.subjects = [Subject.objects.create(name='Subject ' + str(i), dataset=cls.dataset) for i in range(2)]
+        cls.label = Label.objects.create(name='Label')
+        cls.task = Task.objects.create(name='Task', type=Task.BOUNDING_BOX)
+        cls.task.dataset.add(cls.dataset)
+        cls.task.label.add(cls.label)
+        cls.task.user.add(cls.user)
+        for subject in cls.subjects:
+            for i in range(3):
+                image = ImageSequence.objects.create(format='/data/frame_#.png', subject=subject, nr_of_frames=10)
+                ImageMetadata.objects.create(image=image, name='Probe', value=subject.name)
+                annotation = ImageAnnotation.objects.create(image=image, task=cls.task, user=cls.user, rejected=False,
+                                                            image_quality=ImageAnnotation.QUALITY_OK, comments='')
+                for frame_nr in (1, 5):
+                    key_frame = KeyFrameAnnotation.objects.create(image_annotation=annotation, frame_nr=frame_nr)
+                    BoundingBox.objects.create(image=key_frame, x=0, y=0, width=1, height=1, label=cls.label)
+        update_metadata_facets(cls.dataset)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_delete_task(self):
+        response = self.client.post(reverse('delete_task', args=[self.task.id]), {'choice': 'Yes'})
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('job', args=[job.id]))
+        self.assertEqual((job.status, job.progress, job.total), (Job.STATUS_FINISHED, 6, 6))
+        self.assertFalse(Task.objects.exists())
+        self.assertFalse(ImageAnnotation.objects.exists())
+        self.assertFalse(KeyFrameAnnotation.objects.exists())
+        self.assertFalse(BoundingBox.objects.exists())
+        self.assertFalse(Task.dataset.through.objects.exists())
+        self.assertEqual(ImageSequence.objects.count(), 6)
+        self.assertTrue(Label.objects.exists())
+
+    def test_delete_subject(self):
+        self.client.post(reverse('delete_subject', args=[self.subjects[0].id]), {'choice': 'Yes'})
+        self.assertEqual(list(Subject.objects.all()), [self.subjects[1]])
+        self.assertEqual(ImageSequence.objects.count(), 3)
+        self.assertEqual(BoundingBox.objects.count(), 6)
+        self.assertEqual(get_image_ids_with_metadata(self.task, {'Probe': [self.subjects[0].name]}), [])
+
+    def test_delete_dataset(self):
+        self.client.post(reverse('delete_dataset', args=[self.dataset.id]), {'choice': 'Yes'})
+        self.assertFalse(Dataset.objects.exists())
+        self.assertFalse(ImageMetadata.objects.exists())
+        self.assertFalse(MetadataFacet.objects.exists())
+        self.assertFalse(BoundingBox.objects.exists())
+        self.assertEqual(list(Task.objects.all()), [self.task])
+
+    @override_settings(RUN_JOBS_IN_BACKGROUND=True)
+    def test_object_is_hidden_until_deleted(self):
+        self.client.post(reverse('delete_subject', args=[self.subjects[0].id]), {'choice': 'Yes'})
+        response = self.client.get(reverse('dataset_details', args=[self.dataset.id]))
+        self.assertEqual(list(response.context['subjects']), [self.subjects[1]])
+        self.assertEqual(Task.objects.get().total_number_of_images, 6)
+        request = RequestFactory().get('/')
+        request.session = {}
+        search_filters = SearchFilter(request, self.task)
+        search_filters.set_value('sort_by', ImageListForm.SORT_IMAGE_ID)
+        self.assertEqual(search_filters.get_image_sequences().count(), 3)
+        self.assertEqual(list(search_filters.subjects), [self.subjects[1]])
+        self.assertEqual(search_filters.get_value('subject'), [str(self.subjects[1].id)])
+
+    def test_chunks(self):
+        chunks = []
+        delete_in_chunks(ImageAnnotation.objects.filter(task=self.task), chunk_size=4, progress=chunks.append)
+        self.assertEqual(chunks, [4, 2])
+        self.assertFalse(KeyFrameAnnotation.objects.exists())
+
+    def test_objects_are_not_loaded(self):
+        with CaptureQueriesContext(connection) as queries:
+            delete_in_chunks(ImageSequence.objects.filter(subject=self.subjects[0]), chunk_size=2)
+        self.assertFalse(BoundingBox.objects.filter(image__image_annotation__image__subject=self.subjects[0]).exists())
+        self.assertEqual(BoundingBox.objects.count(), 6)
+        # Only primary keys are selected, the rows are deleted bottom up with one delete per table and chunk
+        selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+        self.assertTrue(all(re.match(r'SELECT "\w+"\."id" FROM', sql) for sql in selects), selects)
+        deletes = [re.match(r'DELETE FROM "(\w+)"', query['sql']).group(1) for query in queries if query['sql'].startswith('DELETE')]
+        self.assertLess(deletes.index('boundingbox_boundingbox'), deletes.index('annotationweb_keyframeannotation'))
+        self.assertLess(deletes.index('annotationweb_imagemetadata'), deletes.index('annotationweb_imagesequence'))
@@ -7,6 +7,10 @@ app_name = 'annotationweb'
 urlpatterns = [
     path('', views.index, name='index'),
     path('copy-task/<int:task_id>/', views.copy_task, name='copy_task'),
+    path('job/<int:job_id>/', views.job, name='job'),
+    path('job-status/<int:job_id>/', views.job_status, name='job_status'),
+    path('cancel-job/<int:job_id>/', views.cancel_job, name='cancel_job'),
+    path('jobs/', views.jobs, name='jobs'),
     path('datasets/', views.datasets, name='datasets'),
     path('add-image-sequence/<int:subject_id>/', views.add_image_sequence, name='add_image_sequence'),
     path('show_frame/<int:image_sequence_id>/<int:frame_nr>/<int:task_id>/', views.show_frame, name='show_frame'),
@@ -31,6 +35,7 @@ urlpatterns = [
     path('annotate/<int:task_id>/', views.annotate_next_image, name='annotate'),
     path('annotate/<int:task_id>/image/<int:image_id>/', views.annotate_image, name='annotate'),
     path('select-key-frames/<int:task_id>/image/<int:image_id>/', views.select_key_frames, name='select_key_frames'),
+    path('select-key-frames/<int:task_id>/', views.select_key_frames_bulk, name='select_key_frames_bulk'),
 
     path('admin/', admin.site.urls),
     path('user/', include('user.urls')),
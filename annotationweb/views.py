@@ -1,18 +1,23 @@
 from django.contrib import messages
 from django.db import transaction
 from django.http import QueryDict
-from django.shortcuts import render, redirect
-from django.http import HttpResponseRedirect, HttpResponse, Http404
+from django.shortcuts import render, redirect, get_object_or_404
+from django.http import HttpResponseRedirect, HttpResponse, Http404, JsonResponse
 from django.contrib.admin.views.decorators import staff_member_required
 from django.template.defaulttags import register
 from common.exporter import find_all_exporters
-from common.utility import get_image_as_http_response
-from common.importer import find_all_importers
+from common.utility import get_frame_as_http_response
+from common.importer import find_all_importers, run_import_job
 from common.search_filters import SearchFilter
 from common.label import get_complete_label_name
+from common.jobs import start_job, fail_stale_jobs
+from common.delete import delete_object
+from common.frames import find_frames, find_container_frames, is_container
+import common.task
 from django.urls import reverse
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 import os
+import json
 from .forms import *
 from .models import *
 from common.user import is_annotater
@@ -29,14 +34,14 @@ def index(request):
 
     if is_annotater(request.user):
         # Show only tasks assigned to this user
-        tasks = Task.objects.filter(user=request.user)
+        tasks = Task.objects.filter(user=request.user, deleted=False)
         get_task_statistics(tasks, request.user)
         context['tasks'] = tasks
         return render(request, 'annotationweb/index_annotater.html', context)
     else:
         # Admin page
         # Classification tasks
-        tasks = Task.objects.all()
+        tasks = Task.objects.filter(deleted=False)
         get_task_statistics(tasks, request.user)
         context['tasks'] = tasks
 
@@ -119,13 +124,11 @@ def import_options(request, dataset_id, importer_index):
     if request.method == 'POST':
         form = importer.get_form(data=request.POST)
         if form.is_valid():
-            success, message = importer.import_data(form)
-            if success:
-                messages.success(request, 'Import finished: ' + message)
-            else:
-                messages.error(request, 'Import failed: ' + message)
-
-            return redirect('index')
+            # The form is validated again by the job, which is run by another process
+            form_data = {name: request.POST.getlist(name) for name in request.POST if name != 'csrfmiddlewaretoken'}
+            job = start_job('Import ' + importer.name + ' to ' + dataset.name, run_import_job,
+                            type(importer).__name__, dataset.id, form_data)
+            return redirect('job', job_id=job.id)
     else:
         # Get unbound form
         form = importer.get_form()
@@ -138,13 +141,12 @@ def show_image(request, image_id, task_id):
         task = Task.objects.get(pk=task_id)
         image = ImageSequence.objects.get(pk=image_id)
         frame = int(image.nr_of_frames/2)
-        filename = image.format.replace('#', str(frame))
     except Task.DoesNotExist:
         raise Http404('Task does not exist')
     except ImageSequence.DoesNotExist:
         raise Http404('Image does not exist')
 
-    return get_image_as_http_response(filename, task.post_processing_method)
+    return get_frame_as_http_response(image, frame, task.post_processing_method)
 
 
 @staff_member_required
@@ -177,16 +179,17 @@ def new_label(request):
 
 @staff_member_required
 def delete_task(request, task_id):
-    # TODO do cleanup after deleting task?
     try:
-        task = Task.objects.get(pk=task_id)
+        task = Task.objects.get(pk=task_id, deleted=False)
     except Task.DoesNotExist:
         return Http404('Task not found')
 
     if request.method == 'POST':
         if request.POST['choice'] == 'Yes':
-            task.delete()
-            messages.success(request, 'The task ' + task.name + ' was deleted.')
+            # Hide the task immediately, and delete it in the background
+            Task.objects.filter(pk=task.pk).update(deleted=True)
+            job = start_job('Delete task ' + task.name, delete_object, Task._meta.label, task.pk)
+            return redirect('job', job_id=job.id)
         return redirect('index')
     else:
         return render(request, 'annotationweb/delete_task.html', {'task': task})
@@ -196,7 +199,7 @@ def delete_task(request, task_id):
 def datasets(request):
     # Show all datasets
     context = {}
-    context['datasets'] = Dataset.objects.all()
+    context['datasets'] = Dataset.objects.filter(deleted=False)
 
     return render(request, 'annotationweb/datasets.html', context)
 
@@ -218,43 +221,22 @@ def new_dataset(request):
 @staff_member_required
 def delete_dataset(request, dataset_id):
     try:
-        dataset = Dataset.objects.get(pk=dataset_id)
+        dataset = Dataset.objects.get(pk=dataset_id, deleted=False)
     except Dataset.DoesNotExist:
         return Http404('Dataset not found')
 
     if request.method == 'POST':
         if request.POST['choice'] == 'Yes':
-            dataset.delete()
-            messages.success(request, 'Dataset ' + dataset.name + ' was deleted.')
+            # Hide the dataset and its image sequences immediately, and delete them in the background
+            Dataset.objects.filter(pk=dataset.pk).update(deleted=True)
+            ImageSequence.objects.filter(subject__dataset=dataset).update(deleted=True)
+            job = start_job('Delete dataset ' + dataset.name, delete_object, Dataset._meta.label, dataset.pk)
+            return redirect('job', job_id=job.id)
         return redirect('datasets')
     else:
         return render(request, 'annotationweb/delete_dataset.html', {'dataset': dataset})
 
 
-def get_start_and_total_frames(file_format):
-    # Find start_number and total number of frames automatically
-    i = 0
-    # Start frame can either be 0 or 1
-    start_frame = None
-    nr_of_frames = 0
-    while True:
-        exists = False
-        if os.path.isfile(file_format.replace('#', str(i))):
-            exists = True
-            nr_of_frames += 1
-        if start_frame is None:
-            if exists:
-                start_frame = i
-            elif i > 1:
-                break
-        else:
-            if not exists:
-                break
-        i += 1
-
-    return start_frame, nr_of_frames
-
-
 @staff_member_required
 def add_image_sequence(request, subject_id):
     try:
@@ -266,18 +248,28 @@ def add_image_sequence(request, subject_id):
         form = ImageSequenceForm(request.POST)
         if form.is_valid():
             new_image_sequence = form.save(commit=False)  # Create new model, but don't save to DB
-            start_frame, total_nr_of_frames = get_start_and_total_frames(new_image_sequence.format)
-            print(start_frame, total_nr_of_frames)
-            if start_frame is None:
-                messages.error(request, 'No data existed with the provided filename format.')
+            try:
+                if is_container(new_image_sequence.format):
+                    start_frame, total_nr_of_frames, missing_frames = find_container_frames(new_image_sequence.format)
+                else:
+                    start_frame, total_nr_of_frames, missing_frames = find_frames(new_image_sequence.format)
+            except ValueError as e:
+                messages.error(request, str(e))
             else:
-                new_image_sequence.nr_of_frames = total_nr_of_frames
-                new_image_sequence.start_frame_nr = start_frame
-                new_image_sequence.subject = subject
-
-                new_image_sequence.save()  # Save to db
-                messages.success(request, 'Sequence successfully added')
-                return redirect('dataset_details', subject.dataset.id)
+                if start_frame is None:
+                    messages.error(request, 'No data existed with the provided filename format.')
+                else:
+                    new_image_sequence.nr_of_frames = total_nr_of_frames
+                    new_image_sequence.start_frame_nr = start_frame
+                    new_image_sequence.subject = subject
+
+                    new_image_sequence.save()  # Save to db
+                    messages.success(request, 'Sequence successfully added')
+                    if len(missing_frames) > 0:
+                        messages.warning(request, 'Only frames ' + str(start_frame) + ' to ' + str(missing_frames[0] - 1) +
+                                         ' were added, because these frames are missing: ' +
+                                         ', '.join(str(frame_nr) for frame_nr in missing_frames))
+                    return redirect('dataset_details', subject.dataset.id)
     else:
         form = ImageSequenceForm()
 
@@ -299,45 +291,44 @@ def select_key_frames(request, task_id, image_id):
         if len(frame_list) == 0:
             messages.error(request, 'You must select at least 1 frame')
         else:
-            # Add annotation object if not exists
             try:
-                annotation = ImageAnnotation.objects.get(image_id=image_id, task_id=task_id)
-            except ImageAnnotation.DoesNotExist:
-                annotation = ImageAnnotation()
-                annotation.image_id = image_id
-                annotation.task_id = task_id
-                annotation.rejected = False
-                annotation.user = request.user
-                annotation.finished = False
-                annotation.save()
-            # Add frames to db
-            for frame_nr in frame_list:
-                # Add new key frames if not exists
-                print(frame_nr)
-                try:
-                    key_frame = KeyFrameAnnotation.objects.get(image_annotation=annotation, frame_nr=frame_nr)
-                    # Already exists, do nothing
-                except KeyFrameAnnotation.DoesNotExist:
-                    # Does not exist, add it
-                    key_frame = KeyFrameAnnotation()
-                    key_frame.image_annotation = annotation
-                    key_frame.frame_nr = frame_nr
-                    key_frame.save()
-                    if annotation.finished:
-                        # New frame, mark annotation as unfinished
-                        annotation.finished = False
-                        annotation.save()
-
-            # Delete frames that were not added
-            to_delete = KeyFrameAnnotation.objects.filter(image_annotation=annotation).exclude(frame_nr__in=frame_list)
-            deleted_count = len(to_delete)
-            to_delete.delete()
+                created_count, deleted_count = common.task.set_key_frames(
+                    task, request.user, {image_sequence.id: [int(frame_nr) for frame_nr in frame_list]})
+            except ValueError as e:
+                messages.error(request, str(e))
+                return redirect('select_key_frames', task.id, image_sequence.id)
 
             messages.success(request, 'The ' + str(len(frame_list)) + ' key frames were stored. ' + str(deleted_count) + ' key frames were deleted.')
             return redirect('task', task_id)
-    else:
-        frames = KeyFrameAnnotation.objects.filter(image_annotation__image=image_sequence, image_annotation__task=task)
-        return render(request, 'annotationweb/add_key_frames.html', {'image_sequence': image_sequence, 'task': task, 'frames': frames})
+
+    frames = KeyFrameAnnotation.objects.filter(image_annotation__image=image_sequence, image_annotation__task=task)
+    return render(request, 'annotationweb/add_key_frames.html', {'image_sequence': image_sequence, 'task': task, 'frames': frames})
+
+
+@staff_member_required
+def select_key_frames_bulk(request, task_id):
+    """
+    Select the key frames of many image sequences of a task at once.
+    Expects a POST request with a JSON body: {"key_frames": {image_id: [frame_nr, ..], ..}}
+    The key frames of each given image sequence are replaced, an empty list removes all its key frames.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': 'false', 'message': 'Must use POST when selecting key frames.'}, status=405)
+
+    try:
+        task = Task.objects.get(pk=task_id)
+        data = json.loads(request.body)
+        key_frames = {int(image_id): [int(frame_nr) for frame_nr in frame_nrs] for image_id, frame_nrs in data['key_frames'].items()}
+        created_count, deleted_count = common.task.set_key_frames(task, request.user, key_frames)
+    except Exception as e:
+        return JsonResponse({'success': 'false', 'message': str(e)}, status=400)
+
+    return JsonResponse({
+        'success': 'true',
+        'message': 'The key frames of ' + str(len(key_frames)) + ' image sequences were stored.',
+        'created': created_count,
+        'deleted': deleted_count,
+    })
 
 
 def show_frame(request, image_sequence_id, frame_nr, task_id):
@@ -350,9 +341,7 @@ def show_frame(request, image_sequence_id, frame_nr, task_id):
     except ImageSequence.DoesNotExist:
         raise Http404('Image sequence does not exist')
 
-    filename = image_sequence.format.replace('#', str(frame_nr))
-
-    return get_image_as_http_response(filename, task.post_processing_method)
+    return get_frame_as_http_response(image_sequence, frame_nr, task.post_processing_method)
 
 
 @staff_member_required()
@@ -362,7 +351,8 @@ def dataset_details(request, dataset_id):
     except Dataset.DoesNotExist:
         return Http404('The dataset does not exist')
 
-    return render(request, 'annotationweb/dataset_details.html', {'dataset': dataset})
+    subjects = dataset.subject_set.filter(deleted=False)
+    return render(request, 'annotationweb/dataset_details.html', {'dataset': dataset, 'subjects': subjects})
 
 
 @staff_member_required()
@@ -389,14 +379,17 @@ def new_subject(request, dataset_id):
 @staff_member_required()
 def delete_subject(request, subject_id):
     try:
-        subject = Subject.objects.get(pk=subject_id)
+        subject = Subject.objects.get(pk=subject_id, deleted=False)
     except Subject.DoesNotExist:
         return Http404('The subject does not exist')
 
     if request.method == 'POST':
         if request.POST['choice'] == 'Yes':
-            subject.delete()
-            messages.success(request, 'The subject ' + subject.name + ' was deleted.')
+            # Hide the subject and its image sequences immediately, and delete them in the background
+            Subject.objects.filter(pk=subject.pk).update(deleted=True)
+            ImageSequence.objects.filter(subject=subject).update(deleted=True)
+            job = start_job('Delete subject ' + subject.name, delete_object, Subject._meta.label, subject.pk)
+            return redirect('job', job_id=job.id)
         return redirect('dataset_details', subject.dataset.id)
     else:
         return render(request, 'annotationweb/delete_subject.html', {'subject': subject})
@@ -409,19 +402,22 @@ def subject_details(request, subject_id):
     except Subject.DoesNotExist:
         return Http404('The subject does not exist')
 
-    return render(request, 'annotationweb/subject_details.html', {'subject': subject})
+    sequences = subject.imagesequence_set.filter(deleted=False)
+    return render(request, 'annotationweb/subject_details.html', {'subject': subject, 'sequences': sequences})
 
 @staff_member_required()
 def delete_sequence(request, sequence_id):
     try:
-        sequence = ImageSequence.objects.get(pk=sequence_id)
+        sequence = ImageSequence.objects.get(pk=sequence_id, deleted=False)
     except ImageSequence.DoesNotExist:
         return Http404('The sequence does not exist')
 
     if request.method == 'POST':
         if request.POST['choice'] == 'Yes':
-            sequence.delete()
-            messages.success(request, 'The subject ' + sequence.format + ' was deleted.')
+            # Hide the sequence immediately, and delete it in the background
+            ImageSequence.objects.filter(pk=sequence.pk).update(deleted=True)
+            job = start_job('Delete sequence ' + sequence.format, delete_object, ImageSequence._meta.label, sequence.pk)
+            return redirect('job', job_id=job.id)
         return redirect('subject_details', sequence.subject.id)
     else:
         return render(request, 'annotationweb/delete_sequence.html', {'sequence': sequence})
@@ -501,67 +497,8 @@ def task(request, task_id):
     else:
         form = search_filters.create_form()
 
-    queryset = ImageSequence.objects.all()
-
-    # Get all processed images for given task
-    sort_by = search_filters.get_value('sort_by')
-    subjects_selected = search_filters.get_value('subject')
-    users_selected = search_filters.get_value('user')
-    image_quality = search_filters.get_value('image_quality')
-    metadata = search_filters.get_value('metadata')
-
-    if len(metadata) > 0:
-        metadata_dict = {}
-        for item in metadata:
-            parts = item.split(': ')
-            if len(parts) != 2:
-                raise Exception('Error: must be 2 parts')
-            name = parts[0]
-            value = parts[1]
-            if name in metadata_dict.keys():
-                metadata_dict[name].append(value)
-            else:
-                metadata_dict[name] = [value]
-
-        for name, values in metadata_dict.items():
-            queryset = queryset.filter(
-                imagemetadata__name=name,
-                imagemetadata__value__in=values
-            )
-
-    if sort_by == ImageListForm.SORT_IMAGE_ID:
-        queryset = queryset.filter(
-            subject__dataset__task=task,
-            subject__in=subjects_selected
-        )
-    elif sort_by == ImageListForm.SORT_NOT_ANNOTATED_IMAGE_ID:
-        queryset = queryset.filter(
-            subject__dataset__task=task,
-            subject__in=subjects_selected
-        ).exclude(imageannotation__task=task, imageannotation__finished=True)
-    else:
-        if task.type == Task.CLASSIFICATION:
-            labels_selected = search_filters.get_value('label')
-            queryset = queryset.filter(
-                imageannotation__image_quality__in=image_quality,
-                imageannotation__task=task,
-                imageannotation__finished=True,
-                imageannotation__user__in=users_selected,
-                imageannotation__keyframeannotation__imagelabel__in=labels_selected,
-                subject__in=subjects_selected,
-            )
-        else:
-            queryset = queryset.filter(
-                imageannotation__image_quality__in=image_quality,
-                imageannotation__task=task,
-                imageannotation__finished=True,
-                imageannotation__user__in=users_selected,
-                subject__in=subjects_selected
-            )
-        if sort_by == ImageListForm.SORT_DATE_DESC:
-            queryset = queryset.order_by('-imageannotation__date')
-        else:
-            queryset = queryset.order_by('imageannotation__date')
+    # Get all images for given task matching the current filters
+    queryset = search_filters.get_image_sequences()
 
     paginator = Paginator(queryset, 12)
     page = request.GET.get('page')
@@ -585,7 +522,8 @@ def task(request, task_id):
     return_url = reverse('task', kwargs={'task_id': task_id})
     if page is not None:
         return_url += '?page=' + str(page)
-    request.session['return_to_url'] = return_url
+    if request.session.get('return_to_url') != return_url:
+        request.session['return_to_url'] = return_url
 
     return render(request, 'annotationweb/task.html', {'images': images, 'task': task, 'form': form})
 
@@ -658,43 +596,55 @@ def annotate_image(request, task_id, image_id):
 
 @staff_member_required
 def copy_task(request, task_id):
-    """This will only copy the task itself and key frames, not the annotations"""
+    """Copy the task and its key frames in a background job, optionally with the annotations"""
     try:
         task = Task.objects.get(pk=task_id)
-        with transaction.atomic():
-            datasets = task.dataset.all() # Keep
-            labels = task.label.all() # Keep
-            task.pk = None # Set primary key to none to copy
-            task.name = task.name + ' Copy'
-            task.save()
-
-            # Must take care of relations here.. how?? Copy relations:
-            task.dataset.clear()
-            for dataset in datasets:
-                print(dataset)
-                task.dataset.add(dataset)
-            task.label.clear()
-            for label in labels:
-                print(label)
-                task.label.add(label)
-            task.user.clear() # Not keep
-            task.save()
-
-            # Copy all ImageAnnotation and KeyFrameAnnotations
-            for annotation in ImageAnnotation.objects.filter(task_id=task_id):
-                key_frames = KeyFrameAnnotation.objects.filter(image_annotation=annotation)
-                annotation.finished = False
-                annotation.pk = None # Set primary key to none to copy
-                annotation.task = task
-                annotation.save()
-                for key_frame in key_frames:
-                    key_frame.pk = None
-                    key_frame.image_annotation = annotation
-                    key_frame.save()
-        messages.success(request, 'Task copy complete')
-        return redirect('index')
     except Task.DoesNotExist:
         return Http404('The Task does not exist')
-    except Exception as e:
-        messages.error(request, 'Error in copy: ' + str(e))
+
+    if request.method == 'POST':
+        if request.POST['choice'] == 'Yes':
+            copy_annotations = 'copy_annotations' in request.POST
+            job = start_job('Copy task ' + task.name, common.task.copy_task, task.id, copy_annotations)
+            return redirect('job', job_id=job.id)
         return redirect('index')
+    else:
+        return render(request, 'annotationweb/copy_task.html', {'task': task})
+
+
+@staff_member_required
+def job(request, job_id):
+    job = get_object_or_404(Job, pk=job_id)
+    fail_stale_jobs([job])
+
+    return render(request, 'annotationweb/job.html', {'job': job})
+
+
+@staff_member_required
+def jobs(request):
+    jobs = list(Job.objects.order_by('-created')[:50])
+    fail_stale_jobs(jobs)
+    return render(request, 'annotationweb/jobs.html', {'jobs': jobs})
+
+
+@staff_member_required
+def cancel_job(request, job_id):
+    """Ask a job to stop, it stops at the next step which checks for it"""
+    if request.method == 'POST':
+        Job.objects.filter(id=job_id, status__in=(Job.STATUS_QUEUED, Job.STATUS_RUNNING)).update(cancel=True)
+    return redirect('job', job_id=job_id)
+
+
+@staff_member_required
+def job_status(request, job_id):
+    job = get_object_or_404(Job, pk=job_id)
+    fail_stale_jobs([job])
+
+    return JsonResponse({
+        'status': job.status,
+        'progress': job.progress,
+        'total': job.total,
+        'percentage': job.percentage_finished,
+        'message': job.message,
+        'cancel': job.cancel,
+    })
@@ -1,3 +1,24 @@
-from django.test import TestCase
+from annotationweb.models import Task
+from annotationweb.testing import SaveAnnotationTestCase, get_frame_data
+from .models import BoundingBox
 
-# Create your tests here.
+
+class SaveBoxesTests(SaveAnnotationTestCase):
+    task_type = Task.BOUNDING_BOX
+    save_view = 'boundingbox:save'
+
+    def save_boxes(self, nr_of_frames, label_id=None):
+        # Two boxes in each frame
+        box = {'x': 1, 'y': 2, 'width': 3, 'height': 4, 'label_id': label_id or self.label.id}
+        return self.save(nr_of_frames, boxes=get_frame_data(nr_of_frames, [box, box]))
+
+    def test_query_count_is_independent_of_frame_count(self):
+        response, queries = self.save_boxes(1)
+        self.assertEqual(response['success'], 'true')
+        self.assertEqual(self.save_boxes(20)[1], queries)
+        self.assertEqual(BoundingBox.objects.count(), 42)
+
+    def test_unknown_label(self):
+        response, queries = self.save_boxes(2, label_id=self.label.id + 100)
+        self.assertEqual(response['success'], 'false')
+        self.assertEqual(BoundingBox.objects.count(), 0)
@@ -8,6 +8,7 @@ from django.http import HttpResponse, Http404, JsonResponse, HttpResponseRedirec
 import random
 import json
 import common.task
+from common.label import check_labels_exist
 from django.db import transaction
 
 
@@ -24,7 +25,8 @@ def process_image(request, task_id, image_id):
         try:
             annotations = KeyFrameAnnotation.objects.filter(image_annotation__task_id=task_id,
                                                             image_annotation__image_id=image_id)
-            context['boxes'] = BoundingBox.objects.filter(image__in=annotations)
+            context['annotation_data'] = list(BoundingBox.objects.filter(image__in=annotations)
+                                              .values_list('image__frame_nr', 'x', 'y', 'width', 'height', 'label_id'))
             context['target_frames'] = annotations
         except KeyFrameAnnotation.DoesNotExist:
             pass
@@ -45,7 +47,7 @@ def save_boxes(request):
             boxes = json.loads(request.POST['boxes'])
 
             # Store every box
-            counter = 0
+            new_boxes = []
             for annotation in annotations:
                 frame_nr = str(annotation.frame_nr)
                 for box in boxes[frame_nr]:
@@ -56,8 +58,10 @@ def save_boxes(request):
                     bb.height = int(box['height'])
                     bb.image = annotation
                     bb.label_id = int(box['label_id'])
-                    bb.save()
-                    counter += 1
+                    new_boxes.append(bb)
+            check_labels_exist({bb.label_id for bb in new_boxes})
+            common.task.save_key_frame_rows(BoundingBox, annotations, new_boxes, ['x', 'y', 'width', 'height', 'label'])
+            counter = len(new_boxes)
 
             response = {
                 'success': 'true',
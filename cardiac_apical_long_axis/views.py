@@ -13,8 +13,8 @@ import numpy as np
 from annotationweb.models import Task, ImageAnnotation, Label
 from common.utility import get_image_as_http_response
 import common.task
+import common.control_points
 from annotationweb.models import KeyFrameAnnotation
-from spline_segmentation.models import ControlPoint
 from django.db import transaction
 
 
@@ -65,8 +65,7 @@ def segment_image(request, task_id, image_id):
 
             annotations = KeyFrameAnnotation.objects.filter(image_annotation__task_id=task_id,
                                                             image_annotation__image_id=image_id)
-            control_points = ControlPoint.objects.filter(image__in=annotations).order_by('index')
-            context['control_points'] = control_points
+            context['annotation_data'] = common.control_points.get_contour_data(annotations)
             context['target_frames'] = annotations
         except KeyFrameAnnotation.DoesNotExist:
             pass
@@ -109,31 +108,14 @@ def save_segmentation(request):
             with transaction.atomic():
                 annotations = common.task.save_annotation(request)
 
+                # Set frame metadata
+                for annotation in annotations:
+                    annotation.frame_metadata = target_frame_types[str(annotation.frame_nr)]
+                KeyFrameAnnotation.objects.bulk_update(annotations, ['frame_metadata'])
+
                 # Save segmentation
                 # Save control points
-                for annotation in annotations:
-                    frame_nr = str(annotation.frame_nr)
-
-                    # Set frame metadata
-                    annotation.frame_metadata = target_frame_types[frame_nr]
-                    annotation.save()
-
-                    for object in control_points[frame_nr]:
-                        nr_of_control_points = len(control_points[frame_nr][object]['control_points'])
-                        if nr_of_control_points < 2:
-                            continue
-                        for point in range(nr_of_control_points):
-                            control_point = ControlPoint()
-                            control_point.image = annotation
-                            control_point.x = float(control_points[frame_nr][object]['control_points'][point]['x'])
-                            control_point.y = float(control_points[frame_nr][object]['control_points'][point]['y'])
-                            control_point.index = point
-                            control_point.object = int(object)
-                            # TODO modify this line to have proper label:
-                            control_point.label = Label.objects.get(id=int(control_points[frame_nr][object]['label']['id']))
-                            control_point.uncertain = bool(
-                                control_points[frame_nr][object]['control_points'][point]['uncertain'])
-                            control_point.save()
+                common.control_points.save_control_points(annotations, control_points, 2)
 
                 response = {
                     'success': 'true',
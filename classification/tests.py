@@ -1,3 +1,17 @@
-from django.test import TestCase
+from annotationweb.models import Task
+from annotationweb.testing import SaveAnnotationTestCase
+from .models import ImageLabel
 
-# Create your tests here.
+
+class SaveLabelsTests(SaveAnnotationTestCase):
+    task_type = Task.CLASSIFICATION
+    save_view = 'classification:save'
+
+    def save_label(self, nr_of_frames):
+        response, queries = self.save(nr_of_frames, label_id=self.label.id)
+        self.assertEqual(response['success'], 'true')
+        return queries
+
+    def test_query_count_is_independent_of_frame_count(self):
+        self.assertEqual(self.save_label(1), self.save_label(20))
+        self.assertEqual(ImageLabel.objects.filter(label=self.label).count(), 21)
@@ -41,7 +41,10 @@ def save_labels(request):
     try:
         rejected = request.POST['rejected'] == 'true'
         if rejected:
-            annotations = common.task.save_annotation(request)
+            with transaction.atomic():
+                annotations = common.task.save_annotation(request)
+                # A rejected image has no labels
+                common.task.save_key_frame_rows(ImageLabel, annotations, [], ['label'])
         else:
             with transaction.atomic():
                 try:
@@ -51,12 +54,13 @@ def save_labels(request):
                     raise Exception('You must select a classification label.')
 
                 annotations = common.task.save_annotation(request)
+                labeled_images = []
                 for annotation in annotations:
                     labeled_image = ImageLabel()
                     labeled_image.image = annotation
                     labeled_image.label = label
-                    labeled_image.task = annotation.image_annotation.task
-                    labeled_image.save()
+                    labeled_images.append(labeled_image)
+                common.task.save_key_frame_rows(ImageLabel, annotations, labeled_images, ['label'])
 
             response = {
                 'success': 'true',
@@ -0,0 +1,123 @@
+import numpy as np
+from django.db.models import Q
+from common.label import check_labels_exist
+from common.task import save_key_frame_rows
+from spline_segmentation.models import Contour
+
+
+class Point:
+    """
+    A control point of a contour
+    """
+
+    def __init__(self, x, y, uncertain):
+        self.x = x
+        self.y = y
+        self.uncertain = uncertain
+
+
+def pack_points(points):
+    """
+    Pack control points to be stored in Contour.points
+    :param points: list of (x, y, uncertain)
+    :return bytes:
+    """
+    return np.asarray(points, dtype=np.float32).reshape((-1, 3)).tobytes()
+
+
+def unpack_points(data):
+    """
+    Unpack the control points of Contour.points
+    :return list of Point:
+    """
+    points = np.frombuffer(data, dtype=np.float32).reshape((-1, 3))
+    return [Point(float(x), float(y), bool(uncertain)) for x, y, uncertain in points]
+
+
+def get_contour_data(key_frames):
+    """
+    Get all contours of the given key frames with one query, in a compact form which is sent to the browser as JSON
+    :return list of [frame_nr, object, label_id, [x, y, uncertain, x, y, uncertain, ..]]:
+    """
+    contours = Contour.objects.filter(image__in=key_frames).order_by('image__frame_nr', 'object')\
+        .values_list('image__frame_nr', 'object', 'label_id', 'points')
+    return [[frame_nr, object, label_id, np.frombuffer(points, dtype=np.float32).astype(np.float64).round(3).tolist()]
+            for frame_nr, object, label_id, points in contours]
+
+
+def get_control_points(key_frame):
+    """
+    Get the label and control points of all objects of a key frame with one query
+    :return dict of object -> (Label, list of Point):
+    """
+    contours = Contour.objects.filter(image=key_frame).select_related('label')
+    return {contour.object: (contour.label, unpack_points(contour.points)) for contour in contours}
+
+
+def create_control_points(annotations, control_points, min_control_points):
+    """
+    Validate the control points posted by a segmentation task and create a Contour for each object, without saving.
+    :param annotations: list of KeyFrameAnnotation to store control points for
+    :param control_points: dict of frame_nr -> object -> {'label': {'id': ..}, 'control_points': [{'x', 'y', 'uncertain'}]}
+    :param min_control_points: objects with fewer control points than this are skipped
+    :return list of Contour:
+    """
+    contours = []
+    label_ids = set()
+    for annotation in annotations:
+        frame_nr = str(annotation.frame_nr)
+        for object, object_data in control_points[frame_nr].items():
+            points = object_data['control_points']
+            if len(points) < min_control_points:
+                continue
+            label_id = int(object_data['label']['id'])
+            label_ids.add(label_id)
+            contour = Contour()
+            contour.image = annotation
+            contour.label_id = label_id
+            contour.object = int(object)
+            contour.points = pack_points([(float(point['x']), float(point['y']), bool(point['uncertain'])) for point in points])
+            contours.append(contour)
+
+    check_labels_exist(label_ids)
+
+    return contours
+
+
+def save_control_points(annotations, control_points, min_control_points):
+    """
+    Validate and store the control points posted by a segmentation task.
+    Only the contours of key frames which were changed are written, see save_key_frame_rows.
+    Must be called inside a transaction, after the key frame annotations have been saved.
+    :return number of objects stored:
+    """
+    contours = create_control_points(annotations, control_points, min_control_points)
+    save_key_frame_rows(Contour, annotations, contours, ['label', 'object', 'points'])
+
+    return len(contours)
+
+
+def update_control_points(key_frames, changes):
+    """
+    Store the changed objects of an annotation in progress. Only the contours of the changed objects are replaced.
+    Must be called inside a transaction.
+    :param key_frames: dict of frame_nr -> KeyFrameAnnotation, for all frames in changes
+    :param changes: dict of frame_nr -> object -> {'label': {'id': ..}, 'control_points': [..]},
+        an object set to None is deleted, a frame set to None has all its objects deleted
+    :return number of objects stored:
+    """
+    deleted = Q(pk__in=[])
+    contours = []
+    for frame_nr, objects in changes.items():
+        key_frame = key_frames[int(frame_nr)]
+        if objects is None:
+            deleted |= Q(image=key_frame)
+            continue
+        deleted |= Q(image=key_frame, object__in=[int(object) for object in objects.keys()])
+        changed = {object: object_data for object, object_data in objects.items() if object_data is not None}
+        contours += create_control_points([key_frame], {str(key_frame.frame_nr): changed}, 1)
+
+    Contour.objects.filter(deleted).delete()
+    Contour.objects.bulk_create(contours)
+
+    return len(contours)
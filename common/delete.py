@@ -0,0 +1,87 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models import CASCADE, SET_NULL, PROTECT, DO_NOTHING, ProtectedError
+from annotationweb.models import Task, Dataset, Subject, ImageSequence, ImageAnnotation, KeyFrameAnnotation
+from common.metadata import update_metadata_facets
+
+# The children of each model which are counted to report progress when deleting
+PROGRESS_CHILDREN = {
+    Task: (ImageAnnotation, 'task'),
+    Dataset: (ImageSequence, 'subject__dataset'),
+    Subject: (ImageSequence, 'subject'),
+    ImageSequence: (KeyFrameAnnotation, 'image_annotation__image'),
+}
+
+
+def delete_in_chunks(queryset, chunk_size=1000, progress=None):
+    """
+    Delete the objects of a queryset and all objects referring to them from the bottom up, in chunks of at most
+    chunk_size rows, each chunk in a transaction. The objects referring to a chunk are deleted first, e.g. the
+    boxes of key frames before the key frames, so that each chunk is removed with a raw bulk delete of one table
+    and objects are never loaded into memory. Like raw deletes, no signals are sent.
+    Relations with on_delete SET_NULL are set to null and PROTECT raises ProtectedError, as with QuerySet.delete.
+    :param progress: function which is called with the number of objects deleted after each chunk
+    """
+    model = queryset.model
+    ids_queryset = queryset.order_by().values_list('pk', flat=True)
+    while True:
+        ids = list(ids_queryset[:chunk_size])
+        if len(ids) == 0:
+            break
+        with transaction.atomic():
+            _delete_related(model, ids, chunk_size)
+            queryset = model._base_manager.filter(pk__in=ids)
+            queryset._raw_delete(queryset.db)
+        if progress is not None:
+            progress(len(ids))
+
+
+def _delete_related(model, ids, chunk_size):
+    # Many to many relations of the model, e.g. the datasets of a task
+    for field in model._meta.many_to_many:
+        queryset = field.remote_field.through._base_manager.filter(**{field.m2m_field_name() + '__in': ids})
+        queryset._raw_delete(queryset.db)
+
+    for relation in model._meta.related_objects:
+        if relation.many_to_many:
+            # Many to many relations of other models, e.g. the tasks of a dataset
+            queryset = relation.through._base_manager.filter(**{relation.field.m2m_reverse_field_name() + '__in': ids})
+            queryset._raw_delete(queryset.db)
+            continue
+
+        related = relation.related_model._base_manager.filter(**{relation.field.attname + '__in': ids})
+        if relation.on_delete == CASCADE:
+            delete_in_chunks(related, chunk_size)
+        elif relation.on_delete == SET_NULL:
+            related.update(**{relation.field.attname: None})
+        elif relation.on_delete == PROTECT:
+            protected = list(related[:10])
+            if len(protected) > 0:
+                raise ProtectedError('Cannot delete {} objects, as they are referenced by {}'.format(
+                    model.__name__, relation.related_model.__name__), protected)
+        elif relation.on_delete != DO_NOTHING:
+            raise NotImplementedError('on_delete of ' + str(relation) + ' is not supported')
+
+
+def delete_object(job, model_label, pk):
+    """
+    Delete an object which has been marked as deleted, used as a background job
+    :param model_label: label of the model of the object, e.g. annotationweb.Task
+    """
+    model = apps.get_model(model_label)
+    child_model, child_field = PROGRESS_CHILDREN[model]
+    children = child_model._base_manager.filter(**{child_field: pk})
+    job.set_progress(0, children.count())
+
+    # The metadata facets of the dataset must be updated when image sequences are deleted
+    dataset = None
+    if model is Subject:
+        dataset = Dataset.objects.filter(subject=pk).first()
+    elif model is ImageSequence:
+        dataset = Dataset.objects.filter(subject__imagesequence=pk).first()
+
+    delete_in_chunks(children, progress=lambda count: job.set_progress(job.progress + count))
+    delete_in_chunks(model._base_manager.filter(pk=pk))
+
+    if dataset is not None:
+        update_metadata_facets(dataset)
@@ -1,24 +1,27 @@
-from os.path import basename
-
-import importlib
-import glob
-import os
-from annotationweb.settings import BASE_DIR
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from common.utility import copy_image, export_frame
+from common.plugins import load_plugin_modules, get_plugin_classes
 
+# Exporter classes in the order they are created, registered by MetaExporter
 exporters = []
 
+# Exporter classes of the exporters folder by task type, built once by load_exporters
+_exporters_by_task_type = None
+
 
 class MetaExporter(type):
 
     def __new__(cls, name, bases, namespace, **kwds):
         result = type.__new__(cls, name, bases, dict(namespace))
-        if name is not 'Exporter':
-            print('Found the exporter class', name)
+        if name != 'Exporter':
             exporters.append(result)
         return result
 
 
 class Exporter(metaclass=MetaExporter):
+    task = None
+    workers = 1  # Number of worker processes used by copy_images and export_frames, set by run_exporter --workers
 
     def get_form(self, data=None):
         raise NotImplementedError('An exporter needs to implement an export method')
@@ -26,20 +29,57 @@ class Exporter(metaclass=MetaExporter):
     def export(self, form):
         raise NotImplementedError('An exporter needs to implement an export method')
 
+    def copy_images(self, filenames):
+        """
+        Copy and convert images, in a pool of worker processes if more than one worker is used
+        :param filenames: list of (filename, new filename)
+        """
+        if self.workers <= 1 or len(filenames) <= 1:
+            for filename, new_filename in filenames:
+                copy_image(filename, new_filename)
+            return
 
-def find_all_exporters(task_type):
-    result = []
+        # Workers are spawned, as forking a process with database connections and threads is not safe
+        with ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            list(pool.map(copy_image, [filename for filename, new_filename in filenames],
+                          [new_filename for filename, new_filename in filenames], chunksize=16))
+
+    def export_frames(self, frames):
+        """
+        Export frames of image sequences with export_frame, in a pool of worker processes if more than one worker is used
+        :param frames: list of (image sequence, frame number, new filename)
+        """
+        # Only the format and packed store are sent to the workers, as model instances can't be used there
+        arguments = [(image_sequence.format, image_sequence.packed_file, frame_nr, new_filename)
+                     for image_sequence, frame_nr, new_filename in frames]
+        if self.workers <= 1 or len(arguments) <= 1:
+            for values in arguments:
+                export_frame(*values)
+            return
+
+        with ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            list(pool.map(export_frame, *zip(*arguments), chunksize=16))
 
-    modules = glob.glob(os.path.join(BASE_DIR, 'exporters') + '/*.py')
-    for module in modules:
-        print('Importing..')
+
+def load_exporters(reload=False):
+    """
+    Import the modules of the exporters folder and build the registry of exporters by task type.
+    This is done once when the app is ready. During development, reload can be set to import the modules
+    again after an exporter has been changed, e.g. from the shell; runserver restarts by itself when they change.
+    """
+    global _exporters_by_task_type
+    if reload:
         exporters.clear()
-        module_name = basename(module)[:-3]
-        foo = importlib.machinery.SourceFileLoader(module_name, module).load_module()
-        for exporter in exporters:
-            if exporter.task_type == task_type:
-                result.append(exporter)
-            else:
-                print('Exporter not correct type')
-
-    return result
+    registry = {}
+    for exporter in get_plugin_classes(exporters, load_plugin_modules('exporters', reload)):
+        registry.setdefault(exporter.task_type, []).append(exporter)
+    _exporters_by_task_type = registry
+
+
+def find_all_exporters(task_type):
+    """
+    Get the exporters for a task type, in the same order every time
+    """
+    if _exporters_by_task_type is None:
+        load_exporters()
+    return list(_exporters_by_task_type.get(task_type, []))
@@ -0,0 +1,82 @@
+import os
+import json
+import numpy as np
+from common.frames import read_frame
+from common.metaimage import MetaImage
+
+# This module is used by worker processes, thus it must not depend on Django
+
+
+def get_sidecar_filename(filename):
+    return os.path.splitext(filename)[0] + '.json'
+
+
+def read_sidecar(filename):
+    """
+    Read the geometry of a packed image sequence
+    :return dict with format, start_frame_nr, nr_of_frames, height, width, channels and spacing:
+    """
+    with open(get_sidecar_filename(filename), 'r') as f:
+        return json.load(f)
+
+
+def pack_frames(format, start_frame_nr, nr_of_frames, filename):
+    """
+    Transcode all frames of an image sequence into one contiguous uint8 array in a .npy file, with the
+    geometry in a JSON sidecar file next to it. Both files are written to a temporary file first, so that a
+    stopped conversion never leaves a partly written store behind. The sidecar is moved into place first,
+    thus when the .npy file exists, the store is complete.
+    :return geometry which is written to the sidecar:
+    """
+    frames = None
+    temporary_filename = filename + '.tmp'
+    for i in range(nr_of_frames):
+        pil_image, source = read_frame(format, start_frame_nr + i)
+        if pil_image.mode not in ('L', 'RGB'):
+            pil_image = pil_image.convert('L' if len(pil_image.getbands()) == 1 else 'RGB')
+        frame = np.asarray(pil_image, dtype=np.uint8)
+        if frames is None:
+            # Geometry is given by the first frame
+            spacing = [float(x) for x in source.get_spacing()[:2]] if isinstance(source, MetaImage) else [1.0, 1.0]
+            geometry = {
+                'format': format,
+                'start_frame_nr': start_frame_nr,
+                'nr_of_frames': nr_of_frames,
+                'height': frame.shape[0],
+                'width': frame.shape[1],
+                'channels': frame.shape[2] if frame.ndim == 3 else 1,
+                'spacing': spacing,
+            }
+            frames = np.lib.format.open_memmap(temporary_filename, mode='w+', dtype=np.uint8,
+                                               shape=(nr_of_frames, ) + frame.shape)
+        if frame.shape != frames.shape[1:]:
+            raise Exception('Frame {} of {} has a different size than the first frame'.format(start_frame_nr + i, format))
+        frames[i] = frame
+
+    if frames is None:
+        raise Exception('Image sequence ' + format + ' has no frames')
+    frames.flush()
+    del frames
+
+    with open(get_sidecar_filename(filename) + '.tmp', 'w') as f:
+        json.dump(geometry, f)
+    os.replace(get_sidecar_filename(filename) + '.tmp', get_sidecar_filename(filename))
+    os.replace(temporary_filename, filename)
+
+    return geometry
+
+
+def read_packed_frame(filename, frame_nr):
+    """
+    Read a single frame of a packed image sequence. The file is memory mapped, so only this frame is read.
+    :return PIL image and the MetaImage it was read from, with the pixel spacing of the original frames:
+    """
+    geometry = read_sidecar(filename)
+    index = frame_nr - geometry['start_frame_nr']
+    if index < 0 or index >= geometry['nr_of_frames']:
+        raise Exception('Frame ' + str(frame_nr) + ' does not exist in ' + filename)
+
+    frames = np.load(filename, mmap_mode='r')
+    metaimage = MetaImage(data=np.array(frames[index]), channels=geometry['channels'] > 1)
+    metaimage.set_spacing(geometry['spacing'])
+    return metaimage.get_image(), metaimage
@@ -0,0 +1,229 @@
+import os
+import hashlib
+import re
+import h5py
+import PIL, PIL.Image
+from common.metaimage import MetaImage
+
+
+def get_frame_pattern(format):
+    """
+    Compile a pattern which matches the filenames of the frames of an image sequence format,
+    e.g. /path/to/frame_#.png matches frame_0.png, frame_1.png and so on. Frame numbers are not zero padded.
+    :return compiled pattern, with the frame number as first group:
+    """
+    filename = os.path.basename(format)
+    if '#' not in filename:
+        raise ValueError('The filename of the format must contain #')
+    if '#' in os.path.dirname(format):
+        raise ValueError('Only the filename of the format can contain #')
+
+    # All # are replaced with the same frame number
+    parts = [re.escape(part) for part in filename.split('#')]
+    return re.compile(parts[0] + '(0|[1-9][0-9]*)' + parts[1] + ''.join('\\1' + part for part in parts[2:]))
+
+
+def find_frame_numbers(filenames, format):
+    """
+    Find the frames of an image sequence among the filenames of its folder
+    :return sorted list of frame numbers:
+    """
+    pattern = get_frame_pattern(format)
+    frame_nrs = []
+    for filename in filenames:
+        match = pattern.fullmatch(filename)
+        if match is not None:
+            frame_nrs.append(int(match.group(1)))
+
+    return sorted(frame_nrs)
+
+
+def get_frame_range(frame_nrs):
+    """
+    Get the first consecutive range of frames, and the frames missing between the first and the last frame
+    :param frame_nrs: sorted list of frame numbers
+    :return start frame number, number of consecutive frames from the start and list of missing frame numbers,
+        start frame number is None if there are no frames:
+    """
+    if len(frame_nrs) == 0:
+        return None, 0, []
+
+    start_frame = frame_nrs[0]
+    missing = sorted(set(range(start_frame, frame_nrs[-1] + 1)).difference(frame_nrs))
+    if len(missing) > 0:
+        nr_of_frames = missing[0] - start_frame
+    else:
+        nr_of_frames = len(frame_nrs)
+
+    return start_frame, nr_of_frames, missing
+
+
+def find_frames(format):
+    """
+    Find the frames of an image sequence with a single listing of its folder
+    :return start frame number, number of consecutive frames from the start and list of missing frame numbers,
+        start frame number is None if there are no frames:
+    """
+    directory = os.path.dirname(format)
+    try:
+        filenames = [entry.name for entry in os.scandir(directory if directory != '' else '.')]
+    except (FileNotFoundError, NotADirectoryError):
+        return None, 0, []
+
+    return get_frame_range(find_frame_numbers(filenames, format))
+
+
+# Files which contain all frames of an image sequence
+CONTAINER_EXTENSIONS = ('.mhd', '.tif', '.tiff', '.h5', '.hdf5', '.hd5')
+
+
+def is_container(format):
+    """
+    An image sequence is stored in a single container file if its format has no #
+    """
+    return '#' not in os.path.basename(format)
+
+
+def get_hdf5_dataset(file):
+    """
+    Get the first dataset with at least 3 dimensions of an HDF5 file, which is used as image sequence
+    """
+    datasets = []
+    file.visititems(lambda name, item: datasets.append(item) if isinstance(item, h5py.Dataset) and item.ndim >= 3 else None)
+    if len(datasets) == 0:
+        raise Exception('No dataset with frames found in ' + file.filename)
+    return datasets[0]
+
+
+def get_container_frames(filename):
+    """
+    Get the number of frames in a container file, only the headers of the file are read
+    :return number of frames, 0 if the file is not a container with several frames:
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.mhd':
+        metaimage = MetaImage()
+        metaimage.read_header(filename)
+        return metaimage.get_number_of_frames() if metaimage.get_number_of_frames() > 1 else 0
+    elif extension in ('.tif', '.tiff'):
+        with PIL.Image.open(filename) as image:
+            return getattr(image, 'n_frames', 1)
+    elif extension in ('.h5', '.hdf5', '.hd5'):
+        with h5py.File(filename, 'r') as file:
+            return get_hdf5_dataset(file).shape[0]
+    return 0
+
+
+def read_container_frame(filename, frame_nr):
+    """
+    Read a single frame of a container file, without reading the other frames
+    :return PIL image and the source it was read from, i.e. a MetaImage or PIL image:
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.mhd':
+        metaimage = MetaImage(filename=filename, frame_nr=frame_nr)
+        return metaimage.get_image(), metaimage
+    elif extension in ('.tif', '.tiff'):
+        image = PIL.Image.open(filename)
+        image.seek(frame_nr)
+        return image, image
+    elif extension in ('.h5', '.hdf5', '.hd5'):
+        with h5py.File(filename, 'r') as file:
+            # Only the chunks of the frame are read
+            image = PIL.Image.fromarray(get_hdf5_dataset(file)[frame_nr])
+        return image, image
+    raise Exception('Unknown container extension ' + extension)
+
+
+def find_container_frames(filename):
+    """
+    Find the frames of an image sequence stored in a container file
+    :return start frame number, number of frames and list of missing frame numbers, as find_frames:
+    """
+    if os.path.splitext(filename)[1].lower() not in CONTAINER_EXTENSIONS:
+        raise ValueError('The format must contain #, or be a file with all frames: ' + ', '.join(CONTAINER_EXTENSIONS))
+    if not os.path.isfile(filename):
+        return None, 0, []
+
+    nr_of_frames = get_container_frames(filename)
+    if nr_of_frames == 0:
+        return None, 0, []
+
+    return 0, nr_of_frames, []
+
+
+def read_frame(format, frame_nr):
+    """
+    Read a frame of an image sequence, stored as one file per frame or in a container file
+    :return PIL image and the source it was read from, i.e. a MetaImage or PIL image:
+    """
+    if is_container(format):
+        return read_container_frame(format, frame_nr)
+
+    filename = format.replace('#', str(frame_nr))
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.mhd':
+        metaimage = MetaImage(filename=filename)
+        return metaimage.get_image(), metaimage
+    elif extension == '.png':
+        image = PIL.Image.open(filename)
+        return image, image
+    raise Exception('Unknown image extension ' + extension)
+
+
+def get_data_files(filename):
+    """
+    Get the files with the data of an image file, i.e. the file itself and for .mhd files also the raw data file
+    """
+    filenames = [filename]
+    if os.path.splitext(filename)[1].lower() == '.mhd':
+        with open(filename, 'r') as f:
+            for line in f:
+                parts = line.split('=')
+                if len(parts) == 2 and parts[0].strip() == 'ElementDataFile':
+                    filenames.append(os.path.join(os.path.dirname(filename), parts[1].strip()))
+    return filenames
+
+
+def hash_file(hash, filename, block_size=1 << 20, max_blocks=None):
+    """
+    Add the content of a file to a hash, streamed in blocks
+    :param max_blocks: hash only this many blocks evenly spread over the file, for large files
+    """
+    size = os.path.getsize(filename)
+    hash.update(str(size).encode())
+    nr_of_blocks = (size + block_size - 1) // block_size
+    with open(filename, 'rb') as f:
+        if max_blocks is None or nr_of_blocks <= max_blocks:
+            for block in iter(lambda: f.read(block_size), b''):
+                hash.update(block)
+        else:
+            for i in range(max_blocks):
+                f.seek((i*(nr_of_blocks - 1) // max(max_blocks - 1, 1))*block_size)
+                hash.update(f.read(block_size))
+
+
+def hash_image_sequence(format, start_frame_nr, nr_of_frames, max_frames=None):
+    """
+    Compute a hash of the content of an image sequence, which does not depend on where it is stored,
+    to find sequences which have been stored twice.
+    :param max_frames: hash only this many frames evenly spread over the sequence, for large sequences.
+        For a container file, this is the number of blocks of 1 MB which are hashed.
+    :return hex digest of SHA-256:
+    """
+    hash = hashlib.sha256()
+    hash.update(str(nr_of_frames).encode())
+    if is_container(format):
+        for filename in get_data_files(format):
+            hash_file(hash, filename, max_blocks=max_frames)
+        return hash.hexdigest()
+
+    if max_frames is None or nr_of_frames <= max_frames:
+        indices = range(nr_of_frames)
+    else:
+        indices = sorted(set(i*(nr_of_frames - 1) // max(max_frames - 1, 1) for i in range(max_frames)))
+    for i in indices:
+        for filename in get_data_files(format.replace('#', str(start_frame_nr + i))):
+            hash_file(hash, filename)
+
+    return hash.hexdigest()
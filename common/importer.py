@@ -1,23 +1,27 @@
-from os.path import basename
-import importlib
-import glob
-import os
-from annotationweb.settings import BASE_DIR
+from annotationweb.models import Dataset
+from common.jobs import check_cancelled
+from common.plugins import load_plugin_modules, get_plugin_classes, find_plugin, get_form_data
 
+# Importer classes in the order they are created, registered by MetaImporter
 importers = []
 
+# Importer classes of the importers folder, built once by load_importers
+_importers = None
+
 
 class MetaImporter(type):
 
     def __new__(cls, name, bases, namespace, **kwds):
         result = type.__new__(cls, name, bases, dict(namespace))
-        if name is not 'Importer':
-            print('Found the importer class', name)
+        if name != 'Importer':
             importers.append(result)
         return result
 
 
 class Importer(metaclass=MetaImporter):
+    dataset = None
+    job = None  # Set when importing in the background
+    workers = 1  # Number of parallel workers an importer which supports it may use, set by run_importer --workers
 
     def get_form(self, data=None):
         raise NotImplementedError('An importer needs to implement a get_form method')
@@ -25,19 +29,63 @@ class Importer(metaclass=MetaImporter):
     def import_data(self, form):
         raise NotImplementedError('An importer needs to implement an import_data method')
 
+    def set_progress(self, progress, total=None):
+        if self.job is not None:
+            self.job.set_progress(progress, total)
 
-def find_all_importers():
-    result = []
+    def add_message(self, message):
+        if self.job is not None:
+            self.job.add_message(message)
+
+    def check_cancelled(self):
+        """
+        Stop the import if the job has been cancelled, should be called between the steps of an import
+        """
+        if self.job is not None:
+            check_cancelled(self.job)
+
+
+def import_in_background(job, importer, form):
+    """
+    Run an importer with a validated form, used as a background job
+    """
+    importer.job = job
+    success, message = importer.import_data(form)
+    if not success:
+        raise Exception(message)
+    job.add_message('Import finished: ' + message)
 
-    # Go through each app and see if there is an exporters.py file
 
-    modules = glob.glob(os.path.join(BASE_DIR, 'importers') + "/*.py")
-    for module in modules:
-        print('Importing..')
+def run_import_job(job, importer_name, dataset_id, form_data):
+    """
+    Run an importer with the data posted to its form, used as a job queued with start_job
+    :param importer_name: class name of the importer
+    :param form_data: dict of field name -> list of values
+    """
+    importer = find_plugin(find_all_importers(), importer_name)()
+    importer.dataset = Dataset.objects.get(pk=dataset_id)
+    form = importer.get_form(data=get_form_data(form_data))
+    if not form.is_valid():
+        raise Exception('Invalid import options: ' + form.errors.as_text())
+    import_in_background(job, importer, form)
+
+
+def load_importers(reload=False):
+    """
+    Import the modules of the importers folder and build the registry of importers.
+    This is done once when the app is ready. During development, reload can be set to import the modules
+    again after an importer has been changed, e.g. from the shell; runserver restarts by itself when they change.
+    """
+    global _importers
+    if reload:
         importers.clear()
-        module_name = basename(module)[:-3]
-        foo = importlib.machinery.SourceFileLoader(module_name, module).load_module()
-        for importer in importers:
-            result.append(importer)
+    _importers = get_plugin_classes(importers, load_plugin_modules('importers', reload))
 
-    return result
+
+def find_all_importers():
+    """
+    Get all importers, in the same order every time
+    """
+    if _importers is None:
+        load_importers()
+    return list(_importers)
@@ -0,0 +1,133 @@
+import json
+import os
+import socket
+import traceback
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from annotationweb.models import Job
+
+
+class JobCancelled(Exception):
+    """"Raise when a job has been asked to stop"""
+    pass
+
+
+def start_job(name, function, *args):
+    """
+    Queue a job which runs function(job, *args). Queued jobs are run by the run_jobs management command,
+    so that the web server only creates jobs and shows their status. The function must be a module level function,
+    and its arguments must be JSON serializable, e.g. ids instead of model objects.
+    The function can report progress with job.set_progress and job.add_message. If it raises an exception the job
+    is marked as failed. A job can be cancelled, if the function calls check_cancelled between its steps.
+    Jobs are run directly instead if the setting RUN_JOBS_IN_BACKGROUND is False, e.g. in tests.
+    :return job:
+    """
+    in_background = getattr(settings, 'RUN_JOBS_IN_BACKGROUND', True)
+    # A job which is run directly is created as running, so that it is not claimed by run_jobs
+    job = Job.objects.create(name=name, function=function.__module__ + '.' + function.__qualname__,
+                             arguments=json.dumps(args), status=Job.STATUS_QUEUED if in_background else Job.STATUS_RUNNING,
+                             process='' if in_background else get_process_name())
+    if not in_background:
+        run_job(job, function, *args)
+
+    return job
+
+
+def claim_job():
+    """
+    Take the oldest queued job, so that it is run by this process. Several processes can claim jobs at the same time,
+    each job is claimed by only one of them.
+    :return job, or None if no job is queued:
+    """
+    while True:
+        job = Job.objects.filter(status=Job.STATUS_QUEUED).order_by('created', 'id').first()
+        if job is None:
+            return None
+        # Only one process can change the status of a queued job
+        job.status = Job.STATUS_RUNNING
+        job.process = get_process_name()
+        if Job.objects.filter(id=job.id, status=Job.STATUS_QUEUED).update(status=job.status, process=job.process) == 1:
+            return job
+
+
+def run_queued_job(job):
+    """
+    Run a job created by start_job, after it has been claimed with claim_job
+    """
+    try:
+        function = import_string(job.function)
+        args = json.loads(job.arguments)
+    except (ImportError, ValueError) as e:
+        job.status = Job.STATUS_FAILED
+        job.message += 'Error: ' + str(e) + '\n'
+        job.finished = timezone.now()
+        Job.objects.filter(id=job.id).update(status=job.status, message=job.message, finished=job.finished)
+        return
+
+    run_job(job, function, *args)
+
+
+def run_job(job, function, *args):
+    job.status = Job.STATUS_RUNNING
+    job.process = get_process_name()
+    Job.objects.filter(id=job.id).update(status=job.status, process=job.process)
+    try:
+        # A job cancelled while it was queued is not started
+        check_cancelled(job)
+        function(job, *args)
+        job.status = Job.STATUS_FINISHED
+    except JobCancelled:
+        job.status = Job.STATUS_CANCELLED
+        job.add_message('Cancelled')
+    except Exception as e:
+        traceback.print_exc()
+        job.status = Job.STATUS_FAILED
+        job.add_message('Error: ' + str(e))
+    job.finished = timezone.now()
+    Job.objects.filter(id=job.id).update(status=job.status, finished=job.finished)
+
+
+def check_cancelled(job):
+    """
+    Stop the job by raising JobCancelled if it has been asked to stop. Changes committed so far are kept.
+    """
+    if job.is_cancelled():
+        raise JobCancelled
+
+
+def get_process_name():
+    return socket.gethostname() + ':' + str(os.getpid())
+
+
+def _is_process_running(process):
+    host, pid = process.rsplit(':', 1)
+    if host != socket.gethostname():
+        # Processes of other hosts can't be checked
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Process exists, but belongs to another user
+        return True
+    return True
+
+
+def fail_stale_jobs(jobs):
+    """
+    Mark running jobs as failed if the process which runs them has stopped, e.g. because the run_jobs command
+    was restarted, so that they are not shown as running forever. Used when the status of jobs is read.
+    :param jobs: list of jobs
+    """
+    for job in jobs:
+        if not job.is_active or job.process == '' or _is_process_running(job.process):
+            continue
+        job.status = Job.STATUS_FAILED
+        job.message += 'Error: The process running the job has stopped\n'
+        job.finished = timezone.now()
+        # Don't overwrite the status if the job has finished meanwhile
+        Job.objects.filter(id=job.id, status__in=(Job.STATUS_QUEUED, Job.STATUS_RUNNING))\
+            .update(status=job.status, message=job.message, finished=job.finished)
+
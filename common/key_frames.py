@@ -0,0 +1,175 @@
+import csv
+import os
+import re
+from annotationweb.models import Task, ImageSequence, ImageMetadata
+from django import forms
+from django.contrib.auth.models import User
+from common.task import set_key_frames
+
+RULE_MIDDLE = 'middle'
+RULE_EVERY_NTH = 'every-nth'
+RULE_CSV = 'csv'
+RULE_METADATA = 'metadata'
+RULES = (RULE_MIDDLE, RULE_EVERY_NTH, RULE_CSV, RULE_METADATA)
+
+
+def middle_frame():
+    # Sequences without frames keep their key frames
+    return lambda id, format, start_frame_nr, nr_of_frames: [start_frame_nr + nr_of_frames // 2] if nr_of_frames > 0 else None
+
+
+def every_nth_frame(n):
+    if n < 1:
+        raise ValueError('N must be at least 1')
+    return lambda id, format, start_frame_nr, nr_of_frames: list(range(start_frame_nr, start_frame_nr + nr_of_frames, n))
+
+
+def frames_from_csv(file):
+    """
+    Read key frames from a CSV file with a row for each image sequence: the id or format of the sequence
+    followed by one or more frame numbers. Sequences which are not listed keep their key frames.
+    """
+    frames = {}
+    for row in csv.reader(file):
+        if len(row) == 0:
+            continue
+        frames[row[0].strip()] = [int(frame_nr) for frame_nr in row[1:] if frame_nr.strip() != '']
+
+    return lambda id, format, start_frame_nr, nr_of_frames: frames.get(str(id), frames.get(format))
+
+
+def parse_frame_numbers(value):
+    """
+    Parse a list of frame numbers separated by commas, e.g. '12' or '12, 30'
+    :return list of frame numbers, or None if the value is not a list of frame numbers:
+    """
+    parts = [part.strip() for part in value.split(',')]
+    if not all(re.fullmatch('[0-9]+', part) for part in parts):
+        return None
+    return [int(part) for part in parts]
+
+
+def frames_from_metadata(task, name, report=None):
+    """
+    Read key frames from the metadata value with the given name, e.g. 'ED' with a value of '12' or '12, 30'.
+    Sequences without this metadata, or with a value which is not a list of frame numbers, keep their key frames.
+    :param report: function which is called with a message for each value which is not a list of frame numbers
+    """
+    values = ImageMetadata.objects.filter(image__subject__dataset__task=task, name=name).values_list('image_id', 'value')
+    frames = {}
+    for image_id, value in values.iterator():
+        frame_nrs = parse_frame_numbers(value)
+        if frame_nrs is not None:
+            frames[image_id] = frame_nrs
+        elif report is not None:
+            report('Skipped image sequence {}, its {} is not a list of frame numbers: {}'.format(image_id, name, value))
+
+    return lambda id, format, start_frame_nr, nr_of_frames: frames.get(id)
+
+
+class KeyFrameRuleForm(forms.Form):
+    """
+    Options of a rule which selects the key frames of all image sequences of a task, used by the task admin
+    """
+    RULE_CHOICES = (
+        (RULE_MIDDLE, 'The middle frame of every sequence'),
+        (RULE_EVERY_NTH, 'Every Nth frame of every sequence'),
+        (RULE_CSV, 'Frames listed in a CSV file, with rows of sequence id or format followed by frame numbers'),
+        (RULE_METADATA, 'Frame numbers in the metadata of each sequence'),
+    )
+    rule = forms.ChoiceField(choices=RULE_CHOICES, widget=forms.RadioSelect, initial=RULE_MIDDLE)
+    n = forms.IntegerField(label='N', min_value=1, required=False, help_text='For every Nth frame')
+    csv_filename = forms.CharField(label='CSV file path', max_length=1000, required=False,
+                                   help_text='Path of the CSV file on the server, for frames from a CSV file')
+    metadata_name = forms.CharField(label='Metadata name', max_length=50, required=False,
+                                    help_text='Name of the metadata with the frame numbers, e.g. ED')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        rule = cleaned_data.get('rule')
+        if rule == RULE_EVERY_NTH and cleaned_data.get('n') is None:
+            self.add_error('n', 'N is required for every Nth frame')
+        elif rule == RULE_CSV and not os.path.isfile(cleaned_data.get('csv_filename', '')):
+            self.add_error('csv_filename', 'The CSV file does not exist')
+        elif rule == RULE_METADATA and cleaned_data.get('metadata_name', '') == '':
+            self.add_error('metadata_name', 'The metadata name is required for frames from metadata')
+        return cleaned_data
+
+    def get_options(self):
+        """
+        :return keyword arguments of get_rule for the selected rule:
+        """
+        rule = self.cleaned_data['rule']
+        if rule == RULE_EVERY_NTH:
+            return {'n': self.cleaned_data['n']}
+        elif rule == RULE_CSV:
+            return {'csv_filename': self.cleaned_data['csv_filename']}
+        elif rule == RULE_METADATA:
+            return {'metadata_name': self.cleaned_data['metadata_name']}
+        return {}
+
+
+def get_rule(task, rule, n=None, csv_filename=None, metadata_name=None, report=None):
+    """
+    Get the function for a key frame rule
+    :param report: function which is called with a message for each sequence which is skipped because of invalid data
+    :return function of (id, format, start_frame_nr, nr_of_frames) -> list of frame numbers or None:
+    """
+    if rule == RULE_MIDDLE:
+        return middle_frame()
+    elif rule == RULE_EVERY_NTH:
+        return every_nth_frame(n)
+    elif rule == RULE_CSV:
+        with open(csv_filename, newline='') as file:
+            return frames_from_csv(file)
+    elif rule == RULE_METADATA:
+        return frames_from_metadata(task, metadata_name, report)
+    raise ValueError('Unknown key frame rule ' + str(rule))
+
+
+def assign_key_frames(task, user, get_frames, chunk_size=500, progress=None):
+    """
+    Select the key frames of all image sequences of a task from a rule, with bulk inserts in chunks of
+    image sequences, each chunk in its own transaction. If it fails, the chunks done so far are kept.
+    :param get_frames: function of (id, format, start_frame_nr, nr_of_frames) -> list of frame numbers,
+        or None to keep the key frames of the sequence
+    :param progress: function which is called with the number of image sequences done after each chunk
+    :return number of key frames created and number of key frames deleted:
+    """
+    images = list(ImageSequence.objects.filter(subject__dataset__task=task, deleted=False).order_by('id')
+                  .values_list('id', 'format', 'start_frame_nr', 'nr_of_frames'))
+    created_count = 0
+    deleted_count = 0
+    for start in range(0, len(images), chunk_size):
+        key_frames = {}
+        for image in images[start:start + chunk_size]:
+            frame_nrs = get_frames(*image)
+            if frame_nrs is not None:
+                key_frames[image[0]] = frame_nrs
+        created, deleted = set_key_frames(task, user, key_frames, chunk_size)
+        created_count += created
+        deleted_count += deleted
+        if progress is not None:
+            progress(len(images[start:start + chunk_size]))
+
+    return created_count, deleted_count
+
+
+def assign_key_frames_job(job, task_id, user_id, rule, options):
+    """
+    Select the key frames of all image sequences of a task from a rule, used as a background job
+    :param options: keyword arguments of get_rule
+    """
+    task = Task.objects.get(pk=task_id)
+    user = User.objects.get(pk=user_id)
+    get_frames = get_rule(task, rule, report=job.add_message, **options)
+    job.set_progress(0, ImageSequence.objects.filter(subject__dataset__task=task, deleted=False).count())
+    try:
+        created, deleted = assign_key_frames(task, user, get_frames,
+                                             progress=lambda count: job.set_progress(job.progress + count))
+    except Exception:
+        # Each chunk is committed by itself
+        job.add_message('Stopped after {} of {} image sequences, the key frames of these sequences have been changed.'
+                        .format(job.progress, job.total))
+        raise
+    job.add_message(str(created) + ' key frames were created and ' + str(deleted) + ' key frames were deleted.')
@@ -1,32 +1,158 @@
-from annotationweb.models import Label
+import uuid
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from annotationweb.models import Label, Task
+
+LABEL_TREE_VERSION_KEY = 'label_tree_version'
+
+
+class LabelTree:
+    """
+    The label hierarchy of a task, built in memory with one query per level of the hierarchy, which only
+    loads the labels of the task and their sublabels. Without a task, all labels are loaded with a single query.
+    Use get_label_tree to get a cached instance.
+    """
+
+    def __init__(self, task_id=None):
+        if task_id is None:
+            labels = list(Label.objects.order_by('id'))
+            self.toplabels = []
+        else:
+            self.toplabels = list(Label.objects.filter(task=task_id).order_by('id'))
+            labels = list(self.toplabels)
+            parent_ids = [label.id for label in self.toplabels]
+            while len(parent_ids) > 0:
+                children = list(Label.objects.filter(parent_id__in=parent_ids).order_by('id'))
+                labels.extend(children)
+                parent_ids = [label.id for label in children]
+
+        self.labels = {label.id: label for label in sorted(labels, key=lambda x: x.id)}
+        self.children = {}
+        for label in self.labels.values():
+            if label.parent_id is not None:
+                # Set parent object, so that label.parent does not cause a query
+                label.parent = self.labels[label.parent_id]
+                self.children.setdefault(label.parent_id, []).append(label)
+
+        self.complete_names = {}
+        for label in self.labels.values():
+            self.complete_names[label.id] = self._create_complete_name(label)
+
+    def _create_complete_name(self, label):
+        # If label is a sublabel this will get the label name as: "sublabel#1.name - sublabel#2.name - assignedlabel.name"
+        label_name = label.name
+        while label.parent_id is not None:
+            label = self.labels[label.parent_id]
+            label_name = label.name + ' - ' + label_name
+
+        return label_name
+
+    def get_complete_name(self, label_id):
+        return self.complete_names[label_id]
+
+    def get_children(self, label_id):
+        return self.children.get(label_id, [])
+
+    def get_sublabels(self):
+        """
+        Get the sublabel groups and a list of all labels of the task, as used by the annotation views
+        :return sublabels, labels:
+        """
+        sublabels = []
+        label_stack = list(self.toplabels)
+        labels = list(self.toplabels)  # all labels
+
+        # Process stack
+        while len(label_stack) > 0:
+            current_label = label_stack.pop()
+
+            # Add all children
+            children = self.get_children(current_label.id)
+            label_stack.extend(children)
+            labels.extend(children)
+
+            if len(children) > 0:
+                sublabel = {'id': current_label.id, 'labels': children}
+                sublabels.append(sublabel)
+
+        return sublabels, labels
+
+    def get_all_labels(self):
+        """
+        Get id and name of all labels of the task, including sublabels
+        :return list of dicts with id and name:
+        """
+        labels = []
+        toplabels = sorted(self.toplabels, key=lambda x: x.name, reverse=True)
+        # Create stack
+        sublabel_stack = [(x.id, x.name) for x in toplabels]
+        while len(sublabel_stack) > 0:
+            sublabel = sublabel_stack.pop()
+
+            for sublabel_child in self.get_children(sublabel[0]):
+                parent_name = sublabel[1]
+                label = (sublabel_child.id, parent_name + ' - ' + sublabel_child.name)
+                sublabel_stack.append(label)
+
+            label = {'id': sublabel[0], 'name': sublabel[1]}
+            labels.append(label)
+
+        return labels
+
+
+def _get_label_tree_version():
+    version = cache.get(LABEL_TREE_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(LABEL_TREE_VERSION_KEY, version, None)
+    return version
+
+
+def get_label_tree(task=None):
+    """
+    Get the cached label tree of a task. If task is None the tree has no top labels,
+    but can still be used to get complete label names.
+    The trees are invalidated through the cache, thus when the site is served by several processes, the CACHES
+    setting must use a backend which is shared by these processes, see settings.py.
+    """
+    task_id = task if task is None or isinstance(task, int) else task.id
+    key = 'label_tree_' + _get_label_tree_version() + '_' + str(task_id)
+    label_tree = cache.get(key)
+    if label_tree is None:
+        label_tree = LabelTree(task_id)
+        cache.set(key, label_tree)
+
+    return label_tree
+
+
+@receiver(post_save, sender=Label)
+@receiver(post_delete, sender=Label)
+@receiver(m2m_changed, sender=Task.label.through)
+def invalidate_label_trees(**kwargs):
+    # Labels may be shared between tasks, thus invalidate the trees of all tasks
+    cache.set(LABEL_TREE_VERSION_KEY, uuid.uuid4().hex, None)
 
 
 def get_complete_label_name(label):
     # If label is a sublabel this will get the label name as: "sublabel#1.name - sublabel#2.name - assignedlabel.name"
-    label_name = label.name
-    while label.parent is not None:
-        # Get parent
-        label = Label.objects.get(pk=label.parent_id)
-        label_name = label.name + ' - ' + label_name
+    label_tree = get_label_tree()
+    if label.id not in label_tree.complete_names:
+        # Label was changed without sending signals, e.g. with a queryset update
+        invalidate_label_trees()
+        label_tree = get_label_tree()
+    return label_tree.get_complete_name(label.id)
+
 
-    return label_name
+def check_labels_exist(label_ids):
+    """
+    Check that all the given label ids exist, using one query
+    :param label_ids: set of label ids
+    """
+    existing_label_ids = set(Label.objects.filter(id__in=label_ids).values_list('id', flat=True))
+    for label_id in label_ids - existing_label_ids:
+        raise Label.DoesNotExist('Label with id ' + str(label_id) + ' does not exist')
 
 
 def get_all_labels(task):
-    labels = []
-    sublabels = [(x.id, x.name) for x in Label.objects.filter(task=task).order_by('-name')]
-    # Create stack
-    sublabel_stack = [x for x in sublabels]
-    while len(sublabel_stack) > 0:
-        sublabel = sublabel_stack.pop()
-
-        sublabels = Label.objects.filter(parent_id=sublabel[0])
-        for sublabel_child in sublabels:
-            parent_name = sublabel[1]
-            label = (sublabel_child.id, parent_name + ' - ' + sublabel_child.name)
-            sublabel_stack.append(label)
-
-        label = {'id': sublabel[0], 'name': sublabel[1]}
-        labels.append(label)
-
-    return labels
+    return get_label_tree(task).get_all_labels()
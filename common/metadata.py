@@ -0,0 +1,247 @@
+import csv
+import json
+import math
+import os
+import threading
+from itertools import groupby
+import numpy as np
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from annotationweb.models import Dataset, ImageSequence, ImageMetadata, MetadataFacet
+
+# State of the metadata facet updates of the current thread
+_facet_updates = threading.local()
+
+
+def pack_ids(ids):
+    return np.unique(np.asarray(ids, dtype=np.uint32)).tobytes()
+
+
+def unpack_ids(data):
+    return np.frombuffer(data, dtype=np.uint32)
+
+
+def parse_number(value):
+    """
+    :return the value as a float if it is numeric, else None:
+    """
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return number if math.isfinite(number) else None
+
+
+def create_metadata(image_id, name, value):
+    return ImageMetadata(image_id=image_id, name=name, value=value, number=parse_number(value))
+
+
+def read_metadata_text(filename):
+    """
+    Read a metadata file with a name: value pair on each line. Only the first : separates the name from the value,
+    so that values such as times can contain :
+    :return list of (name, value):
+    """
+    metadata = []
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.strip() == '':
+                continue
+            if ':' not in line:
+                raise Exception('Expected name: value on each line of metadata file ' + filename)
+            name, value = line.split(':', 1)
+            metadata.append((name.strip(), value.strip()))
+
+    return metadata
+
+
+def read_metadata_json(filename):
+    """
+    Read a metadata file with a JSON object of name -> value
+    :return list of (name, value):
+    """
+    with open(filename, 'r') as f:
+        values = json.load(f)
+    if not isinstance(values, dict):
+        raise Exception('Expected a JSON object in metadata file ' + filename)
+
+    return [(name, value if isinstance(value, str) else json.dumps(value)) for name, value in values.items()]
+
+
+def read_metadata_folder(path):
+    """
+    Read the metadata.txt and metadata.json files of an image sequence folder, if they exist
+    :return list of (name, value):
+    """
+    metadata = []
+    if os.path.exists(os.path.join(path, 'metadata.txt')):
+        metadata += read_metadata_text(os.path.join(path, 'metadata.txt'))
+    if os.path.exists(os.path.join(path, 'metadata.json')):
+        metadata += read_metadata_json(os.path.join(path, 'metadata.json'))
+
+    return metadata
+
+
+def read_metadata_csv(file):
+    """
+    Read a CSV file with the metadata of many image sequences. The first row has the metadata names, and
+    each following row the path of an image sequence folder followed by its values. Empty values are skipped.
+    :return dict of path -> list of (name, value):
+    """
+    reader = csv.reader(file)
+    try:
+        names = [name.strip() for name in next(reader)[1:]]
+    except StopIteration:
+        return {}
+
+    metadata = {}
+    for row in reader:
+        if len(row) == 0:
+            continue
+        metadata[row[0].strip()] = [(name, value.strip()) for name, value in zip(names, row[1:]) if value.strip() != '']
+
+    return metadata
+
+
+def set_metadata(metadata, chunk_size=500):
+    """
+    Set the metadata of image sequences with bulk inserts, in chunks of image sequences.
+    Existing metadata of the sequences with the same names is replaced.
+    The metadata facets are not updated, update_metadata_facets must be called afterwards.
+    :param metadata: dict of image sequence id -> list of (name, value)
+    """
+    image_ids = sorted(metadata.keys())
+    with transaction.atomic():
+        for start in range(0, len(image_ids), chunk_size):
+            chunk = image_ids[start:start + chunk_size]
+            names = set(name for image_id in chunk for name, value in metadata[image_id])
+            ImageMetadata.objects.filter(image_id__in=chunk, name__in=names).delete()
+            ImageMetadata.objects.bulk_create([create_metadata(image_id, name, value)
+                                               for image_id in chunk for name, value in metadata[image_id]])
+
+
+def update_metadata_facets(dataset):
+    """
+    Rebuild the metadata facets of a dataset from its ImageMetadata. Should be called after metadata is imported.
+    """
+    rows = ImageMetadata.objects.filter(image__subject__dataset=dataset)\
+        .order_by('name', 'value', 'image_id')\
+        .values_list('name', 'value', 'image_id')
+
+    facets = []
+    for (name, value), group in groupby(rows.iterator(), key=lambda row: (row[0], row[1])):
+        facet = MetadataFacet()
+        facet.dataset = dataset
+        facet.name = name
+        facet.value = value
+        facet.image_ids = pack_ids([row[2] for row in group])
+        facets.append(facet)
+
+    with transaction.atomic():
+        MetadataFacet.objects.filter(dataset=dataset).delete()
+        MetadataFacet.objects.bulk_create(facets)
+
+
+def _update_pending_metadata_facets(dataset_id):
+    pending = _facet_updates.__dict__.setdefault('pending', set())
+    if dataset_id not in pending:
+        # Already updated by another change in the same transaction
+        return
+    pending.discard(dataset_id)
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if dataset is not None:
+        update_metadata_facets(dataset)
+
+
+def update_metadata_facets_on_commit(dataset_ids):
+    """
+    Update the metadata facets of datasets when the current transaction is committed,
+    once for each dataset also if this is called for many changes in the transaction
+    """
+    pending = _facet_updates.__dict__.setdefault('pending', set())
+    for dataset_id in dataset_ids:
+        pending.add(dataset_id)
+        transaction.on_commit(lambda dataset_id=dataset_id: _update_pending_metadata_facets(dataset_id))
+
+
+@receiver(post_save, sender=ImageMetadata)
+def update_facets_of_saved_metadata(instance, **kwargs):
+    """
+    Update the metadata facets of the dataset when ImageMetadata is saved one by one, e.g. in the admin.
+    There is no receiver for deletes, as it would stop Django from deleting metadata with fast bulk deletes when
+    image sequences are deleted. Code which deletes metadata, or saves it with bulk_create or queryset update,
+    must update the facets itself, e.g. with update_metadata_facets.
+    """
+    dataset_id = ImageSequence.objects.filter(id=instance.image_id).values_list('subject__dataset_id', flat=True).first()
+    if dataset_id is not None:
+        update_metadata_facets_on_commit([dataset_id])
+
+
+def get_metadata_choices(task):
+    """
+    Get all distinct metadata name and value pairs of the datasets of a task
+    :return list of dicts with name and value:
+    """
+    return MetadataFacet.objects.filter(dataset__task=task).values('name', 'value').distinct().order_by('name', 'value')
+
+
+def get_numeric_metadata_names(metadata_choices):
+    """
+    Get the metadata names where all values are numeric, which can be filtered on with a range
+    :param metadata_choices: metadata choices as returned by get_metadata_choices
+    :return sorted list of names:
+    """
+    names = {}
+    for item in metadata_choices:
+        names[item['name']] = names.get(item['name'], True) and parse_number(item['value']) is not None
+
+    return sorted(name for name, numeric in names.items() if numeric)
+
+
+def get_images_with_metadata_in_range(task, name, minimum=None, maximum=None):
+    """
+    Find the image sequences of a task with a numeric metadata value in a range, using the index on name and number
+    :return queryset of image sequence ids, to be used as a subquery:
+    """
+    queryset = ImageMetadata.objects.filter(image__subject__dataset__task=task, name=name, number__isnull=False)
+    if minimum is not None:
+        queryset = queryset.filter(number__gte=minimum)
+    if maximum is not None:
+        queryset = queryset.filter(number__lte=maximum)
+
+    return queryset.values('image_id')
+
+
+def get_images_with_metadata(task, name, values):
+    """
+    Find the image sequences of a task with one of the given values of a metadata name, using the index on name and value
+    :return queryset of image sequence ids, to be used as a subquery:
+    """
+    return ImageMetadata.objects.filter(image__subject__dataset__task=task, name=name, value__in=values).values('image_id')
+
+
+def get_image_ids_with_metadata(task, metadata_selected):
+    """
+    Find the image sequences of a task which match the selected metadata.
+    An image sequence must have one of the selected values for every selected metadata name.
+    :param metadata_selected: dict of name -> list of values
+    :return sorted list of image sequence ids:
+    """
+    facets = MetadataFacet.objects.filter(dataset__task=task, name__in=metadata_selected.keys())\
+        .values_list('name', 'value', 'image_ids')
+
+    # Union of the image ids of all selected values of each name
+    ids_per_name = {name: np.empty(0, dtype=np.uint32) for name in metadata_selected.keys()}
+    for name, value, image_ids in facets:
+        if value in metadata_selected[name]:
+            ids_per_name[name] = np.union1d(ids_per_name[name], unpack_ids(image_ids))
+
+    # Intersection over all names
+    result = None
+    for ids in ids_per_name.values():
+        result = ids if result is None else np.intersect1d(result, ids, assume_unique=True)
+
+    if result is None:
+        return []
+    return result.tolist()
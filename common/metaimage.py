@@ -11,14 +11,29 @@ def tuple_to_string(tuple):
     return string[:len(string)-1]
 
 
+# Numpy types of the MetaImage element types
+METAIMAGE_TYPES = {
+    'MET_FLOAT': np.float32,
+    'MET_UCHAR': np.uint8,
+    'MET_CHAR': np.int8,
+    'MET_USHORT': np.uint16,
+    'MET_SHORT': np.int16,
+    'MET_UINT': np.uint32,
+    'MET_INT': np.int32,
+}
+
+
 class MetaImage:
-    def __init__(self, filename=None, data=None, channels=False):
+    def __init__(self, filename=None, data=None, channels=False, frame_nr=None):
+        """
+        :param frame_nr: read only this frame of a 3D image, the data file is memory mapped so that the rest is not read
+        """
         self.attributes = {}
         self.attributes['ElementSpacing'] = [1, 1, 1]
         self.attributes['ElementNumberOfChannels'] = 1
         if filename is not None:
-            self.read(filename)
-        else:
+            self.read(filename, frame_nr)
+        elif data is not None:
             if not channels:
                 self.ndims = len(data.shape)
             else:
@@ -34,11 +49,10 @@ class MetaImage:
             else:
                 self.dim_size = (data.shape[1], data.shape[0], data.shape[2])
 
-    def read(self, filename):
+    def read_header(self, filename):
         if not os.path.isfile(filename):
             raise Exception('File ' + filename + ' does not exist')
 
-        base_path = os.path.dirname(filename) + '/'
         # Parse file
         with open(filename, 'r') as f:
             for line in f:
@@ -49,7 +63,7 @@ class MetaImage:
                 if parts[0].strip() == 'ElementSpacing':
                     self.attributes['ElementSpacing'] = [float(x) for x in self.attributes['ElementSpacing'].split()]
 
-        dims = self.attributes['DimSize'].split(' ')
+        dims = self.attributes['DimSize'].split()
         if len(dims) == 2:
             self.dim_size = (int(dims[0]), int(dims[1]))
         elif len(dims) == 3:
@@ -57,34 +71,54 @@ class MetaImage:
 
         self.ndims = int(self.attributes['NDims'])
 
+    def read(self, filename, frame_nr=None):
+        self.read_header(filename)
+        base_path = os.path.dirname(filename) + '/'
+        data_filename = os.path.join(base_path, self.attributes['ElementDataFile'])
+        dtype = METAIMAGE_TYPES[self.attributes.get('ElementType', 'MET_UCHAR')]
+
+        # Shape of a frame, height first
+        shape = (self.dim_size[1], self.dim_size[0])
+        if self.get_channels() > 1:
+            shape += (self.get_channels(), )
+        if frame_nr is not None and self.get_number_of_frames() <= frame_nr:
+            raise Exception('Frame ' + str(frame_nr) + ' does not exist in ' + filename)
+
         compressed_data = 'CompressedData' in self.attributes and self.attributes['CompressedData'] == 'True'
 
         if compressed_data:
             # Read compressed raw file (.zraw)
-            with open(os.path.join(base_path, self.attributes['ElementDataFile']), 'rb') as raw_file:
+            with open(data_filename, 'rb') as raw_file:
                 raw_data_compressed = raw_file.read()
                 raw_data_uncompressed = zlib.decompress(raw_data_compressed)
-
-                if self.attributes['ElementType'] == 'MET_FLOAT':
-                    self.data = (np.fromstring(raw_data_uncompressed, dtype=np.float32)*255).astype(dtype=np.uint8)
-                else:
-                    self.data = np.fromstring(raw_data_uncompressed, dtype=np.uint8)
+            data = np.frombuffer(raw_data_uncompressed, dtype=dtype)
+            if self.get_number_of_frames() > 1:
+                data = data.reshape((self.get_number_of_frames(), ) + shape)
+                if frame_nr is not None:
+                    data = data[frame_nr]
+        elif frame_nr is not None:
+            # Read only the requested frame of the uncompressed raw file (.raw)
+            frame_size = int(np.prod(shape))*np.dtype(dtype).itemsize
+            data = np.array(np.memmap(data_filename, dtype=dtype, mode='r', offset=frame_nr*frame_size, shape=shape))
         else:
             # Read uncompressed raw file (.raw)
-            self.data = np.fromfile(os.path.join(base_path, self.attributes['ElementDataFile']), dtype=np.uint8)
-
-
-        dims = self.attributes['DimSize'].split(' ')
-        if len(dims) == 2:
-            self.dim_size = (int(dims[0]), int(dims[1]))
-        elif len(dims) == 3:
-            self.dim_size = (int(dims[0]), int(dims[1]), int(dims[2]))
-
-        self.ndims = int(self.attributes['NDims'])
-        if self.get_channels() == 1:
-            self.data = self.data.reshape((self.dim_size[1], self.dim_size[0]))
-        else:
-            self.data = self.data.reshape((self.dim_size[1], self.dim_size[0], self.get_channels()))
+            data = np.fromfile(data_filename, dtype=dtype)
+
+        if frame_nr is None and self.get_number_of_frames() > 1:
+            shape = (self.get_number_of_frames(), ) + shape
+        data = data.reshape(shape)
+
+        if dtype == np.float32:
+            data = (data*255).astype(dtype=np.uint8)
+        self.data = data
+
+    def get_number_of_frames(self):
+        """
+        :return the size of the third dimension of a 3D image, 1 for a 2D image:
+        """
+        if len(self.dim_size) == 3 and self.ndims == 3:
+            return self.dim_size[2]
+        return 1
 
     def get_size(self):
         return self.dim_size
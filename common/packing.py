@@ -0,0 +1,104 @@
+import os
+import json
+import multiprocessing
+from os.path import join
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from annotationweb.models import ImageSequence
+from common.frame_store import pack_frames, get_sidecar_filename
+
+
+def get_packed_filename(path, image_sequence_id):
+    return join(path, str(image_sequence_id) + '.npy')
+
+
+def read_pack_log(filename):
+    """
+    Read the log of image sequences which have been packed to a folder
+    :return dict of image sequence id -> (format, start_frame_nr, nr_of_frames, packed filename):
+    """
+    packed = {}
+    if not os.path.exists(filename):
+        return packed
+
+    with open(filename, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Last line may be incomplete if the conversion was stopped
+                continue
+            packed[entry['id']] = (entry['format'], entry['start_frame_nr'], entry['nr_of_frames'], entry['filename'])
+
+    return packed
+
+
+def pack_image_sequences(image_sequences, path, workers=4, progress=None, chunk_size=100):
+    """
+    Transcode image sequences into packed stores in a folder, in a pool of worker processes.
+    Each packed sequence is appended to the log pack.log in the folder, so that a conversion which is
+    stopped can be resumed without transcoding these sequences again.
+    :param image_sequences: queryset of image sequences, sequences which already are packed are skipped
+    :param progress: function which is called with the number of image sequences done
+    :return number of image sequences packed and list of error messages:
+    """
+    os.makedirs(path, exist_ok=True)
+    log_filename = join(path, 'pack.log')
+    packed = read_pack_log(log_filename)
+    sequences = list(image_sequences.filter(packed_file='').order_by('id')
+                     .values_list('id', 'format', 'start_frame_nr', 'nr_of_frames'))
+
+    done = []
+    todo = []
+    for id, format, start_frame_nr, nr_of_frames in sequences:
+        entry = packed.get(id)
+        if entry is not None and entry[:3] == (format, start_frame_nr, nr_of_frames) and os.path.exists(entry[3]) \
+                and os.path.exists(get_sidecar_filename(entry[3])):
+            # Packed before the conversion was stopped
+            done.append(ImageSequence(id=id, packed_file=entry[3]))
+        else:
+            todo.append((id, format, start_frame_nr, nr_of_frames))
+    ImageSequence.objects.bulk_update(done, ['packed_file'])
+    count = len(done)
+    if progress is not None:
+        progress(count)
+
+    errors = []
+    pending = []
+    futures = {}
+    # Workers are spawned, as forking a process with database connections and threads is not safe
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        futures = {pool.submit(pack_frames, format, start_frame_nr, nr_of_frames, get_packed_filename(path, id)):
+                   (id, format, start_frame_nr, nr_of_frames) for id, format, start_frame_nr, nr_of_frames in todo}
+        with open(log_filename, 'a') as log:
+            for future in as_completed(futures):
+                id, format, start_frame_nr, nr_of_frames = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append('Failed to pack {}: {}'.format(format, e))
+                    continue
+                filename = get_packed_filename(path, id)
+                log.write(json.dumps({'id': id, 'format': format, 'start_frame_nr': start_frame_nr,
+                                      'nr_of_frames': nr_of_frames, 'filename': filename}) + '\n')
+                log.flush()
+                pending.append(ImageSequence(id=id, packed_file=filename))
+                if len(pending) == chunk_size:
+                    ImageSequence.objects.bulk_update(pending, ['packed_file'])
+                    count += len(pending)
+                    pending = []
+                    if progress is not None:
+                        progress(count)
+    finally:
+        # Don't transcode sequences which have not been started when cancelled
+        for future in futures:
+            future.cancel()
+        pool.shutdown()
+        ImageSequence.objects.bulk_update(pending, ['packed_file'])
+
+    count += len(pending)
+    if progress is not None:
+        progress(count)
+
+    return count, errors
+
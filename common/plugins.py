@@ -0,0 +1,86 @@
+import glob
+import importlib
+import json
+import os
+import sys
+from os.path import basename
+from django.utils.datastructures import MultiValueDict
+from annotationweb.settings import BASE_DIR
+
+
+def load_plugin_modules(folder, reload=False):
+    """
+    Import all modules of a plugin folder, e.g. exporters, as modules of the package with the name of the folder.
+    Modules which already have been imported are not executed again, unless reload is set.
+    :return list of modules, sorted by name:
+    """
+    modules = []
+    for filename in sorted(glob.glob(os.path.join(BASE_DIR, folder, '*.py'))):
+        module_name = folder + '.' + basename(filename)[:-3]
+        if reload and module_name in sys.modules:
+            modules.append(importlib.reload(sys.modules[module_name]))
+        else:
+            modules.append(importlib.import_module(module_name))
+
+    return modules
+
+
+def get_plugin_classes(classes, modules):
+    """
+    Get the plugin classes which are defined in the given modules, in the order of the modules
+    :param classes: list of classes registered by the metaclass of the plugin base class
+    """
+    return [plugin for module in modules for plugin in classes if plugin.__module__ == module.__name__]
+
+
+def find_plugin(plugins, name):
+    """
+    Find an importer or exporter class by its class name, its name or its index in the list
+    :return class, or None if not found:
+    """
+    for index, plugin in enumerate(plugins):
+        if name in (plugin.__name__, getattr(plugin, 'name', None), str(index)):
+            return plugin
+    return None
+
+
+def get_form_data(spec=None, values=None):
+    """
+    Get the data of an importer or exporter form from a JSON object and name=value strings, e.g. from the command line.
+    Values given as name=value replace the values of the JSON object with the same name, a name can be given
+    several times for fields with multiple values.
+    :param spec: dict of field name -> value or list of values
+    :param values: list of name=value strings
+    :return data which can be given to the form:
+    """
+    data = MultiValueDict()
+    for name, value in (spec or {}).items():
+        if isinstance(value, list):
+            data.setlist(name, [str(x) for x in value])
+        elif isinstance(value, bool):
+            data[name] = value
+        else:
+            data[name] = str(value)
+
+    given = set()
+    for item in values or []:
+        if '=' not in item:
+            raise ValueError('Expected name=value, got ' + item)
+        name, value = item.split('=', 1)
+        if name not in given:
+            data.setlist(name, [])
+            given.add(name)
+        data.appendlist(name, value)
+
+    return data
+
+
+def read_form_spec(filename):
+    """
+    Read the JSON object with the form data of an importer or exporter from a file
+    """
+    with open(filename, 'r') as f:
+        spec = json.load(f)
+    if not isinstance(spec, dict):
+        raise ValueError('Expected a JSON object in ' + filename)
+    return spec
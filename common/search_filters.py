@@ -1,61 +1,210 @@
-from annotationweb.models import Task, Label, Subject, ImageAnnotation, ImageMetadata
+from annotationweb.models import Task, Label, Subject, ImageAnnotation, ImageSequence
 from annotationweb.forms import ImageListForm
 from django.contrib.auth.models import User
 from common.label import get_all_labels
+from common.metadata import get_metadata_choices, get_images_with_metadata, get_numeric_metadata_names, \
+    get_images_with_metadata_in_range
+
+
+# Value of a multiple choice filter where all choices are selected
+ALL = '*'
 
 
 class SearchFilter:
+    """
+    The image list filters of a task, stored in the session of the user.
+    Only values which differ from the defaults are stored. Multiple choice filters are stored either as ALL,
+    or as a dict with a list of the excluded choices, so that the session does not grow with the number of subjects.
+    """
+
+    MULTIPLE_CHOICE_FILTERS = ('image_quality', 'subject', 'label', 'user')
+
     def __init__(self, request, task):
         self.request = request
         self.task = task
+        self.session_key = 'search_filters' + str(task.id)
 
         # Get task labels if classification
         self.labels = None
-        labels_selected = None
         if task.type == Task.CLASSIFICATION:
             # Get all labels, including sublabels
             self.labels = get_all_labels(task)
-            labels_selected = [label['id'] for label in self.labels]
 
         self.image_quality = [x for x, y in ImageAnnotation.IMAGE_QUALITY_CHOICES]
-        self.subjects = Subject.objects.filter(dataset__task=task)
+        self.subjects = Subject.objects.filter(dataset__task=task, deleted=False, dataset__deleted=False)
         self.users = User.objects.filter(imageannotation__task=task).distinct()
 
         # Get metadata for task
-        self.metadata = ImageMetadata.objects.values('value', 'name').filter(image__subject__dataset__task=task).distinct()
-
-        if 'search_filters'+str(task.id) not in request.session:
-            request.session['search_filters'+str(task.id)] = {}
-
-            # Set initial values
-            sort_by = ImageListForm.SORT_DATE_DESC # Default sort
-            self.set_value('sort_by', sort_by)
-            self.set_value('image_quality', self.image_quality)
-            subjects_selected = [subject.id for subject in self.subjects]
-            self.set_value('subject', subjects_selected)
-            self.set_value('label', labels_selected)
-            users_selected = [user.id for user in self.users]
-            self.set_value('user', users_selected)
-            metadata_selected = []
-            self.set_value('metadata', metadata_selected)
+        self.metadata = get_metadata_choices(task)
+        self.numeric_metadata = get_numeric_metadata_names(self.metadata)
+
+        self.defaults = {
+            'sort_by': ImageListForm.SORT_DATE_DESC,
+            'image_quality': ALL,
+            'subject': ALL,
+            'label': ALL,
+            'user': ALL,
+            'metadata': [],
+            'metadata_range_name': '',
+            'metadata_min': None,
+            'metadata_max': None,
+        }
+        self.values = dict(self.defaults)
+        self.values.update(request.session.get(self.session_key, {}))
+
+        # Convert explicit lists of selected choices stored by older versions
+        for name in self.MULTIPLE_CHOICE_FILTERS:
+            if isinstance(self.values[name], list):
+                self.set_value(name, self.values[name])
+
+    def get_choices(self, name):
+        """
+        Get all choices of a multiple choice filter as strings, or None if the filter is not used for this task
+        """
+        if name == 'image_quality':
+            return self.image_quality
+        elif name == 'subject':
+            return [str(id) for id in self.subjects.values_list('id', flat=True)]
+        elif name == 'label':
+            if self.labels is None:
+                return None
+            return [str(label['id']) for label in self.labels]
+        elif name == 'user':
+            return [str(id) for id in self.users.values_list('id', flat=True)]
+        else:
+            raise ValueError('Unknown multiple choice filter ' + name)
 
     def set_value(self, name, value):
-        self.request.session['search_filters'+str(self.task.id)][name] = value
+        if name in self.MULTIPLE_CHOICE_FILTERS and value is not None and value != ALL:
+            selected = set(str(x) for x in value)
+            excluded = [x for x in self.get_choices(name) or [] if x not in selected]
+            if len(excluded) == 0:
+                value = ALL
+            else:
+                value = {'exclude': excluded}
+        self.values[name] = value
+        self.save()
+
+    def save(self):
+        """
+        Store the filter values which differ from the defaults in the session.
+        The session is only modified if the stored values changed.
+        """
+        state = {name: value for name, value in self.values.items() if value != self.defaults[name]}
+        if state == self.request.session.get(self.session_key, {}):
+            return
+        if len(state) > 0:
+            self.request.session[self.session_key] = state
+        else:
+            del self.request.session[self.session_key]
 
     def create_form(self, data=None):
         if data is None:
-            form = ImageListForm(self.subjects, self.users, self.metadata, data=self.request.session['search_filters'+str(self.task.id)], labels=self.labels)
+            data = {name: self.get_value(name) for name in self.defaults.keys()}
+            form = ImageListForm(self.subjects, self.users, self.metadata, data=data, labels=self.labels,
+                                 numeric_metadata=self.numeric_metadata)
         else:
-            form = ImageListForm(self.subjects, self.users, self.metadata, data=data, labels=self.labels)
+            form = ImageListForm(self.subjects, self.users, self.metadata, data=data, labels=self.labels,
+                                 numeric_metadata=self.numeric_metadata)
             # Update search filters with contents of form if it is valid
             if form.is_valid():
                 for key, value in form.cleaned_data.items():
-                    if key in self.request.session['search_filters'+str(self.task.id)]:
+                    if key in self.defaults:
                         self.set_value(key, value)
         return form
 
+    def get_excluded(self, name):
+        """
+        Get the excluded choices of a multiple choice filter, this is an empty list if all choices are selected
+        """
+        value = self.values[name]
+        if value == ALL or value is None:
+            return []
+        return value['exclude']
+
     def get_value(self, name):
-        return self.request.session['search_filters'+str(self.task.id)][name]
+        value = self.values[name]
+        if name in self.MULTIPLE_CHOICE_FILTERS:
+            choices = self.get_choices(name)
+            if choices is None or value == ALL:
+                return choices
+            excluded = set(self.get_excluded(name))
+            return [x for x in choices if x not in excluded]
+        return value
 
     def delete(self):
-        del self.request.session['search_filters'+str(self.task.id)]
+        self.values = dict(self.defaults)
+        if self.session_key in self.request.session:
+            del self.request.session[self.session_key]
+
+    def get_metadata_selected(self):
+        """
+        Group the selected 'name: value' metadata items by name
+        :return dict of name -> list of values:
+        """
+        metadata_dict = {}
+        for item in self.get_value('metadata'):
+            # Values can contain ': ', thus split on the first only
+            parts = item.split(': ', 1)
+            if len(parts) != 2:
+                raise Exception('Error: must be 2 parts')
+            name = parts[0]
+            value = parts[1]
+            if name in metadata_dict.keys():
+                metadata_dict[name].append(value)
+            else:
+                metadata_dict[name] = [value]
+
+        return metadata_dict
+
+    def filter_metadata(self, queryset, image_id_field):
+        """
+        Filter a queryset on the selected metadata values and the selected range of a numeric metadata
+        """
+        # Filtered with subqueries, as the number of matching image sequences can be larger than a query can list
+        for name, values in self.get_metadata_selected().items():
+            queryset = queryset.filter(**{image_id_field + '__in': get_images_with_metadata(self.task, name, values)})
+
+        name = self.get_value('metadata_range_name')
+        if name != '' and (self.get_value('metadata_min') is not None or self.get_value('metadata_max') is not None):
+            queryset = queryset.filter(**{image_id_field + '__in': get_images_with_metadata_in_range(
+                self.task, name, self.get_value('metadata_min'), self.get_value('metadata_max'))})
+
+        return queryset
+
+    def get_annotations(self):
+        """
+        Get the finished annotations of this task which match the current filters
+        """
+        queryset = ImageAnnotation.objects.filter(task=self.task, finished=True, image__deleted=False)
+        # Only filter on the excluded choices, to avoid large IN lists when most choices are selected
+        if len(self.get_excluded('image_quality')) > 0:
+            queryset = queryset.exclude(image_quality__in=self.get_excluded('image_quality'))
+        if len(self.get_excluded('user')) > 0:
+            queryset = queryset.exclude(user__in=self.get_excluded('user'))
+        if len(self.get_excluded('subject')) > 0:
+            queryset = queryset.exclude(image__subject__in=self.get_excluded('subject'))
+        if self.task.type == Task.CLASSIFICATION:
+            queryset = queryset.filter(keyframeannotation__imagelabel__label__in=self.get_value('label'))
+
+        return self.filter_metadata(queryset, 'image_id')
+
+    def get_image_sequences(self):
+        """
+        Get the image sequences of this task which match the current filters, in the order they are listed
+        """
+        sort_by = self.get_value('sort_by')
+        if sort_by in (ImageListForm.SORT_IMAGE_ID, ImageListForm.SORT_NOT_ANNOTATED_IMAGE_ID):
+            queryset = ImageSequence.objects.filter(subject__dataset__task=self.task, deleted=False)
+            if len(self.get_excluded('subject')) > 0:
+                queryset = queryset.exclude(subject__in=self.get_excluded('subject'))
+            if sort_by == ImageListForm.SORT_NOT_ANNOTATED_IMAGE_ID:
+                queryset = queryset.exclude(imageannotation__task=self.task, imageannotation__finished=True)
+
+            return self.filter_metadata(queryset, 'id').order_by('id')
+        else:
+            queryset = ImageSequence.objects.filter(imageannotation__in=self.get_annotations())
+            if sort_by == ImageListForm.SORT_DATE_DESC:
+                return queryset.order_by('-imageannotation__date', '-imageannotation__id')
+            else:
+                return queryset.order_by('imageannotation__date', 'imageannotation__id')
@@ -1,13 +1,16 @@
 import json
 import random
+from collections import Counter
 from django.contrib import messages
 from django.http import Http404
 from annotationweb.models import Task, ImageAnnotation, Subject, Label, ImageSequence, KeyFrameAnnotation
 from annotationweb.forms import ImageListForm
 from django.db.models.aggregates import Count
 from common.search_filters import SearchFilter
-from django.db import transaction
-from django.db.models import Q, Exists, OuterRef
+from common.label import get_label_tree
+from django.db import transaction, IntegrityError
+from django.db.models import Q, Exists, OuterRef, F
+from common.delete import delete_in_chunks, delete_object
 
 
 class NoMoreImages(Exception):
@@ -15,13 +18,21 @@ class NoMoreImages(Exception):
     pass
 
 
+class AnnotationChanged(Exception):
+    """"Raise when an annotation was saved by someone else after it was loaded"""
+
+    def __init__(self, version):
+        super().__init__('The annotation was changed by someone else, reload the image to continue.')
+        self.version = version
+
+
 def get_next_unprocessed_image(task):
     """
     Get the next unprocessed image related to a task (in random order)
     :param task:
     :return image:
     """
-    queryset = ImageSequence.objects.filter(subject__dataset__task=task) # Get all sequences for this task
+    queryset = ImageSequence.objects.filter(subject__dataset__task=task, deleted=False) # Get all sequences for this task
     # Exclude does that are marked as finished, or not opened at all
     queryset = queryset.exclude(imageannotation__in=ImageAnnotation.objects.filter(task=task, finished=True))
     if not task.user_frame_selection:
@@ -39,170 +50,50 @@ def get_next_unprocessed_image(task):
     return queryset.order_by("subject", "format")[index]
 
 
-# TODO These two functions get_previous and get_next_image are not up to date and thus just return None
-# TODO cleanup these to functions, extract common functionality
-def get_previous_image(request, task, image):
-    try:
-        search_filters = SearchFilter(request, task)
-
-        sort_by = search_filters.get_value('sort_by')
-        image_quality = search_filters.get_value('image_quality')
-        selected_subjects = search_filters.get_value('subject')
-        selected_labels = search_filters.get_value('label')
-        users_selected = search_filters.get_value('user')
-        metadata = search_filters.get_value('metadata')
-
-        queryset = Image.objects.all()
-
-        if len(metadata) > 0:
-            metadata_dict = {}
-            for item in metadata:
-                parts = item.split(': ')
-                if len(parts) != 2:
-                    raise Exception('Error: must be 2 parts')
-                name = parts[0]
-                value = parts[1]
-                if name in metadata_dict.keys():
-                    metadata_dict[name].append(value)
-                else:
-                    metadata_dict[name] = [value]
-
-            for name, values in metadata_dict.items():
-                queryset = queryset.filter(
-                    metadata__name=name,
-                    metadata__value__in=values
-                )
-
-        if sort_by == ImageListForm.SORT_IMAGE_ID:
-            return queryset.filter(
-                subject__dataset__task=task,
-                subject__in=selected_subjects,
-            ).exclude(id__gte=image.id).order_by('-id')[0].id
+def get_neighbour_image(request, task, image, forward):
+    """
+    Get the id of the image sequence next to the given image in the filtered image list of the task.
+    Uses a single keyset query on (date, id) or id, so that each step is an index lookup.
+    :param forward: True to get the next image, False to get the previous image
+    :return image id or None if there is no such image:
+    """
+    search_filters = SearchFilter(request, task)
+    sort_by = search_filters.get_value('sort_by')
+
+    if sort_by in (ImageListForm.SORT_IMAGE_ID, ImageListForm.SORT_NOT_ANNOTATED_IMAGE_ID):
+        queryset = search_filters.get_image_sequences()
+        if forward:
+            queryset = queryset.filter(id__gt=image.id).order_by('id')
         else:
-            # Get current annotated image
-            annotated_image = ProcessedImage.objects.get(task=task, image=image)
-            if sort_by == ImageListForm.SORT_DATE_DESC:
-                if task.type != Task.CLASSIFICATION:
-                    queryset = queryset.filter(
-                        processedimage__task=task,
-                        processedimage__date__gt=annotated_image.date,
-                        processedimage__image_quality__in=image_quality,
-                        processedimage__user__in=users_selected,
-                        subject__in=selected_subjects,
-                    )
-                else:
-                    queryset = queryset.filter(
-                        processedimage__task=task,
-                        processedimage__date__gt=annotated_image.date,
-                        processedimage__image_quality__in=image_quality,
-                        processedimage__imagelabel__label__in=selected_labels,
-                        processedimage__user__in=users_selected,
-                        subject__in=selected_subjects,
-                    )
-                return queryset.order_by('processedimage__date')[0].id
-            elif sort_by == ImageListForm.SORT_DATE_ASC:
-                if task.type != Task.CLASSIFICATION:
-                    queryset = queryset.filter(
-                        processedimage__task=task,
-                        processedimage__date__lt=annotated_image.date,
-                        processedimage__image_quality__in=image_quality,
-                        processedimage__user__in=users_selected,
-                        subject__in=selected_subjects,
-                    )
-                else:
-                    queryset = queryset.filter(
-                        processedimage__task=task,
-                        processedimage__date__lt=annotated_image.date,
-                        processedimage__image_quality__in=image_quality,
-                        processedimage__imagelabel__label__in=selected_labels,
-                        processedimage__user__in=users_selected,
-                        subject__in=selected_subjects,
-                    )
-                return queryset.order_by('-processedimage__date')[0].id
-    except:
+            queryset = queryset.filter(id__lt=image.id).order_by('-id')
+        return queryset.values_list('id', flat=True).first()
+
+    annotations = search_filters.get_annotations()
+    current = annotations.filter(image=image).values('id', 'date').first()
+    if current is None:
+        # Image is not part of the filtered list
         return None
 
+    # When newest images are listed first, the next image is an older one
+    newer = (sort_by == ImageListForm.SORT_DATE_DESC) != forward
+    if newer:
+        annotations = annotations.filter(
+            Q(date__gt=current['date']) | Q(date=current['date'], id__gt=current['id'])
+        ).order_by('date', 'id')
+    else:
+        annotations = annotations.filter(
+            Q(date__lt=current['date']) | Q(date=current['date'], id__lt=current['id'])
+        ).order_by('-date', '-id')
+
+    return annotations.values_list('image_id', flat=True).first()
+
+
+def get_previous_image(request, task, image):
+    return get_neighbour_image(request, task, image, forward=False)
+
 
 def get_next_image(request, task, image):
-    try:
-        search_filters = SearchFilter(request, task)
-
-        sort_by = search_filters.get_value('sort_by')
-        image_quality = search_filters.get_value('image_quality')
-        selected_subjects = search_filters.get_value('subject')
-        selected_labels = search_filters.get_value('label')
-        users_selected = search_filters.get_value('user')
-        metadata = search_filters.get_value('metadata')
-
-        queryset = Image.objects.all()
-
-        if len(metadata) > 0:
-            metadata_dict = {}
-            for item in metadata:
-                parts = item.split(': ')
-                if len(parts) != 2:
-                    raise Exception('Error: must be 2 parts')
-                name = parts[0]
-                value = parts[1]
-                if name in metadata_dict.keys():
-                    metadata_dict[name].append(value)
-                else:
-                    metadata_dict[name] = [value]
-
-            for name, values in metadata_dict.items():
-                queryset = queryset.filter(
-                    metadata__name=name,
-                    metadata__value__in=values
-                )
-
-        if sort_by == ImageListForm.SORT_IMAGE_ID:
-            return queryset.filter(
-                subject__dataset__task=task,
-                subject__in=selected_subjects,
-            ).exclude(id__lte=image.id).order_by('id')[0].id
-        else:
-            # Get current annotated image
-            annotated_image = ProcessedImage.objects.get(task=task, image=image)
-            if sort_by == ImageListForm.SORT_DATE_DESC:
-                if task.type != Task.CLASSIFICATION:
-                    queryset = queryset.filter(
-                        processedimage__task=task,
-                        processedimage__date__lt=annotated_image.date,
-                        processedimage__image_quality__in=image_quality,
-                        processedimage__user__in=users_selected,
-                        subject__in=selected_subjects,
-                    )
-                else:
-                    queryset = queryset.filter(
-                        processedimage__task=task,
-                        processedimage__date__lt=annotated_image.date,
-                        processedimage__image_quality__in=image_quality,
-                        processedimage__imagelabel__label__in=selected_labels,
-                        processedimage__user__in=users_selected,
-                        subject__in=selected_subjects,
-                    )
-                return queryset.order_by('-processedimage__date')[0].id
-            elif sort_by == ImageListForm.SORT_DATE_ASC:
-                if task.type != Task.CLASSIFICATION:
-                    queryset = queryset.filter(
-                        processedimage__task=task,
-                        processedimage__date__gt=annotated_image.date,
-                        processedimage__image_quality__in=image_quality,
-                        processedimage__user__in=users_selected,
-                        subject__in=selected_subjects,
-                    )
-                else:
-                    queryset = queryset.filter(
-                        processedimage__task=task,
-                        processedimage__date__gt=annotated_image.date,
-                        processedimage__image_quality__in=image_quality,
-                        processedimage__imagelabel__label__in=selected_labels,
-                        processedimage__user__in=users_selected,
-                        subject__in=selected_subjects,
-                    )
-                return queryset.order_by('processedimage__date')[0].id
-    except:
-        return None
+    return get_neighbour_image(request, task, image, forward=True)
 
 
 def setup_task_context(request, task_id, type, image_id):
@@ -213,31 +104,10 @@ def setup_task_context(request, task_id, type, image_id):
     except Task.DoesNotExist:
         raise Http404("Task does not exist")
 
-    # TODO Get label hierarchy
-    # Top labels first
-    toplabels = task.label.all()
-    # Find each sublabel group
-    sublabels = []
-    label_stack = []
-    labels = [] # all labels
-    for label in toplabels:
-        label_stack.append(label)
-        labels.append(label)
-
-    # Process stack
-    while len(label_stack) > 0:
-        current_label = label_stack.pop()
-
-        # Add all children
-        children = []
-        for label in Label.objects.filter(parent=current_label):
-            label_stack.append(label)
-            children.append(label)
-            labels.append(label)
-
-        if len(children) > 0:
-            sublabel = {'id': current_label.id, 'labels': children}
-            sublabels.append(sublabel)
+    # Get label hierarchy
+    label_tree = get_label_tree(task)
+    toplabels = label_tree.toplabels
+    sublabels, labels = label_tree.get_sublabels()
 
     context['toplabels'] = toplabels
     context['sublabels'] = sublabels
@@ -278,13 +148,76 @@ def setup_task_context(request, task_id, type, image_id):
     if processed.exists():
         context['chosen_quality'] = processed[0].image_quality
         context['comments'] = processed[0].comments
+        context['annotation_version'] = processed[0].version
     else:
         context['chosen_quality'] = -1
+        context['annotation_version'] = 0
 
     return context
 
 
+def save_key_frame_rows(model, key_frames, rows, fields):
+    """
+    Store the task specific annotations (e.g. boxes, contours or labels) posted for the key frames of an annotation.
+    The rows of each key frame are compared with those stored, and only key frames whose rows changed are written:
+    if the number of rows is the same, the stored rows are updated in place with one bulk update,
+    otherwise the rows of the key frame are replaced. Must be called inside a transaction, after save_annotation.
+    :param model: model of the rows, with a foreign key to KeyFrameAnnotation
+    :param key_frames: list of KeyFrameAnnotation returned by save_annotation
+    :param rows: list of unsaved model objects of these key frames
+    :param fields: names of the fields which are compared and stored, e.g. ['x', 'y', 'label']
+    :return number of key frames which were changed:
+    """
+    key_frame_field = next(field for field in model._meta.fields if field.related_model is KeyFrameAnnotation)
+    attnames = [model._meta.get_field(name).attname for name in fields]
+
+    def get_payload(row):
+        # Binary fields are read as memoryview on some databases
+        return tuple(bytes(value) if isinstance(value, memoryview) else value for value in
+                     (getattr(row, attname) for attname in attnames))
+
+    new_rows = {key_frame.id: [] for key_frame in key_frames}
+    for row in rows:
+        new_rows[getattr(row, key_frame_field.attname)].append(row)
+    stored_rows = {key_frame_id: [] for key_frame_id in new_rows}
+    for row in model.objects.filter(**{key_frame_field.name + '__in': list(new_rows)}).order_by('pk'):
+        stored_rows[getattr(row, key_frame_field.attname)].append(row)
+
+    updated = []
+    deleted = []
+    created = []
+    changed = 0
+    for key_frame_id, frame_rows in new_rows.items():
+        stored = stored_rows[key_frame_id]
+        if Counter(get_payload(row) for row in stored) == Counter(get_payload(row) for row in frame_rows):
+            continue
+        changed += 1
+        if len(stored) == len(frame_rows):
+            for stored_row, row in zip(stored, frame_rows):
+                row.pk = stored_row.pk
+            updated += frame_rows
+        else:
+            deleted += [row.pk for row in stored]
+            created += frame_rows
+
+    if len(deleted) > 0:
+        model.objects.filter(pk__in=deleted).delete()
+    if len(updated) > 0:
+        model.objects.bulk_update(updated, fields, batch_size=500)
+    if len(created) > 0:
+        model.objects.bulk_create(created)
+
+    return changed
+
+
 def save_annotation(request):
+    """
+    Save the image annotation and the key frames posted by an annotation task.
+    Key frames are compared with the ones stored: removed frames are deleted, new frames are inserted
+    and existing frames are kept with the same primary key, together with their task specific annotations.
+    The caller stores the posted annotations of the key frames with save_key_frame_rows.
+    :return list of KeyFrameAnnotation in the order they were posted:
+    """
     with transaction.atomic():
         if request.method != 'POST':
             raise Exception('ERROR: Must use POST when saving processed image.')
@@ -295,14 +228,13 @@ def save_annotation(request):
 
         image_id = int(request.POST['image_id'])
         task_id = int(request.POST['task_id'])
-        new_key_frames = json.loads(request.POST['target_frames'])
+        new_key_frames = []
+        for frame in json.loads(request.POST['target_frames']):
+            if int(frame) not in new_key_frames:
+                new_key_frames.append(int(frame))
         rejected = request.POST['rejected'] == 'true'
         comments = request.POST['comments']
 
-        # Delete old key frames if they exist, this will also delete old annotations
-        key_frames = KeyFrameAnnotation.objects.filter(image_annotation__task_id=task_id, image_annotation__image_id=image_id)
-        key_frames.delete()
-
         # Save to DB
         try:
             annotation = ImageAnnotation.objects.get(task_id=task_id, image_id=image_id)
@@ -316,16 +248,234 @@ def save_annotation(request):
         annotation.user = request.user
         annotation.finished = True
         annotation.image_quality = request.POST['quality']
+        annotation.version += 1
         annotation.save()
 
-        annotations = []
-        for frame in new_key_frames:
+        key_frames = {key_frame.frame_nr: key_frame for key_frame in KeyFrameAnnotation.objects.filter(image_annotation=annotation)}
+
+        # Delete old key frames which were removed, this will also delete their annotations
+        removed_key_frames = [key_frame.id for frame_nr, key_frame in key_frames.items() if frame_nr not in new_key_frames]
+        if len(removed_key_frames) > 0:
+            KeyFrameAnnotation.objects.filter(id__in=removed_key_frames).delete()
+
+        # Insert new key frames
+        added_key_frames = []
+        for frame_nr in new_key_frames:
+            if frame_nr not in key_frames:
+                keyframe = KeyFrameAnnotation()
+                keyframe.frame_nr = frame_nr
+                keyframe.image_annotation = annotation
+                added_key_frames.append(keyframe)
+        if len(added_key_frames) > 0:
+            KeyFrameAnnotation.objects.bulk_create(added_key_frames)
+            # Primary keys are not set by bulk_create on all databases, thus get the key frames again
+            key_frames = {key_frame.frame_nr: key_frame for key_frame in KeyFrameAnnotation.objects.filter(image_annotation=annotation)}
+
+        annotations = [key_frames[frame_nr] for frame_nr in new_key_frames]
+
+    return annotations
+
+
+def autosave_annotation(request, task_id, image_id, version, frame_nrs):
+    """
+    Mark an annotation as in progress and get its key frames for the given frames, creating those missing.
+    The annotation is marked as finished again when it is saved with save_annotation.
+    Must be called inside a transaction.
+    :param version: the version of the annotation the changes are based on, 0 if it does not exist yet
+    :param frame_nrs: list of frame numbers which are changed
+    :return new version and dict of frame_nr -> KeyFrameAnnotation:
+    """
+    annotation = ImageAnnotation.objects.filter(task_id=task_id, image_id=image_id).first()
+    if annotation is None:
+        if version != 0:
+            # Annotation was deleted
+            raise AnnotationChanged(0)
+        annotation = ImageAnnotation()
+        annotation.image_id = image_id
+        annotation.task_id = task_id
+        annotation.user = request.user
+        annotation.rejected = False
+        annotation.comments = ''
+        annotation.finished = False
+        annotation.version = 1
+        try:
+            with transaction.atomic():
+                annotation.save()
+        except IntegrityError:
+            # Created by another request in the meantime
+            raise AnnotationChanged(ImageAnnotation.objects.get(task_id=task_id, image_id=image_id).version)
+    else:
+        # Only update if nobody else has saved the annotation since the given version
+        updated = ImageAnnotation.objects.filter(id=annotation.id, version=version)\
+            .update(version=F('version') + 1, finished=False, user=request.user)
+        if updated == 0:
+            raise AnnotationChanged(annotation.version)
+        annotation.version = version + 1
+
+    key_frames = {key_frame.frame_nr: key_frame for key_frame in KeyFrameAnnotation.objects.filter(image_annotation=annotation)}
+    added_key_frames = []
+    for frame_nr in frame_nrs:
+        if frame_nr not in key_frames:
             keyframe = KeyFrameAnnotation()
-            keyframe.frame_nr = int(frame)
+            keyframe.frame_nr = frame_nr
             keyframe.image_annotation = annotation
-            keyframe.save()
-            annotations.append(keyframe)
+            added_key_frames.append(keyframe)
+    if len(added_key_frames) > 0:
+        KeyFrameAnnotation.objects.bulk_create(added_key_frames)
+        key_frames = {key_frame.frame_nr: key_frame for key_frame in KeyFrameAnnotation.objects.filter(image_annotation=annotation)}
 
-    return annotations
+    return annotation.version, key_frames
 
 
+def set_key_frames(task, user, key_frames, chunk_size=500):
+    """
+    Select the key frames of many image sequences of a task, using a few queries per chunk of image sequences.
+    Frames which are not selected any more are deleted together with their annotations, new frames are inserted
+    and existing frames are kept. Annotations which get new key frames are marked as unfinished.
+    All frame numbers are validated before anything is changed, and all chunks are stored in one transaction,
+    thus either all or none of the key frames are stored.
+    :param key_frames: dict of image sequence id -> list of frame numbers
+    :return number of key frames created and number of key frames deleted:
+    """
+    image_ids = list(key_frames.keys())
+    chunks = [{image_id: key_frames[image_id] for image_id in image_ids[start:start + chunk_size]}
+              for start in range(0, len(image_ids), chunk_size)]
+    for chunk in chunks:
+        _validate_key_frames(task, chunk)
+
+    created_count = 0
+    deleted_count = 0
+    with transaction.atomic():
+        for chunk in chunks:
+            created, deleted = _set_key_frames(task, user, chunk)
+            created_count += created
+            deleted_count += deleted
+
+    return created_count, deleted_count
+
+
+def _validate_key_frames(task, key_frames):
+    # Validate the frame numbers against the image sequences of the task
+    images = ImageSequence.objects.filter(id__in=key_frames.keys(), subject__dataset__task=task, deleted=False)\
+        .values_list('id', 'start_frame_nr', 'nr_of_frames')
+    frame_ranges = {id: range(start_frame_nr, start_frame_nr + nr_of_frames) for id, start_frame_nr, nr_of_frames in images}
+    for image_id, frame_nrs in key_frames.items():
+        if image_id not in frame_ranges:
+            raise ValueError('Image sequence ' + str(image_id) + ' is not part of task ' + task.name)
+        for frame_nr in frame_nrs:
+            if frame_nr not in frame_ranges[image_id]:
+                raise ValueError('Frame ' + str(frame_nr) + ' is not part of image sequence ' + str(image_id))
+
+
+def _set_key_frames(task, user, key_frames):
+    # Add annotation objects which don't exist
+    annotations = dict(ImageAnnotation.objects.filter(task=task, image_id__in=key_frames.keys()).values_list('image_id', 'id'))
+    new_annotations = []
+    for image_id, frame_nrs in key_frames.items():
+        if image_id not in annotations and len(frame_nrs) > 0:
+            annotation = ImageAnnotation()
+            annotation.image_id = image_id
+            annotation.task = task
+            annotation.user = user
+            annotation.rejected = False
+            annotation.finished = False
+            new_annotations.append(annotation)
+    if len(new_annotations) > 0:
+        ImageAnnotation.objects.bulk_create(new_annotations)
+        # Primary keys are not set by bulk_create on all databases, thus get the annotations again
+        annotations = dict(ImageAnnotation.objects.filter(task=task, image_id__in=key_frames.keys()).values_list('image_id', 'id'))
+
+    selected = {(annotations[image_id], frame_nr) for image_id, frame_nrs in key_frames.items() if image_id in annotations
+                for frame_nr in frame_nrs}
+    existing = {(annotation_id, frame_nr): id for annotation_id, frame_nr, id in KeyFrameAnnotation.objects
+                .filter(image_annotation_id__in=annotations.values()).values_list('image_annotation_id', 'frame_nr', 'id')}
+
+    removed = [id for key, id in existing.items() if key not in selected]
+    delete_in_chunks(KeyFrameAnnotation.objects.filter(id__in=removed))
+
+    added = selected - existing.keys()
+    KeyFrameAnnotation.objects.bulk_create([KeyFrameAnnotation(image_annotation_id=annotation_id, frame_nr=frame_nr)
+                                            for annotation_id, frame_nr in sorted(added)])
+
+    # New frames must be annotated, and an annotation open in the browser must not be autosaved over the changes
+    added_annotations = {annotation_id for annotation_id, frame_nr in added}
+    removed_annotations = {annotation_id for annotation_id, frame_nr in existing.keys() - selected}
+    ImageAnnotation.objects.filter(id__in=added_annotations).update(finished=False)
+    ImageAnnotation.objects.filter(id__in=added_annotations | removed_annotations).update(version=F('version') + 1)
+
+    return len(added), len(removed)
+
+
+def copy_task(job, task_id, copy_annotations=False, chunk_size=1000):
+    """
+    Copy a task with its image and key frame annotations, used as a background job.
+    Rows are copied with bulk inserts in chunks of image annotations, each chunk in its own transaction,
+    using in memory maps from old to new ids. If copy_annotations is False, the task specific annotations
+    (e.g. control points and boxes) are not copied and all images are marked as unfinished.
+    :return the new task:
+    """
+    task = Task.objects.get(pk=task_id)
+    datasets = list(task.dataset.all())
+    labels = list(task.label.all())
+    task.pk = None  # Set primary key to none to copy
+    task.name = task.name + ' Copy'
+    task.save()
+    task.dataset.set(datasets)
+    task.label.set(labels)
+
+    try:
+        annotation_ids = list(ImageAnnotation.objects.filter(task_id=task_id).order_by('id').values_list('id', flat=True))
+        job.set_progress(0, len(annotation_ids))
+        for start in range(0, len(annotation_ids), chunk_size):
+            with transaction.atomic():
+                _copy_annotations(task, annotation_ids[start:start + chunk_size], copy_annotations)
+            job.set_progress(min(start + chunk_size, len(annotation_ids)))
+    except Exception:
+        # Hide the incomplete copy and remove it like the delete views do, it stays hidden if this fails too
+        Task.objects.filter(pk=task.pk).update(deleted=True)
+        job.add_message('Removing the incomplete copy ' + task.name)
+        delete_object(job, Task._meta.label, task.pk)
+        raise
+
+    job.add_message('Task copied to ' + task.name)
+    return task
+
+
+def _copy_annotations(task, annotation_ids, copy_annotations):
+    # Image annotations, the unique task and image pair is used to find the new ids
+    annotations = list(ImageAnnotation.objects.filter(id__in=annotation_ids))
+    old_annotation_ids = {annotation.image_id: annotation.id for annotation in annotations}
+    for annotation in annotations:
+        annotation.pk = None
+        annotation.task = task
+        annotation.version = 0
+        if not copy_annotations:
+            annotation.finished = False
+    ImageAnnotation.objects.bulk_create(annotations)
+    annotation_id_map = {old_annotation_ids[image_id]: id for image_id, id in ImageAnnotation.objects
+                         .filter(task=task, image_id__in=old_annotation_ids.keys()).values_list('image_id', 'id')}
+
+    # Key frames, found with the new image annotation id and frame number
+    key_frames = list(KeyFrameAnnotation.objects.filter(image_annotation_id__in=annotation_ids))
+    old_key_frame_ids = {}
+    for key_frame in key_frames:
+        key_frame.image_annotation_id = annotation_id_map[key_frame.image_annotation_id]
+        old_key_frame_ids[(key_frame.image_annotation_id, key_frame.frame_nr)] = key_frame.id
+        key_frame.pk = None
+    KeyFrameAnnotation.objects.bulk_create(key_frames)
+    if not copy_annotations:
+        return
+
+    key_frame_id_map = {}
+    for image_annotation_id, frame_nr, id in KeyFrameAnnotation.objects\
+            .filter(image_annotation_id__in=annotation_id_map.values())\
+            .values_list('image_annotation_id', 'frame_nr', 'id'):
+        key_frame_id_map[old_key_frame_ids[(image_annotation_id, frame_nr)]] = id
+
+    # Annotations of the task types, e.g. control points and boxes
+    for relation in KeyFrameAnnotation._meta.related_objects:
+        rows = list(relation.related_model._base_manager.filter(**{relation.field.attname + '__in': key_frame_id_map.keys()}))
+        for row in rows:
+            row.pk = None
+            setattr(row, relation.field.attname, key_frame_id_map[getattr(row, relation.field.attname)])
+        relation.related_model._base_manager.bulk_create(rows)
@@ -1,5 +1,7 @@
 import os
 from common.metaimage import MetaImage
+from common.frames import read_container_frame, read_frame, is_container
+from common.frame_store import read_packed_frame
 import PIL
 from shutil import copyfile
 from io import BytesIO
@@ -9,16 +11,30 @@ from annotationweb.post_processing import post_processing_register
 import time
 
 
-def get_image_as_http_response(filename, post_processing_method=''):
+def get_image_as_http_response(filename, post_processing_method='', frame_nr=None, frame=None):
+    """
+    :param frame_nr: frame to show of a container file with all the frames of an image sequence
+    :param frame: PIL image and source of a frame which already has been read, as returned by read_image_sequence_frame
+    """
     _, extension = os.path.splitext(filename)
     buffer = BytesIO()
     start = time.time()
-    if extension.lower() == '.mhd':
-        reader = MetaImage(filename=filename)
-        source = reader
+    if frame is not None:
+        pil_image, source = frame
+    elif frame_nr is not None:
+        pil_image, source = read_container_frame(filename, frame_nr)
+    elif extension.lower() == '.mhd':
+        source = MetaImage(filename=filename)
         # Convert raw data to image, and then to a http response
-        pil_image = reader.get_image()
-        spacing = reader.get_spacing()
+        pil_image = source.get_image()
+    elif extension.lower() == '.png':
+        pil_image = PIL.Image.open(filename)
+        source = pil_image
+    else:
+        raise Exception('Unknown output image extension ' + extension)
+
+    if isinstance(source, MetaImage):
+        spacing = source.get_spacing()
         if spacing[0] != spacing[1]:
             # Compensate for anistropic pixel spacing
             real_aspect = pil_image.width*spacing[0] / (pil_image.height*spacing[1])
@@ -26,11 +42,6 @@ def get_image_as_http_response(filename, post_processing_method=''):
             new_width = int(pil_image.width*(real_aspect / current_aspect))
             new_height = pil_image.height
             pil_image = pil_image.resize((new_width, new_height))
-    elif extension.lower() == '.png':
-        pil_image = PIL.Image.open(filename)
-        source = pil_image
-    else:
-        raise Exception('Unknown output image extension ' + extension)
 
     if post_processing_method is not '':
         post_processing = post_processing_register.get(post_processing_method)
@@ -47,6 +58,29 @@ def get_image_as_http_response(filename, post_processing_method=''):
     return HttpResponse(buffer.getvalue(), content_type="image/png")
 
 
+def read_image_sequence_frame(image_sequence, frame_nr):
+    """
+    Read a frame of an image sequence, from its packed store if it has been packed
+    :return PIL image and the source it was read from, i.e. a MetaImage or PIL image:
+    """
+    return read_stored_frame(image_sequence.format, image_sequence.packed_file, frame_nr)
+
+
+def read_stored_frame(format, packed_file, frame_nr):
+    """
+    Read a frame of an image sequence given by its format and packed store, as read_image_sequence_frame
+    :param packed_file: packed store of the image sequence, or an empty string if it has not been packed
+    """
+    if packed_file != '':
+        return read_packed_frame(packed_file, frame_nr)
+    return read_frame(format, frame_nr)
+
+
+def get_frame_as_http_response(image_sequence, frame_nr, post_processing_method=''):
+    frame = read_image_sequence_frame(image_sequence, frame_nr)
+    return get_image_as_http_response(image_sequence.format.replace('#', str(frame_nr)), post_processing_method, frame=frame)
+
+
 def copy_image(filename, new_filename):
     _, original_extension = os.path.splitext(filename)
     _, new_extension = os.path.splitext(new_filename)
@@ -74,5 +108,39 @@ def copy_image(filename, new_filename):
         raise Exception('Unknown input image extension ' + original_extension)
 
 
+def get_frame_filename(format, frame_nr):
+    """
+    Get the filename of an exported frame of an image sequence, e.g. frame_3.png for the format /path/frame_#.png.
+    Frames of a container file are exported as <name>_<frame_nr>.png, or .mhd if the container is a 3D .mhd file.
+    """
+    if not is_container(format):
+        return os.path.basename(format).replace('#', str(frame_nr))
+    name, extension = os.path.splitext(os.path.basename(format))
+    return name + '_' + str(frame_nr) + ('.mhd' if extension.lower() == '.mhd' else '.png')
+
+
+def export_frame(format, packed_file, frame_nr, new_filename):
+    """
+    Write a frame of an image sequence to a new file, converted to the extension of the new filename.
+    Frames stored one per file are copied with copy_image, frames of a container file are read with read_stored_frame.
+    :param packed_file: packed store of the image sequence, or an empty string if it has not been packed
+    """
+    if not is_container(format):
+        copy_image(format.replace('#', str(frame_nr)), new_filename)
+        return
+
+    pil_image, source = read_stored_frame(format, packed_file, frame_nr)
+    _, new_extension = os.path.splitext(new_filename)
+    if new_extension.lower() == '.mhd':
+        metaimage = MetaImage(data=np.asarray(pil_image), channels=pil_image.mode == 'RGB')
+        if isinstance(source, MetaImage):
+            metaimage.set_spacing(source.get_spacing()[:2])
+        metaimage.write(new_filename)
+    elif new_extension.lower() == '.png':
+        pil_image.save(new_filename)
+    else:
+        raise Exception('Unknown output image extension ' + new_extension)
+
+
 def create_folder(path):
     os.makedirs(path, exist_ok=True)
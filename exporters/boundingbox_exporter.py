@@ -1,6 +1,6 @@
 from common.exporter import Exporter
 from common.metaimage import MetaImage
-from common.utility import create_folder, copy_image
+from common.utility import create_folder, get_frame_filename
 from annotationweb.models import ImageAnnotation, Dataset, Task, Label, Subject, KeyFrameAnnotation
 from boundingbox.models import BoundingBox
 from django import forms
@@ -64,6 +64,7 @@ class BoundingBoxExporter(Exporter):
         label_file.close()
 
         # For each subject
+        exported_frames = []
         for subject in data:
             subject_path = join(path, subject.name)
             create_folder(subject_path)
@@ -72,10 +73,9 @@ class BoundingBoxExporter(Exporter):
                 image_sequence = frame.image_annotation.image
 
                 # Copy image
-                filename = image_sequence.format.replace('#', str(frame.frame_nr))
-                target_name = os.path.basename(image_sequence.format).replace('#',str(frame.frame_nr))
+                target_name = get_frame_filename(image_sequence.format, frame.frame_nr)
                 new_filename = join(subject_path, target_name)
-                copy_image(filename, new_filename)
+                exported_frames.append((image_sequence, frame.frame_nr, new_filename))
 
                 # Write bounding boxes txt file
                 boxes = BoundingBox.objects.filter(image=frame)
@@ -86,5 +86,8 @@ class BoundingBoxExporter(Exporter):
                         label = label_dict[box.label.id]
                         f.write('{} {} {} {} {}\n'.format(label, center_x, center_y, box.width, box.height))
 
+        # Images are copied last, in parallel if several workers are used
+        self.export_frames(exported_frames)
+
         return True, path
 
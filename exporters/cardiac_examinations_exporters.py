@@ -1,5 +1,5 @@
 from common.exporter import Exporter
-from common.utility import copy_image, create_folder
+from common.utility import copy_image, create_folder, read_image_sequence_frame
 from annotationweb.models import *
 from classification.models import ImageLabel
 from django import forms
@@ -255,13 +255,8 @@ class CardiacHDFExaminationsExporter(Exporter):
                         end_frame = min(nr_of_frames, key_frame.frame_nr + self.task.frames_after + 1)
 
                     for i in range(start_frame, end_frame):
-                        # Get image
-                        filename = image_sequence.format.replace('#', str(i))
-                        if filename[-4:] == '.mhd':
-                            metaimage = MetaImage(filename=filename)
-                            image = metaimage.get_image()
-                        else:
-                            image = PIL.Image.open(filename)
+                        # Get image, from the packed store if the sequence has been packed
+                        image, _ = read_image_sequence_frame(image_sequence, i)
 
                         # Setup assigned colormode
                         if form.cleaned_data['colormode'] != image.mode:
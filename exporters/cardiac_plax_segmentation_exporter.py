@@ -1,9 +1,9 @@
 from math import sqrt, floor, ceil
 from common.exporter import Exporter
 from common.metaimage import MetaImage
-from common.utility import create_folder, copy_image
+from common.utility import create_folder, get_frame_filename, export_frame
 from annotationweb.models import ImageAnnotation, Dataset, Task, Label, Subject, KeyFrameAnnotation, ImageMetadata
-from spline_segmentation.models import ControlPoint
+from common.control_points import get_control_points
 from django import forms
 import os
 from os.path import join
@@ -71,12 +71,11 @@ class CardiacPLAXSegmentationExporter(Exporter):
                 subject_subfolder = join(subject_path, str(sequence_id))
                 create_folder(subject_subfolder)
 
-                target_name = os.path.basename(image_sequence.format).replace('#',str(frame.frame_nr))
+                target_name = get_frame_filename(image_sequence.format, frame.frame_nr)
                 target_gt_name = os.path.splitext(target_name)[0]+"_gt.mhd"
 
-                filename = image_sequence.format.replace('#', str(frame.frame_nr))
                 new_filename = join(subject_subfolder, target_name)
-                copy_image(filename, new_filename)
+                export_frame(image_sequence.format, image_sequence.packed_file, frame.frame_nr, new_filename)
 
                 # Get control points to create segmentation
                 x_scaling = 1
@@ -206,12 +205,13 @@ class CardiacPLAXSegmentationExporter(Exporter):
         print('X scaling is', x_scaling)
         image_size = [image_size[1], image_size[0]]
         # Get control points for all objects
-        control_points0 = list(ControlPoint.objects.filter(image=frame, object=0).order_by('index'))
-        control_points1 = list(ControlPoint.objects.filter(image=frame, object=1).order_by('index'))
-        control_points2 = list(ControlPoint.objects.filter(image=frame, object=2).order_by('index'))
-        control_points3 = list(ControlPoint.objects.filter(image=frame, object=3).order_by('index'))
-        control_points4 = list(ControlPoint.objects.filter(image=frame, object=4).order_by('index'))
-        control_points5 = list(ControlPoint.objects.filter(image=frame, object=5).order_by('index'))
+        control_points = {object: points for object, (label, points) in get_control_points(frame).items()}
+        control_points0 = control_points.get(0, [])
+        control_points1 = control_points.get(1, [])
+        control_points2 = control_points.get(2, [])
+        control_points3 = control_points.get(3, [])
+        control_points4 = control_points.get(4, [])
+        control_points5 = control_points.get(5, [])
 
         if x_scaling != 1:
             for point in control_points0:
@@ -1,10 +1,9 @@
 from math import sqrt, floor, ceil
 from common.exporter import Exporter
 from common.metaimage import MetaImage
-from common.utility import create_folder, copy_image
+from common.utility import create_folder, get_frame_filename, export_frame
 from annotationweb.models import ImageAnnotation, Dataset, Task, Label, Subject, KeyFrameAnnotation, ImageMetadata
 from image_quality.models import ImageQualityTask, Category, Ranking
-from spline_segmentation.models import ControlPoint
 from django import forms
 import os
 from os.path import join
@@ -68,12 +67,11 @@ class ImageQualityExporter(Exporter):
                 subject_subfolder = join(subject_path, str(sequence_id))
                 create_folder(subject_subfolder)
 
-                target_name = os.path.basename(image_sequence.format).replace('#',str(frame.frame_nr))
+                target_name = get_frame_filename(image_sequence.format, frame.frame_nr)
                 target_gt_name = os.path.splitext(target_name)[0]+"_image_quality.txt"
 
-                filename = image_sequence.format.replace('#', str(frame.frame_nr))
                 new_filename = join(subject_subfolder, target_name)
-                copy_image(filename, new_filename)
+                export_frame(image_sequence.format, image_sequence.packed_file, frame.frame_nr, new_filename)
 
                 self.save_segmentation(frame, join(subject_subfolder, target_gt_name))
 
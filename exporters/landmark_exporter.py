@@ -1,6 +1,6 @@
 from common.exporter import Exporter
 from common.metaimage import MetaImage
-from common.utility import create_folder, copy_image
+from common.utility import create_folder, read_image_sequence_frame
 from annotationweb.models import ImageAnnotation, Dataset, Task, Label, Subject, KeyFrameAnnotation
 from django import forms
 import os
@@ -76,9 +76,10 @@ class LandmarkExporter(Exporter):
                     f.write((annotation.comments).encode('ascii', 'ignore').decode('ascii').replace('\n', '<br>') + '\n') # Encoding fix
                     # Get aspect ratio to correct x landmarks, because they are stored with isotropic spacing, while images
                     # are often not stored in isotropic spacing
-                    metaimage = MetaImage(filename=annotation.image.format.replace('#', str(0)))
-                    spacingX = metaimage.get_spacing()[0]
-                    spacingY = metaimage.get_spacing()[1]
+                    _, source = read_image_sequence_frame(annotation.image, annotation.image.start_frame_nr)
+                    spacing = source.get_spacing() if isinstance(source, MetaImage) else [1, 1]
+                    spacingX = spacing[0]
+                    spacingY = spacing[1]
                     aspect = (spacingY / spacingX)
                     for frame in frames:
                         # Write bounding boxes txt file
@@ -1,9 +1,10 @@
 from math import sqrt, floor, ceil
 from common.exporter import Exporter
 from common.metaimage import MetaImage
-from common.utility import create_folder, copy_image
+from common.utility import create_folder, get_frame_filename, export_frame
 from annotationweb.models import ImageAnnotation, Dataset, Task, Label, Subject, KeyFrameAnnotation, ImageMetadata
-from spline_segmentation.models import ControlPoint
+from spline_segmentation.models import Contour
+from common.control_points import unpack_points
 from django import forms
 import os
 from os.path import join
@@ -73,12 +74,11 @@ class SplineLinePointExporter(Exporter):
                 subject_subfolder = join(subject_path, str(sequence_id))
                 create_folder(subject_subfolder)
 
-                target_name = os.path.basename(image_sequence.format).replace('#',str(frame.frame_nr))
+                target_name = get_frame_filename(image_sequence.format, frame.frame_nr)
                 target_gt_name = os.path.splitext(target_name)[0]+"_gt.mhd"
 
-                filename = image_sequence.format.replace('#', str(frame.frame_nr))
                 new_filename = join(subject_subfolder, target_name)
-                copy_image(filename, new_filename)
+                export_frame(image_sequence.format, image_sequence.packed_file, frame.frame_nr, new_filename)
 
                 # Get control points to create segmentation
                 if new_filename.endswith('.mhd'):
@@ -100,11 +100,11 @@ class SplineLinePointExporter(Exporter):
         labels = Label.objects.filter(task=frame.image_annotation.task).order_by('id')
         counter = 1
         for label in labels:
-            objects = ControlPoint.objects.filter(label=label, image=frame).only('object').distinct()
-            for object in objects:
+            contours = Contour.objects.filter(label=label, image=frame).order_by('object').values_list('points', flat=True)
+            for points in contours:
                 previous_x = None
                 previous_y = None
-                control_points = ControlPoint.objects.filter(label=label, image=frame, object=object.object).order_by('index')
+                control_points = unpack_points(points)
                 max_index = len(control_points)
 
                 if max_index == 1:
@@ -1,9 +1,10 @@
 from math import sqrt, floor, ceil
 from common.exporter import Exporter
 from common.metaimage import MetaImage
-from common.utility import create_folder, copy_image
+from common.utility import create_folder, get_frame_filename, export_frame, read_image_sequence_frame
 from annotationweb.models import ImageAnnotation, Dataset, Task, Label, Subject, KeyFrameAnnotation, ImageMetadata
-from spline_segmentation.models import ControlPoint
+from spline_segmentation.models import Contour
+from common.control_points import unpack_points
 from django import forms
 import os
 from os.path import join
@@ -132,12 +133,11 @@ class SplineSegmentationExporter(Exporter):
                 subject_subfolder = join(subject_path, str(sequence_id))
                 create_folder(subject_subfolder)
 
-                target_name = os.path.basename(image_sequence.format).replace('#',str(frame.frame_nr))
+                target_name = get_frame_filename(image_sequence.format, frame.frame_nr)
                 target_gt_name = os.path.splitext(target_name)[0]+"_gt.mhd"
 
-                filename = image_sequence.format.replace('#', str(frame.frame_nr))
                 new_filename = join(subject_subfolder, target_name)
-                copy_image(filename, new_filename)
+                export_frame(image_sequence.format, image_sequence.packed_file, frame.frame_nr, new_filename)
 
                 # Get control points to create segmentation
                 if new_filename.endswith('.mhd'):
@@ -161,12 +161,12 @@ class SplineSegmentationExporter(Exporter):
         xy_new_temp =0
 
         for label in labels:
-            objects = ControlPoint.objects.filter(label=label, image=frame).only('object').distinct()
-            for object in objects:
+            contours = Contour.objects.filter(label=label, image=frame).order_by('object').values_list('points', flat=True)
+            for points in contours:
                 previous_x = None
                 previous_y = None
                 xy = []
-                control_points = ControlPoint.objects.filter(label=label, image=frame, object=object.object).order_by('index')
+                control_points = unpack_points(points)
                 max_index = len(control_points)
                 for i in range(max_index):
                     if i == 0:
@@ -241,12 +241,10 @@ class SplineSegmentationExporter(Exporter):
         segmentation, coords = self.get_object_segmentation(image_size, frame)
 
         if json_annotations:
-            image_filename = frame.image_annotation.image.format.replace('#', str(frame.frame_nr))
-            if image_filename.endswith('.mhd'):
-                image_mhd = MetaImage(filename=image_filename)
-                image_array = image_mhd.get_pixel_data()
+            image_pil, source = read_image_sequence_frame(frame.image_annotation.image, frame.frame_nr)
+            if isinstance(source, MetaImage):
+                image_array = source.get_pixel_data()
             else:
-                image_pil = PIL.Image.open(image_filename)
                 image_array = np.asarray(image_pil)
             image_data = img_arr_to_b64(image_array)
             json_dict = create_json(coords, image_size, filename, image_data)
@@ -1,3 +1,43 @@
-from django.test import TestCase
+from annotationweb.models import Task
+from annotationweb.testing import SaveAnnotationTestCase, get_frame_data
+from .models import ImageQualityTask, Rank, Category, Ranking
 
-# Create your tests here.
+
+class SaveRankingsTests(SaveAnnotationTestCase):
+    task_type = Task.IMAGE_QUALITY
+    save_view = 'image_quality:save'
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        iq_task = ImageQualityTask.objects.create(name='Image quality')
+        iq_task.task.add(cls.task)
+        cls.ranks = [Rank.objects.create(index=i, name='Rank ' + str(i)) for i in range(3)]
+        cls.categories = []
+        for i in range(4):
+            category = Category.objects.create(iq_task=iq_task, name='Category ' + str(i))
+            category.rankings.add(*cls.ranks)
+            cls.categories.append(category)
+
+    def save_rankings(self, nr_of_frames, rank_id=None):
+        # Rank every category in each frame
+        rankings = {str(category.id): rank_id or self.ranks[1].id for category in self.categories}
+        return self.save(nr_of_frames, rankings=get_frame_data(nr_of_frames, rankings))
+
+    def test_query_count_is_independent_of_frame_count(self):
+        response, queries = self.save_rankings(1)
+        self.assertEqual(response['success'], 'true')
+        self.assertEqual(self.save_rankings(20)[1], queries)
+        self.assertEqual(Ranking.objects.filter(selection=self.ranks[1]).count(), 84)
+
+    def test_missing_rank(self):
+        response, queries = self.save_rankings(2, rank_id=-1)
+        self.assertEqual(response['success'], 'false')
+        self.assertEqual(Ranking.objects.count(), 0)
+
+    def test_rank_of_other_category(self):
+        # A rank must be one of the rankings of its category
+        self.categories[0].rankings.remove(self.ranks[2])
+        response, queries = self.save_rankings(1, rank_id=self.ranks[2].id)
+        self.assertEqual(response['success'], 'false')
+        self.assertEqual(Ranking.objects.count(), 0)
@@ -23,7 +23,8 @@ def rank_image(request, task_id, image_id):
         # Check if image is already segmented, if so get data and pass to template
         try:
             annotations = KeyFrameAnnotation.objects.filter(image_annotation__task_id=task_id, image_annotation__image_id=image_id)
-            context['rankings'] = Ranking.objects.filter(annotation__in=annotations)
+            context['annotation_data'] = list(Ranking.objects.filter(annotation__in=annotations)
+                                              .values_list('annotation__frame_nr', 'category_id', 'selection_id'))
         except KeyFrameAnnotation.DoesNotExist:
             pass
 
@@ -40,26 +41,35 @@ def save(request):
     error_messages = ''
 
     rankings = json.loads(request.POST['rankings'])
-    print(request.POST)
 
     try:
         # Use atomic transaction here so if something crashes the annotations are restored..
         with transaction.atomic():
             annotations = common.task.save_annotation(request)
 
-            # Save segmentation
-            # Save control points
+            # Get the categories of the task and their ranks with one query
+            task_id = int(request.POST['task_id'])
+            category_ranks = set(Category.rankings.through.objects.filter(category__iq_task__task=task_id)
+                                 .values_list('category_id', 'rank_id'))
+            category_ids = {category_id for category_id, rank_id in category_ranks}
+
+            new_rankings = []
             for annotation in annotations:
                 frame_nr = str(annotation.frame_nr)
                 for key, value in rankings[frame_nr].items():
                     ranking = Ranking()
                     ranking.annotation = annotation
-                    ranking.category = Category.objects.get(id=key)
+                    ranking.category_id = int(key)
+                    if ranking.category_id not in category_ids:
+                        raise Category.DoesNotExist(f'Category with id {key} does not exist in this task')
                     try:
-                        ranking.selection = Rank.objects.get(id=value)
-                    except Rank.DoesNotExist:
+                        ranking.selection_id = int(value)
+                    except (TypeError, ValueError):
+                        ranking.selection_id = None
+                    if (ranking.category_id, ranking.selection_id) not in category_ranks:
                         raise Exception(f'You must select image quality for all categories. Missing for frame {frame_nr}')
-                    ranking.save()
+                    new_rankings.append(ranking)
+            common.task.save_key_frame_rows(Ranking, annotations, new_rankings, ['category', 'selection'])
 
             response = {
                 'success': 'true',
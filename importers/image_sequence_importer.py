@@ -1,12 +1,29 @@
 from common.importer import Importer
 from django import forms
-from annotationweb.models import ImageSequence, Dataset, Subject, ImageMetadata
+from django.db import transaction
+from annotationweb.models import ImageSequence, Dataset, Subject, ImageMetadata, ImportManifest
 import os
-from os.path import join, basename
-import glob
+from os.path import join, basename, dirname
+from concurrent.futures import ThreadPoolExecutor
+from common.frames import find_frame_numbers, get_frame_range, get_container_frames, hash_image_sequence, CONTAINER_EXTENSIONS
+from common.metadata import update_metadata_facets, create_metadata, read_metadata_folder, read_metadata_csv, set_metadata
+from common.packing import pack_image_sequences
 
 class ImageSequenceImporterForm(forms.Form):
+    DUPLICATES_REPORT = 'report'
+    DUPLICATES_SKIP = 'skip'
+
     path = forms.CharField(label='Data path', max_length=1000)
+    duplicates = forms.ChoiceField(label='Duplicates', required=False, initial=DUPLICATES_REPORT, choices=(
+        (DUPLICATES_REPORT, 'Import and report sequences with the same content as another sequence of the dataset'),
+        (DUPLICATES_SKIP, 'Skip sequences with the same content as another sequence of the dataset'),
+    ))
+    metadata_csv = forms.CharField(label='Metadata CSV file', max_length=1000, required=False,
+                                   help_text='Optional. First row: path, followed by the metadata names. Other rows: path of '
+                                             'a sequence folder, relative to the data path, followed by its values.')
+    pack_path = forms.CharField(label='Pack frames to folder', max_length=1000, required=False,
+                                help_text='Optional. Transcode each image sequence into one file in this folder, '
+                                          'from which frames are read faster. The original images are kept.')
 
     # TODO validate path
 
@@ -26,14 +43,35 @@ class ImageSequenceImporter(Importer):
             ...
     Subject 2/
         ...
+    Sequence folders can have metadata in a metadata.txt file with a name: value pair on each line, or in a metadata.json
+    file with an object of name -> value. Metadata can also be given for all sequences in a CSV file.
     Allow both .mhd and .png sequences from the same root folder.
     Assumes that a single sequence does not mix .mhd and .png
+    A sequence folder can instead have a single file with all frames: a 3D .mhd, a multi-page .tif or an .h5 file,
+    in which case the first dataset with at least 3 dimensions is used.
 
     This importer will create a subject for each subject folder and an image sequence for each subfolder.
+    Folders are scanned in parallel by a pool of worker threads, which is useful on network storage,
+    and new image sequences are inserted in chunks, each chunk in its own transaction.
+    When run as a job, the progress is reported first as folders scanned and then as image sequences created.
+
+    When importing the same folder again, folders which have not been modified since the last import are
+    not listed again. Sequences with added or removed frames are updated, keeping their annotations.
+
+    A hash of the content of each new sequence is computed by the pool of worker threads. For long sequences only
+    a sample of the frames is hashed. Sequences with the same content as another sequence of the dataset, e.g. the
+    same exam stored under two subjects, are reported or skipped. Sequences of the dataset which were imported
+    before content hashes were stored are hashed on the next import. If their files can't be read they are marked,
+    and not hashed again until their frames change.
+
+    Optionally, each image sequence is transcoded into a packed store with all frames in one file, in a pool of
+    worker processes. The number of worker threads and processes is given by workers. Sequences with added or removed frames are packed again.
     """
 
     name = 'Image sequence importer'
-    dataset = None
+    workers = 8
+    hash_frames = 16
+    chunk_size = 1000
 
     def get_form(self, data=None):
         return ImageSequenceImporterForm(data)
@@ -43,93 +81,337 @@ class ImageSequenceImporter(Importer):
             raise Exception('Dataset must be given to importer')
 
         path = form.cleaned_data['path']
-        # Go through each subfolder and create a subject for each
-        for file in os.listdir(path):
-            subject_dir = join(path, file)
-            if not os.path.isdir(subject_dir):
-                continue
+        scanner = FolderScanner(ImportManifest.objects.filter(dataset=self.dataset, path__startswith=join(path, '')))
+        pool = ThreadPoolExecutor(self.workers)
+        futures = []
 
-            try:
-                # Check if subject exists in this dataset first
-                subject = Subject.objects.get(name=file, dataset=self.dataset)
-            except Subject.DoesNotExist:
-                # Create new subject
-                subject = Subject()
-                subject.name = file
-                subject.dataset = self.dataset
-                subject.save()
-
-            for file2 in os.listdir(subject_dir):
-                image_sequence_dir = join(subject_dir, file2)
-                if not os.path.isdir(image_sequence_dir):
-                    continue
+        def map_in_pool(function, items):
+            # Like pool.map, but the futures are kept, so that those not started can be cancelled
+            futures[:] = [future for future in futures if not future.done()]
+            submitted = [pool.submit(function, item) for item in items]
+            futures.extend(submitted)
+            return (future.result() for future in submitted)
 
-                # Count nr of frames
-                # Handle only monotype sequence: .mhd or .png
-                frames = []
-                extension = None
-                name = ''
-                for file3 in os.listdir(image_sequence_dir):
-                    if file3[-4:] == '.mhd':
-                        image_filename = join(image_sequence_dir, file3)
-                        frames.append(image_filename)
-                        name = file3[:file3.rfind('_')]
-                        if extension is None or extension == '.mhd':
-                            extension = '.mhd'
-                        else:
-                            raise Exception('Found both mhd and png images in the same folder.')
-                    elif file3[-4:] == '.png':
-                        image_filename = join(image_sequence_dir, file3)
-                        frames.append(image_filename)
-                        name = file3[:file3.rfind('_')]
-                        if extension is None or extension == '.png':
-                            extension = '.png'
-                        else:
-                            raise Exception('Found both mhd and png images in the same folder.')
-
-                if len(frames) == 0:
+        try:
+            # Go through each subfolder, and each subfolder of those, in parallel.
+            # Folders which have not changed since the last import are not listed again.
+            subject_dirs = [entry.path for entry in os.scandir(path) if entry.is_dir()]
+            subject_folders = list(map_in_pool(scanner.scan_subject_folder, subject_dirs))
+            sequence_dirs = [(basename(subject_folder.path), sequence_dir)
+                             for subject_folder, sequence_dirs in subject_folders for sequence_dir in sequence_dirs]
+            sequence_folders = []
+            self.set_progress(0, len(sequence_dirs))
+            for folder in map_in_pool(scanner.scan_sequence_folder, [sequence_dir for subject_name, sequence_dir in sequence_dirs]):
+                sequence_folders.append(folder)
+                if len(sequence_folders) % 100 == 0:
+                    self.set_progress(len(sequence_folders))
+                    self.check_cancelled()
+
+            # Create a subject for each subject folder which does not exist in this dataset
+            subjects = self.get_subjects()
+            new_subjects = set(basename(subject_dir) for subject_dir in subject_dirs if basename(subject_dir) not in subjects)
+            if len(new_subjects) > 0:
+                Subject.objects.bulk_create([Subject(name=name, dataset=self.dataset) for name in sorted(new_subjects)])
+                subjects = self.get_subjects()
+
+            # Compare with the sequences which already have been imported
+            existing = {(subject_id, format): (id, start_frame_nr, nr_of_frames) for subject_id, format, id, start_frame_nr, nr_of_frames
+                        in ImageSequence.objects.filter(subject__dataset=self.dataset)
+                        .values_list('subject_id', 'format', 'id', 'start_frame_nr', 'nr_of_frames')}
+            found = set()
+            added = []
+            changed = []
+            changed_folders = []
+            for (subject_name, sequence_dir), folder in zip(sequence_dirs, sequence_folders):
+                if folder.error != '':
+                    self.add_message(folder.error)
+                if folder.format == '':
                     continue
+                key = (subjects[subject_name], folder.format)
+                found.add(key)
+                if key not in existing:
+                    added.append((subjects[subject_name], folder))
+                elif existing[key][1:] != (folder.start_frame_nr, folder.nr_of_frames):
+                    # Frames were added or removed, keep the sequence and its annotations
+                    changed.append(ImageSequence(id=existing[key][0], start_frame_nr=folder.start_frame_nr,
+                                                 nr_of_frames=folder.nr_of_frames, packed_file=''))
+                    changed_folders.append(folder)
+            removed = [key for key in existing.keys() if key not in found and key[1].startswith(join(path, ''))]
+            self.add_message('Scanned {} folders, found {} new image sequences'.format(len(sequence_folders), len(added)))
+
+            # Hashes of the content of the sequences of the dataset, to find duplicates
+            known = {}
+            unhashed = []
+            changed_ids = {image_sequence.id for image_sequence in changed}
+            for id, format, start_frame_nr, nr_of_frames, content_hash in ImageSequence.objects\
+                    .filter(subject__dataset=self.dataset, deleted=False)\
+                    .values_list('id', 'format', 'start_frame_nr', 'nr_of_frames', 'content_hash').iterator():
+                if content_hash == '':
+                    if id not in changed_ids:
+                        unhashed.append((id, format, start_frame_nr, nr_of_frames))
+                elif content_hash != ImageSequence.HASH_UNREADABLE:
+                    known[content_hash] = format
 
-                filename_format = join(image_sequence_dir, name + '_#')
-                filename_format += extension
-                try:
-                    # Check to see if sequence exist
-                    image_sequence = ImageSequence.objects.get(format=filename_format, subject=subject)
-                    # Check to see that nr of sequences is correct
-                    if image_sequence.nr_of_frames < len(frames):
-                        # Delete this sequnce, and redo it
-                        image_sequence.delete()
-                        # Create new
-                        image_sequence = ImageSequence()
-                        image_sequence.format = filename_format
-                        image_sequence.subject = subject
-                        image_sequence.nr_of_frames = len(frames)
-                        image_sequence.save()
+            # Sequences imported before content hashes were stored are hashed once, so that copies of them are found.
+            # Sequences which can't be read are marked, so that they are not tried again by every import.
+            hashed = []
+            unreadable = 0
+            for (id, format, start_frame_nr, nr_of_frames), content_hash in zip(unhashed, map_in_pool(self.hash_existing, unhashed)):
+                hashed.append(ImageSequence(id=id, content_hash=content_hash))
+                if content_hash == ImageSequence.HASH_UNREADABLE:
+                    unreadable += 1
+                    self.add_message('Could not compute the content hash of {}, it is not hashed again until its frames change'.format(format))
+                else:
+                    known.setdefault(content_hash, format)
+            ImageSequence.objects.bulk_update(hashed, ['content_hash'], batch_size=500)
+            if len(hashed) > 0:
+                self.add_message('Computed the content hash of {} image sequences imported before, {} could not be read'.format(
+                    len(hashed) - unreadable, unreadable))
+            skip_duplicates = form.cleaned_data.get('duplicates') == ImageSequenceImporterForm.DUPLICATES_SKIP
+            duplicates = []
+            created = 0
+            self.set_progress(0, len(added))
+            for start in range(0, len(added), self.chunk_size):
+                self.check_cancelled()
+                sequences = added[start:start + self.chunk_size]
+                hashes = map_in_pool(self.hash_folder, [folder for subject_id, folder in sequences])
+                chunk = []
+                for (subject_id, folder), content_hash in zip(sequences, hashes):
+                    folder.content_hash = content_hash
+                    if content_hash in known:
+                        duplicates.append((folder.format, known[content_hash]))
+                        if skip_duplicates:
+                            continue
                     else:
-                        # Skip importing data, as this has already have been done
-                        continue
-                except ImageSequence.DoesNotExist:
-                    # Create new image sequence
-                    image_sequence = ImageSequence()
-                    image_sequence.format = filename_format
-                    image_sequence.subject = subject
-                    image_sequence.nr_of_frames = len(frames)
-                    image_sequence.save()
-
-                # Check if metadata.txt exists, and if so parse it and add
-                metadata_filename = join(image_sequence_dir, 'metadata.txt')
-                if os.path.exists(metadata_filename):
-                    with open(metadata_filename, 'r') as f:
-                        for line in f:
-                            parts = line.split(':')
-                            if len(parts) != 2:
-                                raise Exception('Excepted 2 parts when spliting metadata in file ' + metadata_filename)
-
-                            # Save to DB
-                            metadata = ImageMetadata()
-                            metadata.image = image_sequence
-                            metadata.name = parts[0].strip()
-                            metadata.value = parts[1].strip()
-                            metadata.save()
-
-        return True, path
+                        known[content_hash] = folder.format
+                    chunk.append((subject_id, folder))
+                metadata = list(map_in_pool(read_metadata_folder, [folder.path for subject_id, folder in chunk]))
+                with transaction.atomic():
+                    self.create_image_sequences(chunk, metadata)
+                created += len(chunk)
+                self.set_progress(start + len(sequences))
+
+            for image_sequence, content_hash in zip(changed, map_in_pool(self.hash_folder, changed_folders)):
+                image_sequence.content_hash = content_hash
+        finally:
+            # Don't wait for folders which have not been scanned yet when cancelled
+            for future in futures:
+                future.cancel()
+            pool.shutdown()
+
+        with transaction.atomic():
+            ImageSequence.objects.bulk_update(changed, ['start_frame_nr', 'nr_of_frames', 'packed_file', 'content_hash'])
+            scanner.update_manifest(self.dataset, [subject_folder for subject_folder, sequence_dirs in subject_folders] + sequence_folders)
+
+        if form.cleaned_data.get('metadata_csv', '') != '':
+            self.import_metadata_csv(path, form.cleaned_data['metadata_csv'])
+        if created > 0 or form.cleaned_data.get('metadata_csv', '') != '':
+            update_metadata_facets(self.dataset)
+
+        message = '{}: {} image sequences added, {} changed and {} not found. Sequences which are not found are not deleted.'\
+            .format(path, created, len(changed), len(removed))
+        if len(duplicates) > 0:
+            for format, original in duplicates:
+                self.add_message('{} has the same content as {}'.format(format, original))
+            message += ' {} duplicates {}.'.format(len(duplicates), 'skipped' if skip_duplicates else 'found')
+        if form.cleaned_data.get('pack_path', '') != '':
+            message += ' ' + self.pack(path, form.cleaned_data['pack_path'])
+
+        return True, message
+
+    def import_metadata_csv(self, path, filename):
+        with open(filename, 'r', newline='') as f:
+            metadata = read_metadata_csv(f)
+
+        # Sequences are found by their folder, which can be relative to the data path or absolute
+        image_ids = {os.path.normpath(dirname(format)): id for id, format in ImageSequence.objects
+                     .filter(subject__dataset=self.dataset, format__startswith=join(path, '')).values_list('id', 'format')}
+        found = {}
+        for folder, values in metadata.items():
+            folder = os.path.normpath(join(path, folder))
+            if folder in image_ids:
+                found[image_ids[folder]] = values
+        set_metadata(found)
+        self.add_message('Metadata of {} image sequences imported from {}, {} were not found'.format(
+            len(found), filename, len(metadata) - len(found)))
+
+    def pack(self, path, pack_path):
+        image_sequences = ImageSequence.objects.filter(subject__dataset=self.dataset, format__startswith=join(path, ''), deleted=False)
+        self.set_progress(0, image_sequences.filter(packed_file='').count())
+
+        def progress(count):
+            self.set_progress(count)
+            self.check_cancelled()
+
+        # Transcoding is limited by the processor, thus use at most one process per core
+        count, errors = pack_image_sequences(image_sequences, pack_path, min(self.workers, os.cpu_count() or 1), progress)
+        for error in errors:
+            self.add_message(error)
+        return '{} image sequences packed to {}, {} failed.'.format(count, pack_path, len(errors))
+
+    def hash_folder(self, folder):
+        return hash_image_sequence(folder.format, folder.start_frame_nr, folder.nr_of_frames, self.hash_frames)
+
+    def hash_existing(self, values):
+        """
+        Hash an image sequence which already is in the dataset
+        :param values: tuple of id, format, start_frame_nr and nr_of_frames
+        :return hash, or ImageSequence.HASH_UNREADABLE if the files can't be read:
+        """
+        id, format, start_frame_nr, nr_of_frames = values
+        try:
+            return hash_image_sequence(format, start_frame_nr, nr_of_frames, self.hash_frames)
+        except OSError:
+            return ImageSequence.HASH_UNREADABLE
+
+    def get_subjects(self):
+        return dict(Subject.objects.filter(dataset=self.dataset).values_list('name', 'id'))
+
+    def create_image_sequences(self, sequences, metadata):
+        image_sequences = []
+        for subject_id, folder in sequences:
+            image_sequence = ImageSequence()
+            image_sequence.format = folder.format
+            image_sequence.subject_id = subject_id
+            image_sequence.start_frame_nr = folder.start_frame_nr
+            image_sequence.nr_of_frames = folder.nr_of_frames
+            image_sequence.content_hash = folder.content_hash
+            image_sequences.append(image_sequence)
+        ImageSequence.objects.bulk_create(image_sequences)
+
+        # Primary keys are not set by bulk_create on all databases, thus get the image sequences again
+        ids = {(subject_id, format): id for subject_id, format, id in ImageSequence.objects
+               .filter(subject__dataset=self.dataset, format__in=[folder.format for subject_id, folder in sequences])
+               .values_list('subject_id', 'format', 'id')}
+        image_metadata = []
+        for (subject_id, folder), lines in zip(sequences, metadata):
+            for name, value in lines:
+                image_metadata.append(create_metadata(ids[(subject_id, folder.format)], name, value))
+        ImageMetadata.objects.bulk_create(image_metadata)
+
+
+class ScannedFolder:
+    """
+    A subject or image sequence folder, with the format and frames of its image sequence, if any
+    """
+
+    def __init__(self, path, modified, format='', start_frame_nr=0, nr_of_frames=0, error=''):
+        self.path = path
+        self.modified = modified
+        self.format = format
+        self.start_frame_nr = start_frame_nr
+        self.nr_of_frames = nr_of_frames
+        self.content_hash = ''
+        # Why the folder was skipped, it is scanned again by the next import
+        self.error = error
+
+
+class FolderScanner:
+    """
+    Scans folders, using the manifest of the last import for folders which have not been modified since.
+    Adding or removing files in a folder changes its modification time, while changing a file does not.
+    """
+
+    def __init__(self, manifest):
+        self.manifest = {entry.path: entry for entry in manifest}
+        self.subfolders = {}
+        for entry in self.manifest.values():
+            self.subfolders.setdefault(dirname(entry.path), []).append(entry.path)
+
+    def is_unchanged(self, path, modified):
+        return path in self.manifest and self.manifest[path].modified == modified
+
+    def scan_subject_folder(self, path):
+        """
+        :return ScannedFolder and list of paths of its subfolders:
+        """
+        # Get the modification time before listing, so that a later change is found by the next import
+        modified = os.stat(path).st_mtime_ns
+        if self.is_unchanged(path, modified):
+            return ScannedFolder(path, modified), self.subfolders.get(path, [])
+
+        return ScannedFolder(path, modified), [entry.path for entry in os.scandir(path) if entry.is_dir()]
+
+    def scan_sequence_folder(self, path):
+        """
+        Count the frames of an image sequence folder. Handle only monotype sequence: .mhd or .png frames,
+        or a single container file with all frames: 3D .mhd, multi-page .tif or .h5 file.
+        Container files are ignored in folders with .mhd or .png frames. Folders with several container files,
+        or a container file which can't be read, are skipped with an error.
+        :return ScannedFolder, with an empty format if there are no frames:
+        """
+        modified = os.stat(path).st_mtime_ns
+        if self.is_unchanged(path, modified):
+            entry = self.manifest[path]
+            return ScannedFolder(path, modified, entry.format, entry.start_frame_nr, entry.nr_of_frames)
+
+        filenames = []
+        containers = []
+        extension = None
+        name = ''
+        for entry in os.scandir(path):
+            if entry.name[-4:] in ('.mhd', '.png'):
+                filenames.append(entry.name)
+                name = entry.name[:entry.name.rfind('_')]
+                if extension is None or extension == entry.name[-4:]:
+                    extension = entry.name[-4:]
+                else:
+                    raise Exception('Found both mhd and png images in the same folder.')
+            elif os.path.splitext(entry.name)[1].lower() in CONTAINER_EXTENSIONS:
+                containers.append(entry.path)
+
+        try:
+            # A single .mhd file can be a 3D image with all frames
+            if len(filenames) == 1 and extension == '.mhd' and get_container_frames(join(path, filenames[0])) > 0:
+                containers = [join(path, filenames.pop())]
+
+            if len(filenames) == 0 and len(containers) > 0:
+                if len(containers) > 1:
+                    return ScannedFolder(path, modified, error='Skipped {}, found several files with all frames: {}'.format(
+                        path, ', '.join(sorted(basename(container) for container in containers))))
+                nr_of_frames = get_container_frames(containers[0])
+                if nr_of_frames == 0:
+                    return ScannedFolder(path, modified)
+                return ScannedFolder(path, modified, containers[0], 0, nr_of_frames)
+        except Exception as e:
+            # An unreadable file, e.g. an .h5 file without a dataset with frames, does not stop the import
+            return ScannedFolder(path, modified, error='Skipped {}, could not read its frames: {}'.format(path, e))
+
+        # Other files next to frames, e.g. a video of the sequence, are ignored
+        if len(filenames) == 0:
+            return ScannedFolder(path, modified)
+
+        format = join(path, name + '_#') + extension
+        start_frame_nr, nr_of_frames, missing_frames = get_frame_range(find_frame_numbers(filenames, format))
+        if start_frame_nr is None:
+            # Frames which do not match the format, e.g. zero padded frame numbers
+            return ScannedFolder(path, modified)
+
+        return ScannedFolder(path, modified, format, start_frame_nr, nr_of_frames)
+
+    def update_manifest(self, dataset, folders):
+        """
+        Store the scanned folders as the manifest of the next import. Must be called inside a transaction.
+        """
+        new_entries = []
+        changed_entries = []
+        for folder in folders:
+            if folder.error != '':
+                continue
+            entry = self.manifest.pop(folder.path, None)
+            if entry is None:
+                entry = ImportManifest(dataset=dataset, path=folder.path)
+                new_entries.append(entry)
+            elif (entry.modified, entry.format, entry.start_frame_nr, entry.nr_of_frames) != \
+                    (folder.modified, folder.format, folder.start_frame_nr, folder.nr_of_frames):
+                changed_entries.append(entry)
+            entry.modified = folder.modified
+            entry.format = folder.format
+            entry.start_frame_nr = folder.start_frame_nr
+            entry.nr_of_frames = folder.nr_of_frames
+
+        # Remaining entries are folders which have been removed
+        ImportManifest.objects.filter(id__in=[entry.id for entry in self.manifest.values()]).delete()
+        ImportManifest.objects.bulk_update(changed_entries, ['modified', 'format', 'start_frame_nr', 'nr_of_frames'])
+        ImportManifest.objects.bulk_create(new_entries)
+
@@ -1,3 +1,24 @@
-from django.test import TestCase
+from annotationweb.models import Task
+from annotationweb.testing import SaveAnnotationTestCase, get_frame_data
+from .models import Landmark
 
-# Create your tests here.
+
+class SaveLandmarksTests(SaveAnnotationTestCase):
+    task_type = Task.LANDMARK
+    save_view = 'landmark:save'
+
+    def save_landmarks(self, nr_of_frames, label_id=None):
+        # Two landmarks in each frame
+        landmark = {'x': 1, 'y': 2, 'label_id': label_id or self.label.id}
+        return self.save(nr_of_frames, landmarks=get_frame_data(nr_of_frames, [landmark, landmark]))
+
+    def test_query_count_is_independent_of_frame_count(self):
+        response, queries = self.save_landmarks(1)
+        self.assertEqual(response['success'], 'true')
+        self.assertEqual(self.save_landmarks(20)[1], queries)
+        self.assertEqual(Landmark.objects.count(), 42)
+
+    def test_unknown_label(self):
+        response, queries = self.save_landmarks(2, label_id=self.label.id + 100)
+        self.assertEqual(response['success'], 'false')
+        self.assertEqual(Landmark.objects.count(), 0)
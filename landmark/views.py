@@ -7,6 +7,7 @@ from django.http import HttpResponse, Http404, JsonResponse, HttpResponseRedirec
 import random
 import json
 import common.task
+from common.label import check_labels_exist
 from django.db import transaction
 
 
@@ -20,7 +21,8 @@ def process_image(request, task_id, image_id):
         context['javascript_files'] = ['landmark/landmark.js']
 
         # Load landmarks if they exist
-        context['landmarks'] = Landmark.objects.filter(image__image_annotation__image_id=image_id, image__image_annotation__task_id=task_id)
+        context['annotation_data'] = list(Landmark.objects.filter(image__image_annotation__image_id=image_id, image__image_annotation__task_id=task_id)
+                                          .values_list('x', 'y', 'label_id', 'image__frame_nr'))
 
         return render(request, 'landmark/process_image.html', context)
     except common.task.NoMoreImages:
@@ -38,7 +40,7 @@ def save(request):
 
             # Store every landmark
             landmarks = json.loads(request.POST['landmarks'])
-            counter = 0
+            new_landmarks = []
             for annotation in annotations:
                 frame_nr = str(annotation.frame_nr)
                 for landmark in landmarks[frame_nr]:
@@ -47,8 +49,10 @@ def save(request):
                     new_landmark.y = int(landmark['y'])
                     new_landmark.image = annotation
                     new_landmark.label_id = int(landmark['label_id'])
-                    new_landmark.save()
-                    counter += 1
+                    new_landmarks.append(new_landmark)
+            check_labels_exist({landmark.label_id for landmark in new_landmarks})
+            common.task.save_key_frame_rows(Landmark, annotations, new_landmarks, ['x', 'y', 'label'])
+            counter = len(new_landmarks)
 
             response = {
                 'success': 'true',
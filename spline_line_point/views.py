@@ -3,8 +3,8 @@ from django.contrib import messages
 from django.http import JsonResponse, HttpResponseRedirect
 from annotationweb.models import Task, KeyFrameAnnotation
 import common.task
+import common.control_points
 import json
-from spline_segmentation.models import *
 from django.db import transaction
 
 
@@ -20,8 +20,7 @@ def segment_image(request, task_id, image_id):
         # Check if image is already segmented, if so get data and pass to template
         try:
             annotations = KeyFrameAnnotation.objects.filter(image_annotation__task_id=task_id, image_annotation__image_id=image_id)
-            control_points = ControlPoint.objects.filter(image__in=annotations).order_by('index')
-            context['control_points'] = control_points
+            context['annotation_data'] = common.control_points.get_contour_data(annotations)
             context['target_frames'] = annotations
         except KeyFrameAnnotation.DoesNotExist:
             pass
@@ -48,22 +47,7 @@ def save_segmentation(request):
 
             # Save segmentation
             # Save control points
-            for annotation in annotations:
-                frame_nr = str(annotation.frame_nr)
-                for object in control_points[frame_nr]:
-                    nr_of_control_points = len(control_points[frame_nr][object]['control_points'])
-                    if nr_of_control_points < 1:
-                        continue
-                    for point in range(nr_of_control_points):
-                        control_point = ControlPoint()
-                        control_point.image = annotation
-                        control_point.x = float(control_points[frame_nr][object]['control_points'][point]['x'])
-                        control_point.y = float(control_points[frame_nr][object]['control_points'][point]['y'])
-                        control_point.index = point
-                        control_point.object = int(object)
-                        control_point.label = Label.objects.get(id=int(control_points[frame_nr][object]['label']['id']))
-                        control_point.uncertain = bool(control_points[frame_nr][object]['control_points'][point]['uncertain'])
-                        control_point.save()
+            common.control_points.save_control_points(annotations, control_points, 1)
 
             response = {
                 'success': 'true',
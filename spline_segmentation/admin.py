@@ -1,6 +1,6 @@
 from django.contrib import admin
-from .models import ControlPoint
+from .models import Contour
 
-admin.site.register(ControlPoint)
+admin.site.register(Contour)
 
 
@@ -0,0 +1,64 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from annotationweb.models import Dataset, Subject, Task, Label, ImageSequence, ImageAnnotation, KeyFrameAnnotation
+from common.control_points import save_control_points, pack_points
+from spline_segmentation.models import Contour
+
+
+class Command(BaseCommand):
+    help = 'Measure the latency of saving spline control points against the number of points. ' \
+           'All data is created inside a transaction which is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, nargs='+', default=[1, 5, 10, 30])
+        parser.add_argument('--objects', type=int, default=3)
+        parser.add_argument('--points', type=int, default=20, help='Control points per object')
+
+    def handle(self, *args, **options):
+        self.stdout.write('frames  points  bulk (ms)  row by row (ms)')
+        for nr_of_frames in options['frames']:
+            bulk = self.measure(nr_of_frames, options['objects'], options['points'], self.save_bulk)
+            row_by_row = self.measure(nr_of_frames, options['objects'], options['points'], self.save_row_by_row)
+            nr_of_points = nr_of_frames*options['objects']*options['points']
+            self.stdout.write('{:6d}  {:6d}  {:9.1f}  {:15.1f}'.format(nr_of_frames, nr_of_points, bulk*1000, row_by_row*1000))
+
+    def measure(self, nr_of_frames, nr_of_objects, nr_of_points, save):
+        with transaction.atomic():
+            label = Label.objects.create(name='Benchmark')
+            user = User.objects.create(username='benchmark_control_points')
+            subject = Subject.objects.create(name='Benchmark', dataset=Dataset.objects.create(name='Benchmark'))
+            task = Task.objects.create(name='Benchmark', type=Task.SPLINE_SEGMENTATION)
+            image = ImageSequence.objects.create(format='benchmark_#.png', subject=subject, nr_of_frames=nr_of_frames)
+            annotation = ImageAnnotation.objects.create(image=image, task=task, user=user, rejected=False)
+            frames = [KeyFrameAnnotation.objects.create(image_annotation=annotation, frame_nr=i) for i in range(nr_of_frames)]
+            control_points = {
+                str(i): {
+                    str(object): {
+                        'label': {'id': label.id},
+                        'control_points': [{'x': j, 'y': j, 'uncertain': False} for j in range(nr_of_points)]
+                    } for object in range(nr_of_objects)
+                } for i in range(nr_of_frames)
+            }
+
+            start = time.perf_counter()
+            save(frames, control_points)
+            duration = time.perf_counter() - start
+
+            transaction.set_rollback(True)
+        return duration
+
+    def save_bulk(self, frames, control_points):
+        save_control_points(frames, control_points, 1)
+
+    def save_row_by_row(self, frames, control_points):
+        # A label query and an insert for each object
+        for frame in frames:
+            for object, object_data in control_points[str(frame.frame_nr)].items():
+                contour = Contour()
+                contour.image = frame
+                contour.object = int(object)
+                contour.label = Label.objects.get(id=object_data['label']['id'])
+                contour.points = pack_points([(point['x'], point['y'], point['uncertain']) for point in object_data['control_points']])
+                contour.save()
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spline_segmentation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='controlpoint',
+            index=models.Index(fields=['image', 'label', 'object', 'index'], name='spline_segm_image_i_f0be7c_idx'),
+        ),
+    ]
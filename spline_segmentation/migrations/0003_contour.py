@@ -0,0 +1,63 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+from itertools import groupby
+import numpy as np
+
+
+def pack_control_points(apps, schema_editor):
+    ControlPoint = apps.get_model('spline_segmentation', 'ControlPoint')
+    Contour = apps.get_model('spline_segmentation', 'Contour')
+    rows = ControlPoint.objects.order_by('image_id', 'object', 'index')\
+        .values_list('image_id', 'object', 'label_id', 'x', 'y', 'uncertain')
+    contours = []
+    for (image_id, object), group in groupby(rows.iterator(), key=lambda row: (row[0], row[1])):
+        group = list(group)
+        points = np.asarray([(row[3], row[4], row[5]) for row in group], dtype=np.float32).tobytes()
+        contours.append(Contour(image_id=image_id, object=object, label_id=group[0][2], points=points))
+        if len(contours) >= 1000:
+            Contour.objects.bulk_create(contours)
+            contours = []
+    Contour.objects.bulk_create(contours)
+
+
+def unpack_control_points(apps, schema_editor):
+    ControlPoint = apps.get_model('spline_segmentation', 'ControlPoint')
+    Contour = apps.get_model('spline_segmentation', 'Contour')
+    for contour in Contour.objects.iterator():
+        points = np.frombuffer(contour.points, dtype=np.float32).reshape((-1, 3))
+        ControlPoint.objects.bulk_create([
+            ControlPoint(image_id=contour.image_id, object=contour.object, label_id=contour.label_id, index=index,
+                         x=float(x), y=float(y), uncertain=bool(uncertain))
+            for index, (x, y, uncertain) in enumerate(points)
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotationweb', '0011_imageannotation_version'),
+        ('spline_segmentation', '0002_auto_20261019_0616'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Contour',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object', models.PositiveIntegerField()),
+                ('points', models.BinaryField(help_text='float32 array of x, y and uncertain for each control point')),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='annotationweb.KeyFrameAnnotation')),
+                ('label', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='annotationweb.Label')),
+            ],
+        ),
+        migrations.RunPython(pack_control_points, unpack_control_points),
+        migrations.DeleteModel(
+            name='ControlPoint',
+        ),
+        migrations.AddIndex(
+            model_name='contour',
+            index=models.Index(fields=['image', 'object'], name='spline_segm_image_i_dd6a56_idx'),
+        ),
+    ]
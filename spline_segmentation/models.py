@@ -2,11 +2,16 @@ from django.db import models
 from annotationweb.models import KeyFrameAnnotation, Label
 
 
-class ControlPoint(models.Model):
+class Contour(models.Model):
+    """
+    The control points of one object in a key frame. Use the helpers in common.control_points to read and write points.
+    """
     image = models.ForeignKey(KeyFrameAnnotation, on_delete=models.CASCADE)
-    x = models.FloatField()
-    y = models.FloatField()
-    index = models.PositiveIntegerField()
     label = models.ForeignKey(Label, on_delete=models.CASCADE)
     object = models.PositiveIntegerField()
-    uncertain = models.BooleanField()
+    points = models.BinaryField(help_text='float32 array of x, y and uncertain for each control point')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['image', 'object']),
+        ]
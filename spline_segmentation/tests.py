@@ -1,3 +1,227 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import PIL.Image
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
+from annotationweb.models import *
+from annotationweb.tests import QueryPlanTestCase
+from common.control_points import save_control_points, get_contour_data, get_control_points, pack_points, unpack_points
+from exporters.cardiac_plax_point_exporter import CardiacPLAXPointExporter
+from .models import Contour
 
-# Create your tests here.
+
+class ContourQueryPlanTests(QueryPlanTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='annotater')
+        dataset = Dataset.objects.create(name='Dataset')
+        subject = Subject.objects.create(name='Subject', dataset=dataset)
+        cls.task = Task.objects.create(name='Task', type=Task.SPLINE_SEGMENTATION)
+        cls.label = Label.objects.create(name='Label')
+        cls.image = ImageSequence.objects.create(format='/data/frame_#.png', subject=subject, nr_of_frames=10)
+        annotation = ImageAnnotation.objects.create(image=cls.image, task=cls.task, user=user,
+                                                    image_quality=ImageAnnotation.QUALITY_OK, comments='',
+                                                    rejected=False)
+        cls.frame = KeyFrameAnnotation.objects.create(image_annotation=annotation, frame_nr=0)
+
+    def test_contour_of_object(self):
+        queryset = Contour.objects.filter(image=self.frame, object=0)
+        self.assertUsesIndex(queryset, 'spline_segmentation_contour')
+
+    def test_contours_of_image(self):
+        annotations = KeyFrameAnnotation.objects.filter(image_annotation__task=self.task,
+                                                        image_annotation__image=self.image)
+        queryset = Contour.objects.filter(image__in=annotations)
+        self.assertUsesIndex(queryset, 'spline_segmentation_contour')
+
+
+class SaveControlPointsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='annotater')
+        subject = Subject.objects.create(name='Subject', dataset=Dataset.objects.create(name='Dataset'))
+        task = Task.objects.create(name='Task', type=Task.SPLINE_SEGMENTATION)
+        cls.label = Label.objects.create(name='Label')
+        image = ImageSequence.objects.create(format='/data/frame_#.png', subject=subject, nr_of_frames=10)
+        annotation = ImageAnnotation.objects.create(image=image, task=task, user=user,
+                                                    image_quality=ImageAnnotation.QUALITY_OK, comments='',
+                                                    rejected=False)
+        cls.frames = [KeyFrameAnnotation.objects.create(image_annotation=annotation, frame_nr=i) for i in range(2)]
+
+    def create_payload(self, nr_of_points, label_id=None):
+        return {
+            str(frame.frame_nr): {
+                str(object): {
+                    'label': {'id': label_id or self.label.id},
+                    'control_points': [{'x': i, 'y': 2*i, 'uncertain': i == 0} for i in range(nr_of_points)],
+                } for object in range(3)
+            } for frame in self.frames
+        }
+
+    def test_query_count_is_independent_of_point_count(self):
+        for nr_of_points in (3, 20):
+            # Checking the labels, getting the stored contours and one bulk insert or update
+            with self.assertNumQueries(3):
+                save_control_points(self.frames, self.create_payload(nr_of_points), 3)
+
+    def test_saved_points(self):
+        self.assertEqual(save_control_points(self.frames, self.create_payload(4), 3), 6)
+        label, points = get_control_points(self.frames[1])[2]
+        self.assertEqual(label, self.label)
+        self.assertEqual([(p.x, p.y, p.uncertain) for p in points],
+                         [(0, 0, True), (1, 2, False), (2, 4, False), (3, 6, False)])
+
+    def test_get_contour_data(self):
+        save_control_points(self.frames, self.create_payload(4), 3)
+        with self.assertNumQueries(1):
+            contours = get_contour_data(self.frames)
+        self.assertEqual([contour[:3] for contour in contours],
+                         [[frame, object, self.label.id] for frame in range(2) for object in range(3)])
+        self.assertEqual(contours[0][3], [0, 0, 1, 1, 2, 0, 2, 4, 0, 3, 6, 0])
+
+    def test_pack_points(self):
+        points = unpack_points(pack_points([(1.5, 2.25, True), (3, 4, False)]))
+        self.assertEqual([(p.x, p.y, p.uncertain) for p in points], [(1.5, 2.25, True), (3, 4, False)])
+        self.assertEqual(unpack_points(pack_points([])), [])
+
+    def test_too_few_points_are_skipped(self):
+        self.assertEqual(save_control_points(self.frames, self.create_payload(2), 3), 0)
+
+    def test_unknown_label(self):
+        with self.assertRaises(Label.DoesNotExist):
+            save_control_points(self.frames, self.create_payload(4, label_id=self.label.id + 100), 3)
+        self.assertEqual(Contour.objects.count(), 0)
+
+
+class AutosaveTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='annotater')
+        subject = Subject.objects.create(name='Subject', dataset=Dataset.objects.create(name='Dataset'))
+        cls.task = Task.objects.create(name='Task', type=Task.SPLINE_SEGMENTATION)
+        cls.label = Label.objects.create(name='Label')
+        cls.image = ImageSequence.objects.create(format='/data/frame_#.png', subject=subject, nr_of_frames=10)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def autosave(self, version, frames):
+        return self.client.patch(reverse('spline_segmentation:autosave'), json.dumps({
+            'task_id': self.task.id,
+            'image_id': self.image.id,
+            'version': version,
+            'frames': frames,
+        }), content_type='application/json')
+
+    def create_object(self, nr_of_points):
+        return {'label': {'id': self.label.id}, 'control_points': [{'x': i, 'y': i, 'uncertain': False} for i in range(nr_of_points)]}
+
+    def get_point_counts(self):
+        return {(frame_nr, object): len(points) // 3 for frame_nr, object, label_id, points in
+                get_contour_data(KeyFrameAnnotation.objects.all())}
+
+    def test_changes_are_applied(self):
+        response = self.autosave(0, {'1': {'0': self.create_object(3), '1': self.create_object(2)}})
+        self.assertEqual(response.json()['version'], 1)
+        annotation = ImageAnnotation.objects.get(task=self.task, image=self.image)
+        self.assertFalse(annotation.finished)
+
+        response = self.autosave(1, {'1': {'1': None, '0': self.create_object(5)}, '4': {'0': self.create_object(1)}})
+        self.assertEqual(response.json()['version'], 2)
+        self.assertEqual(self.get_point_counts(), {(1, 0): 5, (4, 0): 1})
+
+        # Unchanged objects are kept
+        self.autosave(2, {'1': {'2': self.create_object(2)}, '4': None})
+        self.assertEqual(self.get_point_counts(), {(1, 0): 5, (1, 2): 2})
+
+    def test_version_conflict(self):
+        self.autosave(0, {'1': {'0': self.create_object(3)}})
+        self.autosave(1, {'1': {'0': self.create_object(4)}})
+
+        response = self.autosave(1, {'1': {'0': None}})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['version'], 2)
+        self.assertEqual(self.get_point_counts(), {(1, 0): 4})
+
+    def test_must_use_patch(self):
+        response = self.client.post(reverse('spline_segmentation:autosave'))
+        self.assertEqual(response.status_code, 405)
+
+
+class SegmentImageTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='annotater')
+        subject = Subject.objects.create(name='Subject', dataset=Dataset.objects.create(name='Dataset'))
+        cls.task = Task.objects.create(name='Task', type=Task.SPLINE_SEGMENTATION, user_frame_selection=True)
+        cls.label = Label.objects.create(name='Label')
+        cls.task.label.add(cls.label)
+        cls.image = ImageSequence.objects.create(format='/data/frame_#.png', subject=subject, nr_of_frames=10)
+        annotation = ImageAnnotation.objects.create(image=cls.image, task=cls.task, user=cls.user,
+                                                    image_quality=ImageAnnotation.QUALITY_OK, comments='',
+                                                    rejected=False)
+        cls.frame = KeyFrameAnnotation.objects.create(image_annotation=annotation, frame_nr=3)
+
+    def test_existing_contours_are_sent_as_json(self):
+        save_control_points([self.frame], {'3': {'0': {
+            'label': {'id': self.label.id},
+            'control_points': [{'x': i + 0.5, 'y': i, 'uncertain': False} for i in range(100)],
+        }}}, 1)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('spline_segmentation:segment_image', args=[self.task.id, self.image.id]))
+        self.assertContains(response, '<script id="annotationData" type="application/json">')
+        self.assertContains(response, 'loadControlPoints(getAnnotationData());')
+        self.assertNotContains(response, 'addControlPoint(')
+        self.assertEqual(len(response.context['annotation_data'][0][3]), 300)
+
+
+class CardiacPLAXPointExporterTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        sequence_dir = os.path.join(self.directory.name, 'Data', 'Sequence')
+        os.makedirs(sequence_dir)
+        PIL.Image.new('L', (20, 10)).save(os.path.join(sequence_dir, 'frame_3.png'))
+
+        user = User.objects.create(username='annotater')
+        self.subject = Subject.objects.create(name='Subject', dataset=Dataset.objects.create(name='Dataset'))
+        self.task = Task.objects.create(name='Task', type=Task.CARDIAC_PLAX_SEGMENTATION)
+        self.task.dataset.add(self.subject.dataset)
+        self.labels = [Label.objects.create(name='Label ' + str(object)) for object in range(6)]
+        image = ImageSequence.objects.create(format=os.path.join(sequence_dir, 'frame_#.png'), subject=self.subject, nr_of_frames=10)
+        annotation = ImageAnnotation.objects.create(image=image, task=self.task, user=user,
+                                                    image_quality=ImageAnnotation.QUALITY_OK, comments='',
+                                                    rejected=False)
+        frame = KeyFrameAnnotation.objects.create(image_annotation=annotation, frame_nr=3)
+        save_control_points([frame], {'3': {str(object): {
+            'label': {'id': self.labels[object].id},
+            'control_points': [{'x': object, 'y': i, 'uncertain': False} for i in range(4)],
+        } for object in range(6)}}, 1)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_labels_are_exported(self):
+        path = os.path.join(self.directory.name, 'Export')
+        exporter = CardiacPLAXPointExporter()
+        exporter.task = self.task
+        form = exporter.get_form({'path': path, 'subjects': [self.subject.id]})
+        self.assertTrue(form.is_valid())
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(exporter.export(form), (True, path))
+
+        with open(os.path.join(path, 'Dataset', 'Subject', 'Sequence', 'frame_3_points.txt'), 'r') as f:
+            lines = f.read().splitlines()
+        self.assertEqual([line for line in lines if line.startswith('# Label')],
+                         ['# Label: Label ' + str(object) for object in range(6)])
+        # The LA (2) starts and ends at the endpoints of the LV (0)
+        start = lines.index('# Label: Label 2')
+        self.assertEqual(lines[start + 1:start + 7], ['0.0 3.0', '2.0 0.0', '2.0 1.0', '2.0 2.0', '2.0 3.0', '0.0 0.0'])
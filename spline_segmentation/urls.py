@@ -7,4 +7,5 @@ urlpatterns = [
     path('segment-image/<int:task_id>/<int:image_id>/', views.segment_image, name='segment_image'),
     path('show/<int:task_id>/<int:image_id>/', views.show_segmentation, name='show_segmentation'),
     path('save/', views.save_segmentation, name='save'),
+    path('autosave/', views.autosave_segmentation, name='autosave'),
 ]
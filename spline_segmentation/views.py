@@ -3,10 +3,20 @@ from django.contrib import messages
 from django.http import JsonResponse, HttpResponseRedirect
 from annotationweb.models import Task, KeyFrameAnnotation
 import common.task
+import common.control_points
 import json
 from .models import *
 from django.db import transaction
 
+# Task types which store their segmentation as control points
+CONTROL_POINT_TASKS = (
+    Task.SPLINE_SEGMENTATION,
+    Task.SPLINE_LINE_POINT,
+    Task.CARDIAC_SEGMENTATION,
+    Task.CARDIAC_PLAX_SEGMENTATION,
+    Task.CARDIAC_ALAX_SEGMENTATION,
+)
+
 
 def segment_next_image(request, task_id):
     return segment_image(request, task_id, None)
@@ -20,8 +30,7 @@ def segment_image(request, task_id, image_id):
         # Check if image is already segmented, if so get data and pass to template
         try:
             annotations = KeyFrameAnnotation.objects.filter(image_annotation__task_id=task_id, image_annotation__image_id=image_id)
-            control_points = ControlPoint.objects.filter(image__in=annotations).order_by('index')
-            context['control_points'] = control_points
+            context['annotation_data'] = common.control_points.get_contour_data(annotations)
             context['target_frames'] = annotations
         except KeyFrameAnnotation.DoesNotExist:
             pass
@@ -48,22 +57,7 @@ def save_segmentation(request):
 
             # Save segmentation
             # Save control points
-            for annotation in annotations:
-                frame_nr = str(annotation.frame_nr)
-                for object in control_points[frame_nr]:
-                    nr_of_control_points = len(control_points[frame_nr][object]['control_points'])
-                    if nr_of_control_points < 3:
-                        continue
-                    for point in range(nr_of_control_points):
-                        control_point = ControlPoint()
-                        control_point.image = annotation
-                        control_point.x = float(control_points[frame_nr][object]['control_points'][point]['x'])
-                        control_point.y = float(control_points[frame_nr][object]['control_points'][point]['y'])
-                        control_point.index = point
-                        control_point.object = int(object)
-                        control_point.label = Label.objects.get(id=int(control_points[frame_nr][object]['label']['id']))
-                        control_point.uncertain = bool(control_points[frame_nr][object]['control_points'][point]['uncertain'])
-                        control_point.save()
+            common.control_points.save_control_points(annotations, control_points, 3)
 
             response = {
                 'success': 'true',
@@ -79,5 +73,31 @@ def save_segmentation(request):
     return JsonResponse(response)
 
 
+def autosave_segmentation(request):
+    """
+    Store the changes of a segmentation in progress, for all tasks which use control points.
+    Expects a PATCH request with a JSON body:
+    {"task_id": .., "image_id": .., "version": .., "frames": {frame_nr: {object: {"label": .., "control_points": [..]}}}}
+    Only the given objects are replaced, an object or frame set to null is deleted.
+    If the annotation was saved by someone else since the given version, nothing is stored and status 409 is returned.
+    """
+    if request.method != 'PATCH':
+        return JsonResponse({'success': 'false', 'message': 'Must use PATCH when autosaving.'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        task = Task.objects.get(pk=int(data['task_id']), type__in=CONTROL_POINT_TASKS)
+        with transaction.atomic():
+            version, key_frames = common.task.autosave_annotation(
+                request, task.id, int(data['image_id']), int(data['version']), [int(frame_nr) for frame_nr in data['frames']])
+            common.control_points.update_control_points(key_frames, data['frames'])
+    except common.task.AnnotationChanged as e:
+        return JsonResponse({'success': 'false', 'message': str(e), 'version': e.version}, status=409)
+    except Exception as e:
+        return JsonResponse({'success': 'false', 'message': str(e)}, status=400)
+
+    return JsonResponse({'success': 'true', 'message': 'Annotation autosaved', 'version': version})
+
+
 def show_segmentation(request, task_id, image_id):
     pass